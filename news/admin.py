@@ -1,7 +1,12 @@
+from uuid import uuid4
+
 from django.contrib import admin, messages
 
-from news.models import (APIUser, BlockedEmail, FailedTask, Interest, LocaleStewards, Newsletter,
-                         NewsletterGroup, SMSMessage, Subscriber)
+from news.models import (APIUser, BlockedEmail, FailedTask, FailedTaskName, Interest,
+                         LocaleStewards, Newsletter, NewsletterGroup, SMSMessage, SpooledWrite,
+                         Subscriber)
+from news.replay import REPLAY_BATCH_SIZE, batch_delay
+from news.tasks import replay_failed_tasks
 
 
 class SMSMessageAdmin(admin.ModelAdmin):
@@ -65,8 +70,7 @@ class TaskNameFilter(admin.SimpleListFilter):
     parameter_name = 'name'
 
     def lookups(self, request, model_admin):
-        qs = model_admin.queryset(request)
-        names = qs.values_list('name', flat=True).distinct().order_by('name')
+        names = FailedTaskName.objects.values_list('name', flat=True).order_by('name')
         return [(name, name.rsplit('.', 1)[1].replace('_', ' ')) for name in names]
 
     def queryset(self, request, queryset):
@@ -81,18 +85,32 @@ class FailedTaskAdmin(admin.ModelAdmin):
     list_filter = (TaskNameFilter,)
     search_fields = ('name', 'exc')
     date_hierarchy = 'when'
+    # not a select of every TaskTraceback
+    raw_id_fields = ('traceback',)
     actions = ['retry_task_action']
 
     def retry_task_action(self, request, queryset):
         """Admin action to retry some tasks that have failed previously"""
-        count = 0
-        for old_task in queryset:
-            old_task.retry()
-            count += 1
-        messages.info(request, "Queued %d task%s to try again" % (count, '' if count == 1 else 's'))
+        ids = list(queryset.order_by('id').values_list('id', flat=True))
+        # a task for each batch, so no message carries, or query filters
+        # on, more ids than a batch, one batch's time apart
+        run_id = uuid4().hex
+        for start in range(0, len(ids), REPLAY_BATCH_SIZE):
+            replay_failed_tasks.apply_async(
+                kwargs={'ids': ids[start:start + REPLAY_BATCH_SIZE], 'run_id': run_id},
+                countdown=start * batch_delay(1))
+        count = len(ids)
+        messages.info(request, "Retrying %d task%s in the background" % (count, '' if count == 1 else 's'))
     retry_task_action.short_description = u"Retry task(s)"
 
 
+class SpooledWriteAdmin(admin.ModelAdmin):
+    list_display = ('when', 'kind', 'target', 'key')
+    list_filter = ('kind',)
+    search_fields = ('target', 'key')
+    date_hierarchy = 'when'
+
+
 admin.site.register(SMSMessage, SMSMessageAdmin)
 admin.site.register(APIUser, APIUserAdmin)
 admin.site.register(BlockedEmail, BlockedEmailAdmin)
@@ -100,4 +118,5 @@ admin.site.register(FailedTask, FailedTaskAdmin)
 admin.site.register(Interest, InterestAdmin)
 admin.site.register(Newsletter, NewsletterAdmin)
 admin.site.register(NewsletterGroup, NewsletterGroupAdmin)
+admin.site.register(SpooledWrite, SpooledWriteAdmin)
 admin.site.register(Subscriber, SubscriberAdmin)
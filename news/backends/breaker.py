@@ -0,0 +1,124 @@
+"""
+Circuit breaker for calls to ExactTarget.
+
+When ET is down, every call to it waits for the full timeout and fails
+anyway. The breaker notices repeated failures of an operation and then
+fails further calls to it straight away for a while, instead of making
+them.
+
+There is a breaker per operation (the SOAP Retrieve, Update, Create and
+Delete calls, and REST), and its state is kept in the Django cache so
+it's shared by every web and celery process:
+
+* closed: calls are made as usual. If EXACTTARGET_BREAKER_THRESHOLD of
+  them fail within EXACTTARGET_BREAKER_WINDOW seconds, it opens.
+* open: calls raise CircuitOpenException without talking to ET, for
+  EXACTTARGET_BREAKER_RESET seconds.
+* half-open: after that, one call at a time is let through to see if
+  ET is back. If it works the breaker closes, otherwise it opens again.
+
+The state of each breaker is sent to statsd as the gauge
+news.et_breaker.<operation>.state (0 closed, 1 half-open, 2 open).
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from django_statsd.clients import statsd
+
+from .common import CircuitOpenException
+
+
+log = logging.getLogger(__name__)
+
+BREAKER_THRESHOLD = getattr(settings, 'EXACTTARGET_BREAKER_THRESHOLD', 5)
+BREAKER_WINDOW = getattr(settings, 'EXACTTARGET_BREAKER_WINDOW', 60)
+BREAKER_RESET = getattr(settings, 'EXACTTARGET_BREAKER_RESET', 60)
+# How long a half-open probe call may hold its slot before another
+# caller gets to try.
+BREAKER_PROBE_TIMEOUT = getattr(settings, 'EXACTTARGET_BREAKER_PROBE_TIMEOUT', 30)
+
+CLOSED = 0
+HALF_OPEN = 1
+OPEN = 2
+
+# HTTP statuses that mean ET or its proxies are struggling, rather than
+# answering with an error
+FAILURE_STATUSES = (502, 503, 504)
+
+
+class CircuitBreaker(object):
+    """The breaker for the ET operation ``op``.
+
+    Callers use it like::
+
+        state = breaker.before_call()
+        try:
+            ...
+        except SomeError:
+            breaker.failure(state)
+            raise
+        breaker.success(state)
+    """
+    def __init__(self, op):
+        self.op = op
+        key = 'et-breaker:%s' % op
+        self.opened_key = key + ':opened'
+        self.failures_key = key + ':failures'
+        self.probe_key = key + ':probe'
+
+    def before_call(self):
+        """Return the breaker's state, raising CircuitOpenException if the
+        call shouldn't be made."""
+        opened = cache.get(self.opened_key)
+        if opened is None:
+            return CLOSED
+
+        wait = opened + BREAKER_RESET - time.time()
+        if wait > 0 or not cache.add(self.probe_key, 1, BREAKER_PROBE_TIMEOUT):
+            statsd.incr('news.et_breaker.%s.rejected' % self.op)
+            raise CircuitOpenException(self.op, max(wait, 0) or BREAKER_RESET)
+
+        self.gauge(HALF_OPEN)
+        return HALF_OPEN
+
+    def success(self, state):
+        if state == HALF_OPEN:
+            cache.delete_many([self.opened_key, self.failures_key,
+                               self.probe_key])
+            log.info('ET circuit breaker for %s closed' % self.op)
+            self.gauge(CLOSED)
+
+    def release(self, state):
+        """End a call that says nothing about whether ET is working, like
+        one cut short by the request's deadline."""
+        if state == HALF_OPEN:
+            cache.delete(self.probe_key)
+
+    def failure(self, state):
+        if state == HALF_OPEN:
+            cache.delete(self.probe_key)
+            self.open()
+            return
+
+        cache.add(self.failures_key, 0, BREAKER_WINDOW)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:
+            # expired between the add and the incr
+            failures = 1
+        if failures >= BREAKER_THRESHOLD:
+            self.open()
+
+    def open(self):
+        # Kept long enough to outlast any outage we'd want to wait out;
+        # if it expires the breaker is just closed again.
+        cache.set(self.opened_key, time.time(), 60 * 60)
+        log.warn('ET circuit breaker for %s opened' % self.op)
+        statsd.incr('news.et_breaker.%s.opened' % self.op)
+        self.gauge(OPEN)
+
+    def gauge(self, state):
+        statsd.gauge('news.et_breaker.%s.state' % self.op, state)
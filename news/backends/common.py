@@ -1,4 +1,7 @@
 
+from basket import errors
+
+
 class UnauthorizedException(Exception):
     """Failure to log into the email server."""
     pass
@@ -19,3 +22,36 @@ class NewsletterNoResultsException(NewsletterException):
     didn't report any errors)
     """
     pass
+
+
+class ServiceBusyException(NewsletterException):
+    """
+    The email server can't take calls of kind ``op`` right now, but might
+    in ``retry_after`` seconds.
+    """
+    message = 'Email service provider %s calls are unavailable'
+
+    def __init__(self, op, retry_after):
+        self.op = op
+        self.retry_after = retry_after
+        super(ServiceBusyException, self).__init__(
+            self.message % op, error_code=errors.BASKET_NETWORK_FAILURE)
+
+    def __reduce__(self):
+        return self.__class__, (self.op, self.retry_after)
+
+
+class CircuitOpenException(ServiceBusyException):
+    """
+    Calls of this kind to the email server have been failing, so we're not
+    trying them for a while (see backends.breaker).
+    """
+    message = 'Email service provider %s calls are failing'
+
+
+class RateLimitedException(ServiceBusyException):
+    """
+    We've used up our quota of calls of this kind to the email server for
+    now (see backends.throttle).
+    """
+    message = 'Email service provider %s rate limit reached'
@@ -0,0 +1,131 @@
+"""
+Request-scoped deadlines for calls to ExactTarget.
+
+Synchronous views can call ET several times in a row, and each call gets
+the full EXACTTARGET_TIMEOUT. Running a view inside `et_deadline` gives
+the whole request a single budget instead. Every ET call made while the
+deadline is active uses the time that's left as its timeout, and once
+the budget is used up the calls fail straight away with
+BASKET_NETWORK_FAILURE instead of tying up the web worker.
+
+The number of ET calls made under each deadline, and the time spent in
+them, are sent to statsd when the deadline ends.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+
+from basket import errors
+from django_statsd.clients import statsd
+
+from news.tracing import span
+
+from .common import NewsletterException
+
+
+# Seconds a request may spend talking to ET in total.
+ET_REQUEST_BUDGET = getattr(settings, 'EXACTTARGET_REQUEST_BUDGET', 8)
+MSG_DEADLINE_EXCEEDED = 'Timed out talking to the email service provider'
+
+_local = threading.local()
+
+
+class Deadline(object):
+    def __init__(self, name, seconds):
+        self.name = name
+        self.expires = time.time() + seconds
+        self.calls = 0
+        self.call_time = 0.0
+
+    def remaining(self):
+        return self.expires - time.time()
+
+
+def current_deadline():
+    """Return the Deadline active in this thread, or None."""
+    return getattr(_local, 'deadline', None)
+
+
+def deadline_exceeded():
+    return NewsletterException(MSG_DEADLINE_EXCEEDED,
+                               error_code=errors.BASKET_NETWORK_FAILURE,
+                               status_code=400)
+
+
+@contextmanager
+def et_deadline(name, seconds=None):
+    """
+    Limit the ET calls made inside the block to ``seconds`` in total
+    (EXACTTARGET_REQUEST_BUDGET by default). ``name`` is used for the
+    statsd metrics.
+
+    If a deadline is already active, e.g. a view inside the `logged_in`
+    decorator, it's kept, so the budget covers the whole request.
+    """
+    deadline = current_deadline()
+    if deadline is not None:
+        yield deadline
+        return
+
+    if seconds is None:
+        seconds = ET_REQUEST_BUDGET
+    deadline = Deadline(name, seconds)
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = None
+        prefix = 'news.et_deadline.%s' % name
+        statsd.timing(prefix + '.calls', deadline.calls)
+        statsd.timing(prefix + '.time', int(deadline.call_time * 1000))
+
+
+def with_et_deadline(view):
+    """Decorator to run a view inside an `et_deadline` named after it."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with et_deadline(view.__name__):
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def et_call_timeout(default):
+    """
+    Return the timeout to use for an ET call about to be made: ``default``,
+    or the time left before the current deadline if that's shorter.
+
+    Raises NewsletterException if the deadline has already passed.
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return default
+
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        statsd.incr('news.et_deadline.%s.exceeded' % deadline.name)
+        raise deadline_exceeded()
+    if default is None:
+        return remaining
+    return min(default, remaining)
+
+
+@contextmanager
+def et_call(name='ET'):
+    """
+    Count an ET call made inside the block against the current deadline.
+
+    The call is also traced as a span named ``name``, which is yielded so
+    its size can be set.
+    """
+    start = time.time()
+    try:
+        with span('et', name) as call:
+            yield call
+    finally:
+        deadline = current_deadline()
+        if deadline is not None:
+            deadline.calls += 1
+            deadline.call_time += time.time() - start
@@ -17,7 +17,10 @@ et.trigger_send('WelcomeEmail', 'jlong@mozilla.com', 'hello', 'H')
 """
 
 import os
+import socket
+import urllib2
 from functools import wraps
+from urlparse import urlparse
 
 from django.conf import settings
 from django.core.cache import cache
@@ -25,14 +28,21 @@ from django.core.cache import cache
 from suds import WebFault
 from suds.cache import Cache
 from suds.client import Client
+from suds.transport import TransportError
 from suds.transport.https import HttpAuthenticated
 from suds.wsse import Security, UsernameToken
 
+from .breaker import FAILURE_STATUSES, CircuitBreaker
 from .common import NewsletterException, NewsletterNoResultsException, \
     UnauthorizedException
+from .deadline import current_deadline, deadline_exceeded, et_call, \
+    et_call_timeout
+from .throttle import wait_for_capacity
 
 
 ET_TIMEOUT = getattr(settings, 'EXACTTARGET_TIMEOUT', 5)
+# Base URL of a stand-in for ET to use instead, e.g. a backends.fake_et server
+ET_FAKE_URL = getattr(settings, 'EXACTTARGET_FAKE_URL', None)
 
 
 class SudsDjangoCache(Cache):
@@ -58,6 +68,75 @@ class SudsDjangoCache(Cache):
         cache.delete(self._cache_key(id))
 
 
+class ETTransport(HttpAuthenticated):
+    """
+    suds transport that puts every SOAP call behind the rate limit and
+    circuit breaker for its operation (see backends.throttle and
+    backends.breaker), and cuts its timeout short to fit in the current
+    request's ET deadline, if there is one (see backends.deadline).
+
+    The client and its transport are shared by every thread, so the
+    timeout is worked out per call rather than stored in the options.
+    """
+    def send(self, request):
+        # fail now if the deadline has passed, before it counts as a call
+        timeout = et_call_timeout(self.options.timeout)
+        # then a timeout is the deadline's doing, not ET's
+        cut_short = timeout != self.options.timeout
+        op = soap_operation(request)
+        wait_for_capacity(op)
+        breaker = CircuitBreaker(op)
+        state = breaker.before_call()
+        with et_call(op) as call:
+            try:
+                reply = HttpAuthenticated.send(self, request)
+                call.size = len(request.message or '') + len(reply.message or '')
+            except Exception as e:
+                if is_timeout(e) and cut_short:
+                    breaker.release(state)
+                elif is_et_failure(e):
+                    breaker.failure(state)
+                else:
+                    breaker.success(state)
+                if is_timeout(e) and current_deadline() is not None:
+                    raise deadline_exceeded()
+                raise
+        breaker.success(state)
+        return reply
+
+    def open(self, request):
+        if ET_FAKE_URL and request.url.startswith('http'):
+            # the schemas the WSDL imports come from the stand-in too
+            request.url = ET_FAKE_URL.rstrip('/') + urlparse(request.url).path
+        return HttpAuthenticated.open(self, request)
+
+    def u2open(self, u2request):
+        timeout = et_call_timeout(self.options.timeout)
+        return self.u2opener().open(u2request, timeout=timeout)
+
+
+def soap_operation(request):
+    """Return the name of the SOAP operation (e.g. 'Retrieve') a suds
+    transport request is for."""
+    return request.headers.get('SOAPAction', '').strip('"') or 'SOAP'
+
+
+def is_timeout(e):
+    return (isinstance(e, socket.timeout) or
+            isinstance(getattr(e, 'reason', None), socket.timeout))
+
+
+def is_et_failure(e):
+    """
+    Whether an exception from the transport means ET isn't working, as
+    opposed to it answering with an error. SOAP faults come back as a 500,
+    so only the statuses a struggling server or proxy gives count.
+    """
+    if isinstance(e, TransportError):
+        return e.httpcode in FAILURE_STATUSES
+    return isinstance(e, (socket.error, urllib2.URLError))
+
+
 def assert_status(obj):
     """Make sure the returned status is OK"""
     if obj.OverallStatus != 'OK':
@@ -94,43 +173,55 @@ def handle_fault(e):
     raise NewsletterException(str(e))
 
 
+def get_client(user, pass_):
+    """
+    Return the suds client, made with ``user`` and ``pass_`` the first time
+    and re-used after, since loading the WSDL is slow.
+    """
+    client = getattr(logged_in, 'cached_client', None)
+    if not client:
+        # Monkey-patch suds because it always initializes an ObjectCache
+        # before looking at the cache you told it to use, and that tries
+        # to use the same subdir under /tmp even if it already exists
+        # and is owned by another user.
+        # While we're at it, use Django caching instead of temp files.
+        import suds.client
+        suds.client.ObjectCache = SudsDjangoCache
+
+        wsdl_file_name = ('et-sandbox-wsdl.txt' if settings.EXACTTARGET_USE_SANDBOX
+                          else 'et-wsdl.txt')
+
+        # This is just a cached version. The real URL is:
+        # https://webservice.s4.exacttarget.com/etframework.wsdl
+        #
+        # The cached version has been stripped down to make suds run 1000x
+        # faster. I deleted most of the fields in the TriggeredSendDefinition
+        # and TriggeredSend objects that we don't use.
+        wsdl_url = 'file://{0}/{1}'.format(os.path.dirname(os.path.abspath(__file__)),
+                                           wsdl_file_name)
+
+        security = Security()
+        token = UsernameToken(user, pass_)
+        security.tokens.append(token)
+        options = {}
+        if ET_FAKE_URL:
+            options['location'] = ET_FAKE_URL.rstrip('/') + '/Service.asmx'
+        client = Client(wsdl_url, wsse=security,
+                        transport=ETTransport(timeout=ET_TIMEOUT),
+                        **options)
+
+        # Save client instance and just re-use it next time.
+        setattr(logged_in, 'cached_client', client)
+    return client
+
+
 def logged_in(f):
     """ Decorator to ensure the request will be authenticated """
 
     @wraps(f)
     def wrapper(inst, *args, **kwargs):
         if not inst.client:
-            # Try to re-use existing client instance.
-            inst.client = getattr(logged_in, 'cached_client', None)
-        if not inst.client:
-            # Monkey-patch suds because it always initializes an ObjectCache
-            # before looking at the cache you told it to use, and that tries
-            # to use the same subdir under /tmp even if it already exists
-            # and is owned by another user.
-            # While we're at it, use Django caching instead of temp files.
-            import suds.client
-            suds.client.ObjectCache = SudsDjangoCache
-
-            wsdl_file_name = ('et-sandbox-wsdl.txt' if settings.EXACTTARGET_USE_SANDBOX
-                              else 'et-wsdl.txt')
-
-            # This is just a cached version. The real URL is:
-            # https://webservice.s4.exacttarget.com/etframework.wsdl
-            #
-            # The cached version has been stripped down to make suds run 1000x
-            # faster. I deleted most of the fields in the TriggeredSendDefinition
-            # and TriggeredSend objects that we don't use.
-            wsdl_url = 'file://{0}/{1}'.format(os.path.dirname(os.path.abspath(__file__)),
-                                               wsdl_file_name)
-
-            security = Security()
-            token = UsernameToken(inst.user, inst.pass_)
-            security.tokens.append(token)
-            inst.client = Client(wsdl_url, wsse=security,
-                                 transport=HttpAuthenticated(timeout=ET_TIMEOUT))
-
-            # Save client instance and just re-use it next time.
-            setattr(logged_in, 'cached_client', inst.client)
+            inst.client = get_client(inst.user, inst.pass_)
         return f(inst, *args, **kwargs)
     return wrapper
 
@@ -303,6 +394,88 @@ class ExactTargetDataExt(ExactTargetObject):
         except WebFault, e:
             handle_fault(e)
 
+    @logged_in
+    def add_records(self, data_id, records):
+        """
+        Add or update several records in data extension ``data_id`` with
+        a single Update call.
+
+        ``records`` is a list of dicts mapping field names to values. The
+        records don't all need to have the same fields.
+        """
+        objs = []
+        for record in records:
+            obj = self.create('DataExtensionObject')
+            props = []
+
+            for name, value in record.items():
+                prop = self.create('APIProperty')
+                prop.Name = name
+                prop.Value = value
+
+                props.append(prop)
+
+            obj.Properties.Property = props
+            obj.CustomerKey = data_id
+            objs.append(obj)
+
+        opt = self.create('SaveOption')
+        opt.PropertyName = '*'
+        opt.SaveAction = 'UpdateAdd'
+
+        self.create('RequestType')
+        opts = self.create('UpdateOptions')
+        opts.SaveOptions.SaveOption = [opt]
+
+        try:
+            obj = self.client.service.Update(opts, objs)
+            assert_status(obj)
+        except WebFault, e:
+            handle_fault(e)
+
+    @logged_in
+    def get_records(self, data_id, values, fields, field='TOKEN'):
+        """
+        Return a list of dicts, one for every record in data extension
+        ``data_id`` whose ``field`` is one of ``values``.
+
+        Unlike get_record, finding nothing is not an error; the list is
+        just empty.
+        """
+        values = list(values)
+        if not values:
+            return []
+
+        req = self.create('RetrieveRequest')
+        req.ObjectType = 'DataExtensionObject[%s]' % data_id
+        req.Properties = fields
+
+        filter_ = self.create('SimpleFilterPart')
+        filter_.Value = values
+        filter_.SimpleOperator = 'IN' if len(values) > 1 else 'equals'
+        filter_.Property = field
+        req.Filter = filter_
+
+        del req.Options
+
+        results = []
+        try:
+            obj = self.client.service.Retrieve(req)
+            # Large result sets come back a page at a time.
+            while obj.OverallStatus == 'MoreDataAvailable':
+                results.extend(getattr(obj, 'Results', []))
+                req = self.create('RetrieveRequest')
+                req.ContinueRequest = obj.RequestID
+                del req.Options
+                obj = self.client.service.Retrieve(req)
+            assert_status(obj)
+        except WebFault, e:
+            handle_fault(e)
+
+        results.extend(getattr(obj, 'Results', []))
+        return [dict((p.Name, p.Value) for p in result.Properties.Property)
+                for result in results]
+
     @logged_in
     def get_record(self, data_id, token, fields, field='TOKEN'):
         req = self.create('RetrieveRequest')
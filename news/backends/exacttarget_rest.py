@@ -1,10 +1,19 @@
 import json
 import time
+from urlparse import urlparse
 
 from django.conf import settings
 
 import requests
 
+from .breaker import FAILURE_STATUSES, CircuitBreaker
+from .deadline import et_call, et_call_timeout
+from .throttle import wait_for_capacity
+
+
+# Base URL of a stand-in for ET to use instead, e.g. a backends.fake_et server
+ET_FAKE_URL = getattr(settings, 'EXACTTARGET_FAKE_URL', None)
+
 
 class ETRestError(Exception):
     pass
@@ -30,6 +39,11 @@ class ExactTargetRest(object):
             raise ValueError('You must provide the Client ID and Client Secret from the '
                              'ExactTarget App Center.')
 
+        if ET_FAKE_URL:
+            base_url = ET_FAKE_URL.rstrip('/')
+            self.api_urls = dict((name, base_url + urlparse(url).path)
+                                 for name, url in self.api_urls.items())
+
     def _request(self, url_name, data, url_params=None, method='POST', extra_headers=None):
         """Make a request to the ET REST API."""
         headers = {'content-type': 'application/json'}
@@ -44,7 +58,32 @@ class ExactTargetRest(object):
         if url_params:
             url = url.format(**url_params)
 
-        return requests.request(method, url, data=json.dumps(data), headers=headers)
+        timeout = et_call_timeout(None)
+        wait_for_capacity('REST')
+        breaker = CircuitBreaker('REST')
+        state = breaker.before_call()
+        body = json.dumps(data)
+        with et_call('REST') as call:
+            try:
+                response = requests.request(method, url, data=body,
+                                            headers=headers, timeout=timeout)
+                call.size = len(body) + len(response.content or '')
+            except requests.Timeout:
+                if timeout is None:
+                    breaker.failure(state)
+                else:
+                    # cut short by the request's deadline
+                    breaker.release(state)
+                raise
+            except requests.RequestException:
+                breaker.failure(state)
+                raise
+
+        if response.status_code in FAILURE_STATUSES:
+            breaker.failure(state)
+        else:
+            breaker.success(state)
+        return response
 
     def auth_token_expired(self):
         """Returns boolean True if the access token has expired."""
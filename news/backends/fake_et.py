@@ -0,0 +1,415 @@
+"""
+A local stand-in for ExactTarget, for load testing basket without using
+up the sandbox's quotas.
+
+It speaks the part of the SOAP API (see et-wsdl.txt) that the backends
+use: Retrieve, Update and Delete of data extension records, and Create
+of triggered sends, as well as the REST API's auth and SMS send calls.
+Data extensions are kept in memory, and triggered sends and text
+messages are just recorded.
+
+Run it with the run_fake_et management command, and point the backends
+at it with::
+
+    EXACTTARGET_FAKE_URL = 'http://127.0.0.1:8111'
+
+Calls can be made to take ``latency`` seconds (plus up to ``jitter``
+more), and ``error_rate`` of them (0 to 1) to fail with an HTTP
+``error_status``. A 500 comes back as a SOAP fault, like ET's own
+errors; anything else looks like ET or its proxies being down.
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+
+
+log = logging.getLogger(__name__)
+
+SOAP_PATH = '/Service.asmx'
+FAULT_SCHEMA_PATH = '/ETFrameworkFault.xsd'
+AUTH_PATH = '/v1/requestToken'
+SMS_PATH_RE = re.compile(r'^/sms/v1/messageContact/(?P<msg_id>[^/]+)/send$')
+
+ENVELOPE = ('<?xml version="1.0" encoding="utf-8"?>'
+            '<soap:Envelope'
+            ' xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"'
+            ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+            ' xmlns:xsd="http://www.w3.org/2001/XMLSchema">'
+            '<soap:Body>%s</soap:Body></soap:Envelope>')
+PARTNER_API = 'http://exacttarget.com/wsdl/partnerAPI'
+# imported by the WSDL
+FAULT_SCHEMA = ('<?xml version="1.0" encoding="utf-8"?>'
+                '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"'
+                ' targetNamespace="urn:fault.partner.exacttarget.com"'
+                ' elementFormDefault="qualified">'
+                '<xs:element name="fault" type="xs:string"/>'
+                '</xs:schema>')
+
+ACCESS_TOKEN_EXPIRES = 3600  # seconds
+
+
+def local_name(elem):
+    """The tag of an element without its namespace."""
+    return elem.tag.rsplit('}', 1)[-1]
+
+
+def children(elem, name):
+    return [child for child in elem if local_name(child) == name]
+
+
+def child(elem, name):
+    found = children(elem, name)
+    return found[0] if found else None
+
+
+def text(elem, name, default=None):
+    found = child(elem, name)
+    if found is None:
+        return default
+    return found.text or ''
+
+
+def properties(elem):
+    """The Name/Value pairs of an element's APIProperty children, as a
+    list of tuples."""
+    return [(text(prop, 'Name'), text(prop, 'Value', ''))
+            for prop in elem if local_name(prop) in ('Property', 'Key')]
+
+
+def default_keys():
+    # Records are keyed by TOKEN unless listed here.
+    return {
+        settings.EXACTTARGET_INTERESTS: ('TOKEN', 'INTEREST'),
+        'Mobile_Subscribers': ('Phone',),
+    }
+
+
+class SOAPFault(Exception):
+    pass
+
+
+class FakeET(object):
+    """The state of the fake ET account: data extensions and sends."""
+    def __init__(self, keys=None, page_size=2500):
+        self.keys = keys if keys is not None else default_keys()
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # {data extension key: {record key: {field: value}}}
+            self.data_extensions = {}
+            self.sends = []
+            self.sms = []
+            self.calls = {}
+            self.continuations = {}
+            self.access_tokens = set()
+
+    def count_call(self, op):
+        with self.lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+
+    def record_key(self, data_ext, record):
+        fields = self.keys.get(data_ext, ('TOKEN',))
+        if all(f in record for f in fields):
+            return tuple(record[f] for f in fields)
+        # nothing to key it by, so every record is a new one
+        return tuple(sorted(record.items()))
+
+    def get_records(self, data_ext):
+        """Return the records in ``data_ext``, as a list of dicts."""
+        with self.lock:
+            return [dict(r) for r in self.data_extensions.get(data_ext, {}).values()]
+
+    def add_record(self, data_ext, record):
+        """Add or update a record of ``data_ext``, a dict of its fields."""
+        with self.lock:
+            records = self.data_extensions.setdefault(data_ext, {})
+            key = self.record_key(data_ext, record)
+            records.setdefault(key, {}).update(record)
+
+    def update(self, request):
+        results = []
+        for obj in children(request, 'Objects'):
+            data_ext = text(obj, 'CustomerKey')
+            record = dict(properties(child(obj, 'Properties')))
+            if not data_ext or not record:
+                raise SOAPFault('Update needs a CustomerKey and Properties')
+            self.add_record(data_ext, record)
+            results.append(result_xml('OK', 'Updated DataExtensionObject',
+                                      len(results)))
+        return response_xml('UpdateResponse', results)
+
+    def delete(self, request):
+        results = []
+        status = 'OK'
+        for obj in children(request, 'Objects'):
+            data_ext = text(obj, 'CustomerKey')
+            keys = dict(properties(child(obj, 'Keys')))
+            with self.lock:
+                records = self.data_extensions.get(data_ext, {})
+                found = [k for k, r in records.items()
+                         if all(r.get(n) == v for n, v in keys.items())]
+                for key in found:
+                    del records[key]
+            if found:
+                results.append(result_xml('OK', 'Deleted DataExtensionObject',
+                                          len(results)))
+            else:
+                status = 'Error'
+                results.append(result_xml('Error', 'Data Extension Object not found',
+                                          len(results)))
+        return response_xml('DeleteResponse', results, status)
+
+    def create(self, request):
+        results = []
+        for obj in children(request, 'Objects'):
+            xsi_type = [v for k, v in obj.attrib.items() if k.endswith('}type')]
+            send_type = xsi_type[0].split(':')[-1] if xsi_type else 'TriggeredSend'
+            definition = child(obj, 'TriggeredSendDefinition')
+            if definition is None:
+                definition = child(obj, 'SMSTriggeredSendDefinition')
+            send = {
+                'type': send_type,
+                'definition': text(definition, 'CustomerKey') if definition is not None else None,
+                'number': text(obj, 'Number'),
+                'subscribers': [],
+            }
+            for subscriber in children(obj, 'Subscribers') + children(obj, 'Subscriber'):
+                attributes = dict((text(a, 'Name'), text(a, 'Value', ''))
+                                  for a in children(subscriber, 'Attributes'))
+                send['subscribers'].append({
+                    'email': text(subscriber, 'EmailAddress'),
+                    'key': text(subscriber, 'SubscriberKey'),
+                    'format': text(subscriber, 'EmailTypePreference'),
+                    'attributes': attributes,
+                })
+            with self.lock:
+                self.sends.append(send)
+            results.append(result_xml('OK', 'Created %s' % send_type, len(results),
+                                      '<NewID>%d</NewID>' % len(self.sends)))
+        return response_xml('CreateResponse', results)
+
+    def retrieve(self, request):
+        request = child(request, 'RetrieveRequest')
+        continue_id = text(request, 'ContinueRequest')
+        if continue_id:
+            with self.lock:
+                fields, rows = self.continuations.pop(continue_id, (None, None))
+            if rows is None:
+                raise SOAPFault('Unknown ContinueRequest %s' % continue_id)
+        else:
+            fields = [p.text for p in children(request, 'Properties')]
+            rows = self.find(text(request, 'ObjectType', ''),
+                             child(request, 'Filter'))
+
+        page, rows = rows[:self.page_size], rows[self.page_size:]
+        status = 'OK'
+        request_id = str(uuid.uuid4())
+        if rows:
+            status = 'MoreDataAvailable'
+            with self.lock:
+                self.continuations[request_id] = (fields, rows)
+
+        results = []
+        for row in page:
+            props = ''.join('<Property><Name>%s</Name><Value>%s</Value></Property>'
+                            % (escape(f), escape(row.get(f) or ''))
+                            for f in fields)
+            results.append('<Results xsi:type="DataExtensionObject">'
+                           '<Properties>%s</Properties></Results>' % props)
+        return ('<RetrieveResponseMsg xmlns="%s">'
+                '<OverallStatus>%s</OverallStatus><RequestID>%s</RequestID>%s'
+                '</RetrieveResponseMsg>' % (PARTNER_API, status, request_id,
+                                            ''.join(results)))
+
+    def find(self, object_type, filter_):
+        """The records of a DataExtensionObject[<key>] ``object_type``
+        matching a SimpleFilterPart."""
+        match = re.match(r'^DataExtensionObject\[(.+)\]$', object_type)
+        if not match:
+            # Only data extensions are kept, so nothing else is found.
+            return []
+        rows = self.get_records(match.group(1))
+        if filter_ is None:
+            return rows
+
+        field = text(filter_, 'Property')
+        operator = text(filter_, 'SimpleOperator')
+        if operator not in ('equals', 'IN'):
+            raise SOAPFault('Unsupported SimpleOperator %s' % operator)
+        # ET compares text without regard to case
+        values = set((v.text or '').lower() for v in children(filter_, 'Value'))
+        return [row for row in rows if (row.get(field) or '').lower() in values]
+
+    def auth(self, data):
+        if not (data.get('clientId') and data.get('clientSecret')):
+            return 401, {'errorcode': 1, 'message': 'Unauthorized'}
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.access_tokens.add(token)
+        return 200, {
+            'accessToken': token,
+            'expiresIn': ACCESS_TOKEN_EXPIRES,
+            'refreshToken': uuid.uuid4().hex,
+        }
+
+    def send_sms(self, msg_id, data, authorization):
+        token = (authorization or '').replace('Bearer ', '', 1)
+        if token not in self.access_tokens:
+            return 401, {'message': 'Not Authorized', 'errorcode': 0}
+        numbers = data.get('mobileNumbers')
+        if not numbers:
+            return 400, {'errors': ['mobileNumbers is required']}
+        with self.lock:
+            self.sms.append({'message_id': msg_id, 'numbers': numbers})
+        return 202, {'tokenId': uuid.uuid4().hex}
+
+
+def result_xml(status, message, ordinal, extra=''):
+    return ('<Results><StatusCode>%s</StatusCode><StatusMessage>%s</StatusMessage>'
+            '<OrdinalID>%d</OrdinalID>%s</Results>'
+            % (status, escape(message), ordinal, extra))
+
+
+def response_xml(name, results, status='OK'):
+    return ('<%s xmlns="%s">%s<RequestID>%s</RequestID>'
+            '<OverallStatus>%s</OverallStatus></%s>'
+            % (name, PARTNER_API, ''.join(results), uuid.uuid4(), status, name))
+
+
+def fault_xml(message):
+    return ('<soap:Fault><faultcode>soap:Client</faultcode>'
+            '<faultstring>%s</faultstring></soap:Fault>' % escape(message))
+
+
+class FakeETHandler(BaseHTTPRequestHandler):
+    # write each response in one go, rather than a packet per header
+    wbufsize = -1
+    soap_operations = {
+        'RetrieveRequestMsg': ('Retrieve', FakeET.retrieve),
+        'UpdateRequest': ('Update', FakeET.update),
+        'CreateRequest': ('Create', FakeET.create),
+        'DeleteRequest': ('Delete', FakeET.delete),
+    }
+
+    def do_GET(self):
+        if self.path == FAULT_SCHEMA_PATH:
+            self.respond(200, 'text/xml; charset=utf-8', FAULT_SCHEMA)
+        else:
+            self.respond(404, 'text/plain', 'Not found')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader('content-length') or 0))
+        self.server.delay()
+        sms_match = SMS_PATH_RE.match(self.path)
+
+        if self.path == SOAP_PATH:
+            self.soap(body)
+        elif self.path == AUTH_PATH or sms_match:
+            self.server.et.count_call('REST')
+            if self.server.inject_error():
+                return self.respond(self.server.error_status, 'application/json',
+                                    json.dumps({'message': 'Injected error'}))
+            data = json.loads(body or '{}')
+            if sms_match:
+                status, reply = self.server.et.send_sms(
+                    sms_match.group('msg_id'), data,
+                    self.headers.getheader('authorization'))
+            else:
+                status, reply = self.server.et.auth(data)
+            self.respond(status, 'application/json', json.dumps(reply))
+        else:
+            self.respond(404, 'text/plain', 'Not found')
+
+    def soap(self, body):
+        try:
+            envelope = ElementTree.fromstring(body)
+            request = list(child(envelope, 'Body'))[0]
+            op, method = self.soap_operations[local_name(request)]
+        except Exception:
+            return self.soap_fault('Unsupported request')
+
+        self.server.et.count_call(op)
+        if self.server.inject_error():
+            if self.server.error_status == 500:
+                return self.soap_fault('Injected error')
+            return self.respond(self.server.error_status, 'text/plain',
+                                'Service Unavailable')
+        try:
+            reply = method(self.server.et, request)
+        except SOAPFault as e:
+            return self.soap_fault(str(e))
+        self.respond(200, 'text/xml; charset=utf-8',
+                     (ENVELOPE % reply).encode('utf-8'))
+
+    def soap_fault(self, message):
+        self.respond(500, 'text/xml; charset=utf-8',
+                     (ENVELOPE % fault_xml(message)).encode('utf-8'))
+
+    def respond(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+class FakeETServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server for a FakeET, handling each request in its own thread.
+
+    :param address: (host, port) to listen on. Port 0 picks a free one.
+    :param latency: Seconds every call takes.
+    :param jitter: Up to this many more seconds are added at random.
+    :param error_rate: Share of calls, 0 to 1, that fail.
+    :param error_status: HTTP status the failed calls get.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, latency=0, jitter=0, error_rate=0,
+                 error_status=503, et=None):
+        HTTPServer.__init__(self, address, FakeETHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.et = et or FakeET()
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+    def delay(self):
+        seconds = self.latency + random.uniform(0, self.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def inject_error(self):
+        return self.error_rate and random.random() < self.error_rate
+
+    def start(self):
+        """Serve in a background thread."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,131 @@
+"""
+A local stand-in for an SMTP server, for testing the email basket sends
+itself, like the stewards' notifications, without delivering any.
+
+It speaks enough SMTP for smtplib and Django's SMTP email backend, and
+records the messages it's sent, and how many connections and messages
+it's had. Point Django at it with::
+
+    EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    EMAIL_HOST = '127.0.0.1'
+    EMAIL_PORT = server.port
+
+Messages can be made to take ``latency`` seconds, and ``error_rate`` of
+them (0 to 1) to be refused with a temporary failure.
+"""
+import random
+import threading
+import time
+from SocketServer import StreamRequestHandler, TCPServer, ThreadingMixIn
+
+
+class FakeSMTPHandler(StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line + '\r\n')
+
+    def handle(self):
+        server = self.server
+        server.count('connections')
+        self.reply('220 fake-smtp ready')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line.strip()
+            verb = command[:4].upper()
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 fake-smtp')
+            elif verb == 'MAIL':
+                sender, recipients = command.split(':', 1)[1].strip(), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command.split(':', 1)[1].strip())
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = self.read_data()
+                server.delay()
+                if server.inject_error():
+                    self.reply('451 Try again later')
+                else:
+                    server.record(sender, recipients, data)
+                    self.reply('250 OK')
+                sender, recipients = None, []
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('502 Command not implemented')
+
+    def read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line.rstrip('\r\n') == '.':
+                break
+            if line.startswith('..'):
+                line = line[1:]
+            lines.append(line)
+        return ''.join(lines)
+
+
+class FakeSMTPServer(ThreadingMixIn, TCPServer):
+    """
+    SMTP server handling each connection in its own thread.
+
+    :param address: (host, port) to listen on. Port 0 picks a free one.
+    :param latency: Seconds every message takes.
+    :param error_rate: Share of messages, 0 to 1, that are refused.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, latency=0, error_rate=0):
+        TCPServer.__init__(self, address, FakeSMTPHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # (sender, recipients, data) of each message delivered
+            self.messages = []
+            self.counts = {'connections': 0, 'messages': 0}
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def record(self, sender, recipients, data):
+        with self.lock:
+            self.messages.append((sender, recipients, data))
+            self.counts['messages'] += 1
+
+    def delay(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def inject_error(self):
+        return self.error_rate and random.random() < self.error_rate
+
+    def start(self):
+        """Serve in a background thread."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,151 @@
+"""
+Cluster-wide rate limiting of calls to ExactTarget.
+
+ET enforces API quotas, and going over them just gets us errors. Each
+ET operation (the SOAP Retrieve, Update, Create and Delete calls, and
+REST) has a token bucket kept in the Django cache, so it's shared by
+every web and celery process. The bucket is refilled continuously, at
+the operation's rate, and holds at most EXACTTARGET_RATE_LIMIT_BURST
+seconds' worth of calls (one second's by default, and never more than
+the whole period's), so calls can't come all at once after a quiet
+spell. The bucket is only ever changed while holding a short lock in
+the cache.
+
+Callers take a token before calling ET. When the bucket is empty they
+wait for the next token, for up to EXACTTARGET_RATE_LIMIT_WAIT seconds
+(less if the request's ET deadline comes sooner). After that they give
+up with RateLimitedException.
+
+Rates are set per operation in the same format as the view rate
+limits, e.g.::
+
+    EXACTTARGET_RATE_LIMITS = {
+        'Retrieve': '50/s',
+        'Update': '20/s',
+        'Create': '10/s',
+        'REST': '600/m',
+    }
+
+Operations without a rate aren't limited.
+
+The tokens left in each bucket are sent to statsd as the gauge
+news.et_throttle.<operation>.fill, and time spent waiting as the timer
+news.et_throttle.<operation>.wait.
+"""
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+from django_statsd.clients import statsd
+
+from .common import RateLimitedException
+from .deadline import current_deadline
+
+
+RATE_LIMITS = getattr(settings, 'EXACTTARGET_RATE_LIMITS', {})
+RATE_LIMIT_WAIT = getattr(settings, 'EXACTTARGET_RATE_LIMIT_WAIT', 5)
+RATE_LIMIT_BURST = getattr(settings, 'EXACTTARGET_RATE_LIMIT_BURST', 1)
+# How long a bucket's lock may be held before it's taken to be abandoned,
+# and how long to try for it.
+LOCK_TIMEOUT = 1
+LOCK_WAIT = 0.5
+LOCK_POLL = 0.005
+# Fractions of a token this close to a whole one count, or rounding
+# could leave a wait too short to make a difference.
+TOKEN_ROUNDING = 1e-6
+
+PERIODS = {
+    's': 1,
+    'm': 60,
+    'h': 60 * 60,
+}
+
+
+def parse_rate(rate):
+    """Parse a rate like '20/s' into (calls, period in seconds)."""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period]
+
+
+def bucket_capacity(limit, period):
+    """The most tokens the bucket for ``limit`` calls per ``period``
+    holds: RATE_LIMIT_BURST seconds' worth, at least one and at most
+    ``limit``."""
+    return max(1, min(limit, int(limit * RATE_LIMIT_BURST / float(period))))
+
+
+@contextmanager
+def bucket_lock(key):
+    lock_key = key + ':lock'
+    locked = False
+    for i in range(int(LOCK_WAIT / LOCK_POLL)):
+        if cache.add(lock_key, 1, LOCK_TIMEOUT):
+            locked = True
+            break
+        time.sleep(LOCK_POLL)
+    # if it isn't let go of in time, carry on regardless; the worst
+    # that happens is a token too many
+    try:
+        yield
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+
+def take_token(op, limit, period):
+    """
+    Take a token from the bucket for ET operation ``op``, refilled with
+    ``limit`` tokens per ``period`` seconds. Returns (True, tokens left),
+    or (False, seconds until there's a token) if it's empty.
+    """
+    key = 'et-throttle:%s' % op
+    rate = limit / float(period)
+    capacity = bucket_capacity(limit, period)
+    with bucket_lock(key):
+        now = time.time()
+        tokens, updated = cache.get(key) or (capacity, now)
+        tokens = min(capacity, tokens + max(now - updated, 0) * rate)
+        taken = tokens >= 1 - TOKEN_ROUNDING
+        if taken:
+            tokens = max(tokens - 1, 0)
+        # once it's been full this long it may as well be gone
+        cache.set(key, (tokens, now), period + 1)
+    if taken:
+        return True, tokens
+    return False, (1 - tokens) / rate
+
+
+def wait_for_capacity(op):
+    """
+    Take a token from the bucket for ET operation ``op``, waiting for one
+    if need be.
+
+    Raises RateLimitedException if none turns up in time.
+    """
+    rate = RATE_LIMITS.get(op)
+    if not rate:
+        return
+
+    limit, period = parse_rate(rate)
+    max_wait = RATE_LIMIT_WAIT
+    deadline = current_deadline()
+    if deadline is not None:
+        max_wait = min(max_wait, deadline.remaining())
+
+    waited = 0
+    while True:
+        taken, value = take_token(op, limit, period)
+        if taken:
+            statsd.gauge('news.et_throttle.%s.fill' % op, int(value))
+            if waited:
+                statsd.timing('news.et_throttle.%s.wait' % op,
+                              int(waited * 1000))
+            return
+
+        if waited + value > max_wait:
+            statsd.incr('news.et_throttle.%s.rejected' % op)
+            raise RateLimitedException(op, value)
+        time.sleep(value)
+        waited += value
@@ -0,0 +1,213 @@
+"""
+End-to-end throughput benchmark of the news API and the ET tasks.
+
+Each operation is run a number of times in this process: the API views
+through the Django test client, with their tasks run eagerly, and the
+tasks themselves in eager mode, as a celery worker would run them. ET is
+a backends.fake_et server with the given latency, so the numbers are
+basket's own overhead plus the ET round trips it makes.
+
+For every operation it reports ops/sec, p50 and p99 latency, ET calls
+per op (by ET operation), database queries per op, and errors. Run it
+with the benchmark_api management command.
+"""
+import json
+from contextlib import contextmanager
+from time import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import connection
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+
+from celery import current_app
+
+from news.backends import exacttarget, exacttarget_rest
+from news.backends.fake_et import FakeETServer
+from news.benchmarks.base import summarize
+from news.models import APIUser, Newsletter, Subscriber
+from news.tasks import SUBSCRIBE, confirm_user, send_message, update_user
+
+
+NEWSLETTER = 'benchmark'
+VENDOR_ID = 'BENCHMARK'
+WELCOME = 'Benchmark_Welcome'
+API_KEY = 'benchmark'
+USER_AGENT = ('Mozilla/5.0 (Android; Tablet; rv:36.0) Gecko/36.0 '
+              'Firefox/36.0')
+HTTPS = {'wsgi.url_scheme': 'https'}
+
+
+@contextmanager
+def fake_et(latency=0, jitter=0):
+    """Point the ET backends at a fake ET server for the block."""
+    server = FakeETServer(('127.0.0.1', 0), latency=latency, jitter=jitter)
+    server.start()
+    saved = (exacttarget.ET_FAKE_URL, exacttarget_rest.ET_FAKE_URL,
+             getattr(exacttarget.logged_in, 'cached_client', None))
+    exacttarget.ET_FAKE_URL = exacttarget_rest.ET_FAKE_URL = server.url
+    exacttarget.logged_in.cached_client = None
+    try:
+        yield server
+    finally:
+        (exacttarget.ET_FAKE_URL, exacttarget_rest.ET_FAKE_URL,
+         exacttarget.logged_in.cached_client) = saved
+        server.stop()
+
+
+@contextmanager
+def eager_tasks():
+    conf = current_app.conf
+    saved = conf.CELERY_ALWAYS_EAGER
+    conf.CELERY_ALWAYS_EAGER = True
+    try:
+        yield
+    finally:
+        conf.CELERY_ALWAYS_EAGER = saved
+
+
+def add_fixtures():
+    Newsletter.objects.get_or_create(slug=NEWSLETTER, defaults={
+        'title': 'Benchmark',
+        'vendor_id': VENDOR_ID,
+        'welcome': WELCOME,
+        'languages': 'en,de,fr',
+    })
+    APIUser.objects.get_or_create(api_key=API_KEY,
+                                  defaults={'name': 'benchmark'})
+
+
+def add_users(et, database, count):
+    """Add ``count`` users to a fake ET's ``database`` and to basket's,
+    and return them as a list of (email, token)."""
+    users = []
+    for i in range(count):
+        email = 'bench-%s@example.com' % uuid4().hex
+        token = str(uuid4())
+        et.add_record(database, {
+            'TOKEN': token,
+            'EMAIL_ADDRESS_': email,
+            'EMAIL_FORMAT_': 'H',
+            'COUNTRY_': 'us',
+            'LANGUAGE_ISO2': 'en',
+            'CREATED_DATE_': '2014-01-01',
+            '%s_FLG' % VENDOR_ID: 'Y',
+        })
+        Subscriber.objects.create(email=email, token=token)
+        users.append((email, token))
+    return users
+
+
+def response_failed(response):
+    return response.status_code >= 400
+
+
+def task_failed(result):
+    return result.failed()
+
+
+class Operations(object):
+    """
+    The benchmarked operations. Each is a method taking the index of
+    the run, and returning whether it failed. ``prepare`` adds the users
+    they need beforehand.
+    """
+    names = ('subscribe', 'user', 'lookup_user', 'fxa_activity',
+             'update_user', 'confirm_user', 'send_message')
+
+    def __init__(self, et):
+        self.et = et
+        self.client = Client()
+
+    def prepare(self, iterations):
+        add_fixtures()
+        self.users = add_users(self.et, settings.EXACTTARGET_DATA, iterations)
+        self.pending = add_users(self.et, settings.EXACTTARGET_OPTIN_STAGE,
+                                 iterations)
+
+    def subscribe(self, i):
+        return response_failed(self.client.post('/news/subscribe/', {
+            'email': 'bench-new-%s@example.com' % uuid4().hex,
+            'newsletters': NEWSLETTER,
+            'lang': 'en',
+            'country': 'us',
+        }))
+
+    def user(self, i):
+        email, token = self.users[i]
+        return response_failed(self.client.get('/news/user/%s/' % token))
+
+    def lookup_user(self, i):
+        email, token = self.users[i]
+        return response_failed(self.client.get('/news/lookup-user/', {
+            'email': email,
+            'api-key': API_KEY,
+        }, **HTTPS))
+
+    def fxa_activity(self, i):
+        return response_failed(self.client.post(
+            '/news/fxa-activity/',
+            json.dumps({
+                'fxa_id': uuid4().hex,
+                'first_device': bool(i % 2),
+                'user_agent': USER_AGENT,
+            }),
+            content_type='application/json',
+            HTTP_X_API_KEY=API_KEY,
+            **HTTPS))
+
+    def update_user(self, i):
+        email, token = self.users[i]
+        return task_failed(update_user.delay(
+            {'newsletters': NEWSLETTER, 'lang': 'de', 'country': 'de'},
+            email, token, SUBSCRIBE, True))
+
+    def confirm_user(self, i):
+        email, token = self.pending[i]
+        return task_failed(confirm_user.delay(token, None))
+
+    def send_message(self, i):
+        email, token = self.users[i]
+        return task_failed(send_message.delay(WELCOME, email, token, 'H'))
+
+
+def run_operation(operation, iterations, et):
+    times = []
+    errors = 0
+    et_calls_before = dict(et.calls)
+    with CaptureQueriesContext(connection) as queries:
+        for i in range(iterations):
+            start = time()
+            if operation(i):
+                errors += 1
+            times.append(time() - start)
+
+    result = summarize(times)
+    result['errors'] = errors
+    result['db_queries_per_op'] = round(len(queries) / float(iterations), 2)
+    result['et_calls_per_op'] = dict(
+        (op, round((count - et_calls_before.get(op, 0)) / float(iterations), 2))
+        for op, count in et.calls.items()
+        if count != et_calls_before.get(op, 0))
+    return result
+
+
+def run_benchmarks(iterations=100, latency=0.05, jitter=0, names=None):
+    """
+    Run each of the ``names`` operations (all of them by default)
+    ``iterations`` times against a fake ET whose calls take ``latency``
+    seconds, plus up to ``jitter``, and return their results by name.
+
+    It adds users and newsletters to the database, so is for use with a
+    test database.
+    """
+    results = {}
+    with fake_et(latency, jitter) as server:
+        with eager_tasks():
+            operations = Operations(server.et)
+            operations.prepare(iterations)
+            for name in names or Operations.names:
+                results[name] = run_operation(getattr(operations, name),
+                                              iterations, server.et)
+    return results
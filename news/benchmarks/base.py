@@ -0,0 +1,71 @@
+"""
+What the benchmarks share: summarizing timings, and saving and loading
+results as JSON so runs can be compared.
+"""
+import json
+import math
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection
+
+
+@contextmanager
+def test_database(verbosity=0):
+    """Run the block against a throwaway test database, as the test
+    runner would."""
+    if 'south' in settings.INSTALLED_APPS:
+        from south.management.commands import patch_for_test_db_setup
+        patch_for_test_db_setup()
+    db_name = connection.creation.create_test_db(verbosity=verbosity,
+                                                 autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(db_name, verbosity=verbosity)
+
+
+def percentile(values, percent):
+    """The ``percent`` percentile of ``values``, by nearest rank."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(ordered))) - 1
+    return ordered[max(rank, 0)]
+
+
+def ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def summarize(times):
+    """Summary of a list of the seconds each op took."""
+    total = sum(times)
+    return {
+        'ops': len(times),
+        'seconds': round(total, 4),
+        'ops_per_sec': round(len(times) / total, 2) if total else None,
+        'p50_ms': ms(percentile(times, 50)),
+        'p99_ms': ms(percentile(times, 99)),
+    }
+
+
+def save_results(path, results, **info):
+    """Write ``results`` to ``path`` as JSON, with when they were made and
+    whatever ``info`` describes the run."""
+    data = dict(info, results=results, when=datetime.utcnow().isoformat())
+    with open(path, 'w') as results_file:
+        json.dump(data, results_file, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as results_file:
+        return json.load(results_file)['results']
+
+
+def change(old, new):
+    """How much ``new`` differs from ``old``, as a percentage."""
+    if not old or new is None:
+        return None
+    return round((new - old) * 100.0 / old, 1)
@@ -0,0 +1,189 @@
+"""
+Microbenchmarks of the news.utils helpers that run on every request and
+task, against synthetic newsletter registries and email block lists of
+different sizes.
+
+Each case is timed timeit-style: the call is repeated enough times to
+take a measurable while, a few times over, and the best time per call
+is kept. Results are keyed '<case>/<size>', and can be checked against
+a stored baseline, failing if any case got more than a tolerance slower.
+A case that takes over SLOW_CALL seconds a call is timed just once, and
+skipped at the larger sizes.
+
+Making the registries replaces every newsletter, group and blocked
+domain in the database, so only run these against a test database. Run
+them with the benchmark_utils management command.
+"""
+import timeit
+
+from news.models import BlockedEmail, Newsletter, NewsletterGroup
+from news.newsletters import clear_newsletter_cache
+from news.utils import (SET, SUBSCRIBE, email_block_list_cache,
+                        email_is_blocked, get_accept_languages,
+                        get_best_accept_language, get_best_language,
+                        language_code_is_valid,
+                        parse_newsletters, user_data_from_record)
+
+
+SIZES = (10, 100, 1000, 10000)
+LANGUAGES = ('en', 'de', 'fr', 'es', 'it', 'pt-BR', 'ru', 'pl', 'nl', 'ja',
+             'zh-TW', 'id', 'hu', 'cs', 'el', 'ro', 'sl', 'zh-CN')
+# Newsletters per group
+GROUP_SIZE = 5
+ACCEPT_LANGUAGE = 'pt-PT,pt;q=0.9,en-US;q=0.8,en;q=0.7,de-DE;q=0.5'
+# Long enough for the timer to be accurate
+MIN_SECONDS = 0.2
+# Too long to time again
+SLOW_CALL = 1.0
+
+
+def slug(i):
+    return 'newsletter-%d' % i
+
+
+def vendor_id(i):
+    return 'NEWSLETTER_%d' % i
+
+
+def make_registry(size):
+    """Replace the newsletters with ``size`` synthetic ones, in a few
+    languages each, with every GROUP_SIZE of the first tenth grouped."""
+    NewsletterGroup.objects.all().delete()
+    Newsletter.objects.all().delete()
+    Newsletter.objects.bulk_create([
+        Newsletter(slug=slug(i), title='Newsletter %d' % i, vendor_id=vendor_id(i),
+                   languages=','.join(LANGUAGES[(i + j) % len(LANGUAGES)]
+                                      for j in range(3)),
+                   welcome='Welcome_%d' % i, active=True, show=True)
+        for i in range(size)])
+
+    ids = list(Newsletter.objects.order_by('id').values_list('id', flat=True))
+    grouped = ids[:max(len(ids) // 10, GROUP_SIZE)]
+    memberships = []
+    for start in range(0, len(grouped), GROUP_SIZE):
+        group = NewsletterGroup.objects.create(slug='group-%d' % start,
+                                               title='Group %d' % start,
+                                               active=True)
+        memberships.extend(
+            NewsletterGroup.newsletters.through(newslettergroup_id=group.id,
+                                                newsletter_id=nl_id)
+            for nl_id in grouped[start:start + GROUP_SIZE])
+    NewsletterGroup.newsletters.through.objects.bulk_create(memberships)
+    # bulk_create doesn't send the signals that would do this
+    clear_newsletter_cache()
+
+
+def make_block_list(size):
+    """Replace the blocked domains with ``size`` synthetic ones."""
+    BlockedEmail.objects.all().delete()
+    BlockedEmail.objects.bulk_create([
+        BlockedEmail(email_domain='blocked-%d.example.com' % i)
+        for i in range(size)])
+    email_block_list_cache.clear()
+
+
+def sized_cases(size):
+    """The cases whose speed depends on the registry or block list size,
+    as a list of (name, function to time)."""
+    wanted = [slug(i) for i in range(min(size, 10))]
+    # a user subscribed to a realistic few of them
+    current = set(slug(i) for i in range(0, size, max(size // 10, 1)))
+    record = {
+        'EMAIL_ADDRESS_': 'dude@example.com',
+        'EMAIL_FORMAT_': 'H',
+        'COUNTRY_': 'us',
+        'LANGUAGE_ISO2': 'en',
+        'TOKEN': 'abides',
+        'CREATED_DATE_': '2014-01-01',
+    }
+    for i in range(size):
+        record['%s_FLG' % vendor_id(i)] = 'Y' if slug(i) in current else 'N'
+
+    return [
+        ('parse_newsletters.subscribe',
+         lambda: parse_newsletters({}, SUBSCRIBE, wanted[:3] + ['group-0'], current)),
+        ('parse_newsletters.set',
+         lambda: parse_newsletters({}, SET, wanted, current)),
+        ('get_accept_languages', lambda: get_accept_languages(ACCEPT_LANGUAGE)),
+        ('get_best_language', lambda: get_best_language(['xx-YY', 'pt-PT', 'fr'])),
+        ('get_best_accept_language', lambda: get_best_accept_language(ACCEPT_LANGUAGE)),
+        ('email_is_blocked', lambda: email_is_blocked('dude@example.com')),
+        ('look_for_user.flags', lambda: user_data_from_record(record)),
+    ]
+
+
+def fixed_cases():
+    """The cases that don't depend on any size."""
+    return [
+        ('language_code_is_valid', lambda: language_code_is_valid('pt-BR')),
+    ]
+
+
+def time_call(func, repeat=3):
+    """The best seconds per call of ``func`` over ``repeat`` runs, and
+    the number of calls in each run."""
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        seconds = timer.timeit(number)
+        if seconds > SLOW_CALL and number == 1:
+            return seconds, number
+        if seconds >= MIN_SECONDS:
+            break
+        number *= 10
+    best = min([seconds] + timer.repeat(repeat - 1, number))
+    return best / number, number
+
+
+def result(func, repeat):
+    seconds, number = time_call(func, repeat)
+    return {'us_per_call': round(seconds * 1000000, 3), 'number': number}
+
+
+def run_benchmarks(sizes=SIZES, repeat=3, names=None):
+    """
+    Time each case (those in ``names``, or all of them) at each of
+    ``sizes``, and return the results by '<case>/<size>', or just
+    '<case>' for the cases that don't depend on size.
+    """
+    results = {}
+    for name, func in fixed_cases():
+        if names is None or name in names:
+            results[name] = result(func, repeat)
+    too_slow = set()
+    for size in sorted(sizes):
+        make_registry(size)
+        make_block_list(size)
+        for name, func in sized_cases(size):
+            if names is not None and name not in names:
+                continue
+            key = '%s/%d' % (name, size)
+            if name in too_slow:
+                results[key] = {'us_per_call': None, 'skipped': True}
+                continue
+            results[key] = result(func, repeat)
+            if results[key]['us_per_call'] > SLOW_CALL * 1000000:
+                too_slow.add(name)
+    return results
+
+
+def case_names():
+    return [name for name, func in fixed_cases() + sized_cases(0)]
+
+
+def regressions(results, baseline, tolerance=0.25):
+    """
+    Compare ``results`` with ``baseline`` ones, and return a list of
+    (key, baseline us per call, us per call now) for each case that's
+    more than ``tolerance`` (a fraction) slower. Cases that have got too
+    slow to time count, with None for now.
+    """
+    slower = []
+    for key, now in sorted(results.items()):
+        before = baseline.get(key)
+        if not before or before['us_per_call'] is None:
+            continue
+        if (now['us_per_call'] is None or
+                now['us_per_call'] > before['us_per_call'] * (1 + tolerance)):
+            slower.append((key, before['us_per_call'], now['us_per_call']))
+    return slower
@@ -0,0 +1,131 @@
+"""
+Benchmark of how long a cold web or worker process takes to start, and
+which imports that time goes on.
+
+Each target is loaded in a fresh python process, with __import__
+wrapped to time the first import of every module: its cumulative time,
+with everything it imports, and its own time, without. A target is a
+module, as a celery worker imports news.tasks, or a .wsgi file, loaded
+as mod_wsgi would. Run it with the benchmark_startup management command.
+
+This module is run as the child process's main script too, so it only
+imports the standard library at the top.
+"""
+import imp
+import json
+import os
+import subprocess
+import sys
+from time import time
+
+
+TARGETS = ('news.tasks', 'news.views', 'wsgi/basket.wsgi')
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class ImportTimer(object):
+    """Time the first import of each module while installed."""
+    def __init__(self):
+        self.modules = {}
+        # own time of the imports in progress, less their imports'
+        self.stack = [0.0]
+
+    def install(self):
+        import __builtin__
+        self.real_import = __builtin__.__import__
+        __builtin__.__import__ = self
+
+    def uninstall(self):
+        import __builtin__
+        __builtin__.__import__ = self.real_import
+
+    def __call__(self, name, globals=None, locals=None, fromlist=None, level=-1):
+        if name in sys.modules:
+            return self.real_import(name, globals, locals, fromlist, level)
+        self.stack.append(0.0)
+        start = time()
+        try:
+            return self.real_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time() - start
+            nested = self.stack.pop()
+            self.stack[-1] += elapsed
+            loaded = self.loaded_name(name, globals)
+            if loaded and loaded not in self.modules:
+                self.modules[loaded] = (elapsed, elapsed - nested)
+
+    def loaded_name(self, name, globals):
+        if name in sys.modules:
+            return name
+        # an implicit relative import
+        package = (globals or {}).get('__package__') or (globals or {}).get('__name__')
+        if package:
+            relative = '%s.%s' % (package, name)
+            if relative in sys.modules:
+                return relative
+        return None
+
+
+def load(target):
+    """Import ``target``, the way a process starting with it would."""
+    if target.endswith('.wsgi'):
+        path = os.path.join(ROOT, target)
+        imp.load_source(os.path.basename(target).replace('.', '_'), path)
+    else:
+        import manage  # noqa, adds the libs and vendor dirs to the path
+        __import__(target)
+
+
+def measure(target):
+    """Load ``target`` and return the seconds it took, and the import
+    times of each module as {module: (cumulative, own)}."""
+    timer = ImportTimer()
+    timer.install()
+    start = time()
+    try:
+        load(target)
+    finally:
+        seconds = time() - start
+        timer.uninstall()
+    return seconds, timer.modules
+
+
+def run_target(target, env=None):
+    """Measure ``target`` in a new python process."""
+    child_env = dict(os.environ, **(env or {}))
+    child_env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + filter(None, [child_env.get('PYTHONPATH')]))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'news.benchmarks.startup', target],
+        cwd=ROOT, env=child_env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, errors = process.communicate()
+    if process.returncode:
+        raise RuntimeError('Loading %s failed:\n%s' % (target, errors))
+    # the results are the last line, after anything loading printed
+    return json.loads(output.splitlines()[-1])
+
+
+def run_benchmarks(targets=TARGETS, repeat=3, env=None, top=20):
+    """
+    Start each of ``targets`` ``repeat`` times, and return by target its
+    best startup seconds, and the ``top`` modules by cumulative import
+    time in that run, as a list of (module, cumulative, own) seconds.
+    ``env`` is added to the processes' environment.
+    """
+    results = {}
+    for target in targets:
+        runs = [run_target(target, env) for i in range(repeat)]
+        best = min(runs, key=lambda run: run['seconds'])
+        modules = sorted(best['modules'].items(),
+                         key=lambda item: item[1][0], reverse=True)
+        results[target] = {
+            'seconds': round(best['seconds'], 4),
+            'modules': [(name, round(cumulative, 4), round(own, 4))
+                        for name, (cumulative, own) in modules[:top]],
+        }
+    return results
+
+
+if __name__ == '__main__':
+    seconds, modules = measure(sys.argv[1])
+    sys.stdout.write('\n' + json.dumps({'seconds': seconds, 'modules': modules}))
@@ -0,0 +1,148 @@
+"""
+A statsd client that buffers metrics in memory and sends them in
+batches, rather than a UDP packet for each.
+
+Use it with::
+
+    STATSD_CLIENT = 'news.buffered_statsd'
+
+Counters with the same name and sample rate are added together, so a
+view counted a thousand times between flushes is a single line. Timers,
+gauges and sets are kept as they are. The buffer is sent as packets of
+as many metrics as fit in the client's maxudpsize, once
+STATSD_BUFFER_SIZE metrics have built up, or STATSD_FLUSH_INTERVAL
+seconds after the first, and when the process exits.
+
+Metrics that couldn't be sent are counted, and the count is sent with
+the next flush as the counter news.statsd.dropped.
+
+A process forked from one that has used the client, like a celery
+prefork child of a worker that warmed up, starts with an empty buffer,
+lock and flush timer of its own. What was buffered is left to the parent
+to send.
+"""
+import atexit
+import os
+import random
+import socket
+import threading
+
+from django.conf import settings
+
+from celery.signals import worker_process_shutdown
+from statsd import client
+
+
+STATSD_BUFFER_SIZE = getattr(settings, 'STATSD_BUFFER_SIZE', 1000)
+STATSD_FLUSH_INTERVAL = getattr(settings, 'STATSD_FLUSH_INTERVAL', 5)
+
+_clients = []
+
+
+class StatsClient(client.StatsClient):
+    def __init__(self, host='localhost', port=8125, prefix=None,
+                 maxudpsize=512, buffer_size=None, flush_interval=None):
+        super(StatsClient, self).__init__(host, port, prefix, maxudpsize)
+        self.buffer_size = buffer_size or STATSD_BUFFER_SIZE
+        self.flush_interval = flush_interval or STATSD_FLUSH_INTERVAL
+        self.dropped = 0
+        self.reset()
+        _clients.append(self)
+
+    def reset(self):
+        """Start with an empty buffer, for the current process."""
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        # {(stat, rate): count}
+        self.counters = {}
+        # everything else, ready to send
+        self.lines = []
+        self.timer = None
+        self.unreported_drops = 0
+
+    def check_fork(self):
+        # Forked, the buffer is the parent's to send, the timer thread
+        # is gone and the lock could have been held by another thread.
+        if self.pid != os.getpid():
+            self.reset()
+
+    def incr(self, stat, count=1, rate=1):
+        """Add ``count`` to a counter, to be sent with the next flush."""
+        if rate < 1 and random.random() > rate:
+            return
+        self.check_fork()
+        with self.lock:
+            key = (stat, rate)
+            self.counters[key] = self.counters.get(key, 0) + count
+        self.buffered()
+
+    def _after(self, data):
+        if data:
+            self.check_fork()
+            with self.lock:
+                # pipelines hand over several at once
+                self.lines.extend(data.split('\n'))
+            self.buffered()
+
+    def buffered(self):
+        with self.lock:
+            flush = len(self.counters) + len(self.lines) >= self.buffer_size
+            if not flush and self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Send everything buffered."""
+        self.check_fork()
+        with self.lock:
+            counters, self.counters = self.counters, {}
+            lines, self.lines = self.lines, []
+            dropped, self.unreported_drops = self.unreported_drops, 0
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+        if dropped:
+            counters[('news.statsd.dropped', 1)] = (
+                counters.get(('news.statsd.dropped', 1), 0) + dropped)
+        for (stat, rate), count in counters.items():
+            value = '%s|c' % count
+            if rate < 1:
+                value += '|@%s' % rate
+            lines.append(self._prepare(stat, value, 1))
+
+        packet = []
+        size = 0
+        for line in lines:
+            if packet and size + len(line) + 1 > self._maxudpsize:
+                self.send_packet(packet)
+                packet = []
+                size = 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            self.send_packet(packet)
+
+    def send_packet(self, lines):
+        try:
+            self._sock.sendto('\n'.join(lines).encode('ascii'), self._addr)
+        except socket.error:
+            with self.lock:
+                self.dropped += len(lines)
+                self.unreported_drops += len(lines)
+
+
+def flush_all():
+    for stats_client in _clients:
+        stats_client.flush()
+
+
+atexit.register(flush_all)
+
+
+@worker_process_shutdown.connect
+def flush_on_shutdown(**kwargs):
+    flush_all()
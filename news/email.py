@@ -1,29 +1,227 @@
+"""
+Email address validation, with flanker.
+
+Whether a domain has a mail exchanger takes DNS lookups and connecting
+to it, so the answer for each domain is cached: found exchangers for
+EMAIL_DOMAIN_TTL seconds, and domains without one for
+EMAIL_DOMAIN_NEGATIVE_TTL. The cache is also flanker's MX cache, so
+its own validation uses it. get_mail_exchangers looks up many domains at
+once, those not cached concurrently, for bulk validation.
+
+EMAIL_DOMAIN_RESOLVER is the dotted path of the function that looks a
+domain up, returning its mail exchanger or None, or raising
+ResolverError if it can't tell, e.g. on a DNS timeout. It's dns_resolver
+by default; local_resolver is a stand-in for tests and benchmarks.
+Domains that can't be looked up aren't cached, and their addresses are
+accepted, rather than turning away everyone at the domain until the
+negative TTL is up.
+"""
+import collections
 import logging
+from functools import partial
+from hashlib import sha1
+from multiprocessing.pool import ThreadPool
 
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import force_bytes
+from django.utils.module_loading import import_by_path
+
+import dnsq
+import flanker.addresslib
 from flanker.addresslib import address, validate
 
 
 log = logging.getLogger(__name__)
 
+EMAIL_DOMAIN_TTL = getattr(settings, 'EMAIL_DOMAIN_TTL', 7 * 24 * 60 * 60)
+EMAIL_DOMAIN_NEGATIVE_TTL = getattr(settings, 'EMAIL_DOMAIN_NEGATIVE_TTL', 60 * 60)
+EMAIL_DOMAIN_THREADS = getattr(settings, 'EMAIL_DOMAIN_THREADS', 10)
+EMAIL_DOMAIN_RESOLVER = getattr(settings, 'EMAIL_DOMAIN_RESOLVER',
+                                'news.email.dns_resolver')
 
-def get_valid_email(email):
-    """Return (valid email address or None, True if email is a suggestion).
+# what flanker caches for a domain without a mail exchanger
+NO_EXCHANGER = 'False'
+# the mail exchanger of a domain that couldn't be looked up
+UNRESOLVED = object()
 
-    It uses flanker to correct commonly misspelled domains (e.g. gmil.com)
-    and to check to make sure MX records exist for the domain.
+
+class ResolverError(Exception):
+    """The resolver couldn't tell whether a domain has a mail exchanger."""
+
+
+class DomainCache(collections.MutableMapping):
     """
-    if not email:
-        return None, None
+    Mail exchangers by domain, in the Django cache, with the dict
+    interface flanker expects of its MX cache. Domains with no mail
+    exchanger are stored as NO_EXCHANGER, for a shorter time.
+    """
+    def key(self, domain):
+        # domains that fail validation can have anything in them
+        return 'email-domain:%s' % sha1(force_bytes(domain.lower())).hexdigest()
+
+    def __getitem__(self, domain):
+        return cache.get(self.key(domain))
+
+    def __setitem__(self, domain, exchanger):
+        timeout = (EMAIL_DOMAIN_NEGATIVE_TTL if exchanger == NO_EXCHANGER
+                   else EMAIL_DOMAIN_TTL)
+        cache.set(self.key(domain), exchanger, timeout)
+
+    def __delitem__(self, domain):
+        cache.delete(self.key(domain))
+
+    def __iter__(self):
+        return iter([])
+
+    def __len__(self):
+        return 0
+
+
+mx_cache = DomainCache()
+flanker.addresslib.set_mx_cache(mx_cache)
+
+
+def dns_resolver(domain):
+    """Look up the domain's MX hosts, and return the first that can be
+    connected to, the way flanker does.
+
+    flanker's own lookup gives no MX hosts when DNS fails, so dnsq, which
+    it uses, is called here to tell a failure, like a timeout or
+    SERVFAIL, from a domain that doesn't exist or has no MX or A record.
+    """
+    fqdn = domain if domain.endswith('.') else domain + '.'
+    # flanker tries twice too
+    for attempt in range(2):
+        try:
+            mx_hosts = dnsq.mx_hosts_for(fqdn)
+            break
+        except Exception as e:
+            error = e
+    else:
+        raise ResolverError('Could not look up %s: %s' % (domain, error))
+    if not mx_hosts:
+        return None
+    return validate.connect_to_mail_exchanger(mx_hosts)
+
+
+def local_resolver(domain):
+    """Give every domain a mail exchanger, except those under .invalid."""
+    if domain.lower().rstrip('.').endswith('.invalid'):
+        return None
+    return 'mx.%s' % domain
+
+
+def get_resolver():
+    return import_by_path(EMAIL_DOMAIN_RESOLVER)
+
+
+def resolve(resolver, domain):
+    """Return the domain's mail exchanger from ``resolver``, None if it
+    has none, or UNRESOLVED if the resolver couldn't tell, caching it
+    unless it's UNRESOLVED."""
+    try:
+        exchanger = resolver(domain)
+    except ResolverError as e:
+        log.warning(str(e))
+        return UNRESOLVED
+    mx_cache[domain] = exchanger or NO_EXCHANGER
+    return exchanger
+
+
+def cached_mail_exchanger(domain):
+    """Return (whether the domain is cached, its mail exchanger or None)."""
+    exchanger = mx_cache[domain]
+    if exchanger is None:
+        return False, None
+    return True, None if exchanger == NO_EXCHANGER else exchanger
+
+
+def get_mail_exchanger(domain):
+    """Return the domain's mail exchanger, None if it has none, or
+    UNRESOLVED if it couldn't be looked up."""
+    cached, exchanger = cached_mail_exchanger(domain)
+    if not cached:
+        exchanger = resolve(get_resolver(), domain)
+    return exchanger
+
+
+def get_mail_exchangers(domains):
+    """
+    Return the mail exchangers of ``domains`` by lower cased domain, None
+    for those without and UNRESOLVED for those that couldn't be looked
+    up. The domains that aren't cached are looked up concurrently,
+    EMAIL_DOMAIN_THREADS at a time.
+    """
+    exchangers = {}
+    missing = []
+    for domain in set(d.lower() for d in domains):
+        cached, exchangers[domain] = cached_mail_exchanger(domain)
+        if not cached:
+            missing.append(domain)
+
+    if missing:
+        pool = ThreadPool(min(EMAIL_DOMAIN_THREADS, len(missing)))
+        try:
+            found = pool.map(partial(resolve, get_resolver()), missing)
+        finally:
+            pool.close()
+            pool.join()
+        exchangers.update(zip(missing, found))
+
+    return exchangers
+
+
+def email_domain(email):
+    return email.rsplit('@', 1)[-1]
+
+
+def suggest_email(email):
     # returns None if it has no alternate or if the email is invalid
-    good_email = validate.suggest_alternate(email) or email
+    return validate.suggest_alternate(email) or email
+
+
+def validated(email, good_email, exchanger):
+    """Validate ``good_email``, suggested for ``email``, whose domain has
+    been looked up, and return what get_valid_email does."""
     suggestion = False
     if email != good_email:
         log.info('Using suggested alternate email')
         suggestion = True
 
-    good_email = address.validate_address(good_email)
+    if exchanger is UNRESOLVED:
+        # flanker would fail to look the domain up too
+        good_email = address.parse(good_email, addr_spec_only=True)
+    else:
+        good_email = address.validate_address(good_email)
     if isinstance(good_email, address.EmailAddress):
         good_email = good_email.address
 
     # returns None if the email is invalid, or the email if all's well
     return good_email, suggestion
+
+
+def get_valid_email(email):
+    """Return (valid email address or None, True if email is a suggestion).
+
+    It uses flanker to correct commonly misspelled domains (e.g. gmil.com)
+    and to check to make sure MX records exist for the domain.
+    """
+    if not email:
+        return None, None
+    good_email = suggest_email(email)
+    # cache the domain for flanker, with the resolver and the negative TTL
+    exchanger = get_mail_exchanger(email_domain(good_email))
+    return validated(email, good_email, exchanger)
+
+
+def get_valid_emails(emails):
+    """get_valid_email for each of ``emails``, with their domains looked
+    up all at once."""
+    suggested = [suggest_email(email) if email else None for email in emails]
+    exchangers = get_mail_exchangers(email_domain(good_email)
+                                     for good_email in suggested if good_email)
+    return [validated(email, good_email,
+                      exchangers[email_domain(good_email).lower()])
+            if email else (None, None)
+            for email, good_email in zip(emails, suggested)]
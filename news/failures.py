@@ -0,0 +1,221 @@
+"""
+Buffered recording of failed tasks.
+
+During an ET outage thousands of tasks can fail at once, and writing a
+FailedTask for each as it happens hammers the database. Instead each
+worker process keeps the failures in a buffer, and saves them with a
+single bulk_create once FAILED_TASK_BUFFER_SIZE have built up, or
+FAILED_TASK_BUFFER_SECONDS after the first, or when the worker shuts
+down.
+
+If the database can't be written to, the failures are saved to a file in
+FAILED_TASK_SPILL_DIR instead, and loaded again by the next flush that
+works, in whichever worker that is.
+
+Tracebacks are stored once each, as TaskTracebacks shared by all the
+FailedTasks that failed the same way.
+
+If a batch can't be saved for any other reason, its failures are saved
+one at a time, so only the ones that can't be saved are lost, and those
+are logged.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from hashlib import sha1
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils.encoding import force_text
+from django.utils.timezone import now, utc
+
+from celery.signals import worker_process_shutdown
+from django_statsd.clients import statsd
+
+from news.models import FailedTask, FailedTaskName, TaskTraceback
+
+
+log = logging.getLogger(__name__)
+
+FAILED_TASK_BUFFER_SIZE = getattr(settings, 'FAILED_TASK_BUFFER_SIZE', 100)
+FAILED_TASK_BUFFER_SECONDS = getattr(settings, 'FAILED_TASK_BUFFER_SECONDS', 10)
+FAILED_TASK_SPILL_DIR = getattr(settings, 'FAILED_TASK_SPILL_DIR',
+                                os.path.join(tempfile.gettempdir(),
+                                             'basket-failed-tasks'))
+
+
+def traceback_ids(texts):
+    """Return a dict of the TaskTraceback ids for ``texts``, by text,
+    adding the ones that aren't stored yet."""
+    hashes = dict((sha1(text.encode('utf-8')).hexdigest(), text)
+                  for text in texts)
+    # touched before they're looked up, so retention.purge_failed_tasks
+    # won't take them as orphans from under the new FailedTasks
+    TaskTraceback.objects.filter(hash__in=hashes.keys()).update(last_used=now())
+    existing = dict(TaskTraceback.objects.filter(hash__in=hashes.keys())
+                    .values_list('hash', 'id'))
+    missing = [TaskTraceback(hash=h, text=text)
+               for h, text in hashes.items() if h not in existing]
+    if missing:
+        TaskTraceback.objects.bulk_create(missing)
+        existing.update(TaskTraceback.objects
+                        .filter(hash__in=[t.hash for t in missing])
+                        .values_list('hash', 'id'))
+    return dict((text, existing[h]) for h, text in hashes.items())
+
+
+def save_failures(failures):
+    """Save a list of failures, as made by FailureRecorder.record, as
+    FailedTasks. Any already saved are skipped."""
+    by_task_id = dict((f['task_id'], f) for f in failures)
+    saved = FailedTask.objects.filter(task_id__in=by_task_id.keys())
+    for task_id in saved.values_list('task_id', flat=True):
+        del by_task_id[task_id]
+    failures = by_task_id.values()
+    if not failures:
+        return
+
+    with transaction.atomic():
+        tracebacks = traceback_ids(set(f['einfo'] for f in failures))
+        FailedTask.objects.bulk_create([
+            FailedTask(
+                when=datetime.fromtimestamp(f['when'], utc),
+                task_id=f['task_id'],
+                name=f['name'],
+                args=f['args'],
+                kwargs=f['kwargs'],
+                exc=f['exc'],
+                traceback_id=tracebacks[f['einfo']],
+            ) for f in failures])
+        for name in set(f['name'] for f in failures):
+            FailedTaskName.add(name)
+
+
+class FailureRecorder(object):
+    def __init__(self, size=None, seconds=None, spill_dir=None):
+        self.size = size or FAILED_TASK_BUFFER_SIZE
+        self.seconds = seconds or FAILED_TASK_BUFFER_SECONDS
+        self.spill_dir = spill_dir or FAILED_TASK_SPILL_DIR
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.timer = None
+
+    def record(self, task_id, name, args, kwargs, exc, einfo, flush=False):
+        """Record a failed task, saving it now if ``flush``."""
+        with self.lock:
+            self.buffer.append({
+                'when': time.time(),
+                'task_id': task_id,
+                'name': name,
+                'args': args,
+                'kwargs': kwargs,
+                'exc': force_text(repr(exc), errors='replace'),
+                # the traceback, which str() gives, is more use than the
+                # repr() of a celery.datastructures.ExceptionInfo. It can be
+                # a byte string, with anything in it.
+                'einfo': force_text(getattr(einfo, 'traceback', einfo),
+                                    errors='replace'),
+            })
+            flush = flush or len(self.buffer) >= self.size
+            if not flush and self.timer is None:
+                self.timer = threading.Timer(self.seconds, self.flush_in_thread)
+                self.timer.daemon = True
+                self.timer.start()
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Save everything that's been recorded, and anything spilled."""
+        with self.lock:
+            failures, self.buffer = self.buffer, []
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        failures = self.unspill() + failures
+        if not failures:
+            return
+
+        try:
+            save_failures(failures)
+        except DatabaseError:
+            log.exception('Could not save %d failed tasks' % len(failures))
+            self.spill(failures)
+            return
+        except Exception:
+            log.exception('Could not save %d failed tasks, saving them one '
+                          'at a time' % len(failures))
+            self.save_each(failures)
+            return
+        statsd.incr('news.failed_tasks.saved', len(failures))
+
+    def save_each(self, failures):
+        """Save ``failures`` one at a time, logging any that can't be."""
+        saved = 0
+        spilled = []
+        for failure in failures:
+            try:
+                save_failures([failure])
+            except DatabaseError:
+                spilled.append(failure)
+            except Exception:
+                log.exception('Could not save failed task: %s'
+                              % json.dumps(failure, default=repr))
+                statsd.incr('news.failed_tasks.lost')
+            else:
+                saved += 1
+        if spilled:
+            self.spill(spilled)
+        if saved:
+            statsd.incr('news.failed_tasks.saved', saved)
+
+    def flush_in_thread(self):
+        try:
+            self.flush()
+        finally:
+            # the timer thread has its own connection
+            connection.close()
+
+    def spill_path(self):
+        return os.path.join(self.spill_dir, 'spill-%d.jsonl' % os.getpid())
+
+    def spill(self, failures):
+        if not os.path.isdir(self.spill_dir):
+            os.makedirs(self.spill_dir)
+        with open(self.spill_path(), 'a') as spill_file:
+            for failure in failures:
+                spill_file.write(json.dumps(failure, default=repr) + '\n')
+        statsd.incr('news.failed_tasks.spilled', len(failures))
+
+    def unspill(self):
+        """Load and remove the failures spilled by any worker."""
+        if not os.path.isdir(self.spill_dir):
+            return []
+
+        failures = []
+        for filename in os.listdir(self.spill_dir):
+            if not filename.startswith('spill-'):
+                continue
+            path = os.path.join(self.spill_dir, filename)
+            # Claim the file so no other worker loads it too
+            claimed = os.path.join(self.spill_dir,
+                                   'loading-%d-%s' % (os.getpid(), filename))
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            with open(claimed) as spill_file:
+                failures.extend(json.loads(line) for line in spill_file)
+            os.remove(claimed)
+        return failures
+
+
+failure_recorder = FailureRecorder()
+
+
+@worker_process_shutdown.connect
+def flush_failures(**kwargs):
+    failure_recorder.flush()
@@ -1,8 +1,8 @@
 from django.core.validators import validate_email
 from django.db import models
 from django.forms import TextInput
+from django.utils.functional import cached_property
 
-import product_details
 from south.modelsinspector import add_introspection_rules
 
 
@@ -28,10 +28,43 @@ class CommaSeparatedEmailField(models.TextField):
         return super(CommaSeparatedEmailField, self).formfield(**kwargs)
 
 
-ENGLISH_LANGUAGE_CHOICES = sorted(
-    [(key, u'{0} ({1})'.format(key, value['English']))
-     for key, value in product_details.languages.items()]
-)
+class LazyChoices(object):
+    """
+    A list of field choices that isn't made until it's first used, so
+    that defining a model doesn't mean loading what they're made from.
+    """
+    def __init__(self, func):
+        self.func = func
+
+    @cached_property
+    def choices(self):
+        return self.func()
+
+    def __iter__(self):
+        return iter(self.choices)
+
+    def __len__(self):
+        return len(self.choices)
+
+    def __getitem__(self, index):
+        return self.choices[index]
+
+    def __nonzero__(self):
+        # Django checks whether a field has choices when it's defined
+        return True
+
+
+def english_language_choices():
+    # importing it loads all its JSON files
+    import product_details
+
+    return sorted(
+        [(key, u'{0} ({1})'.format(key, value['English']))
+         for key, value in product_details.languages.items()]
+    )
+
+
+ENGLISH_LANGUAGE_CHOICES = LazyChoices(english_language_choices)
 
 
 class LocaleField(models.CharField):
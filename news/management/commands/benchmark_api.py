@@ -0,0 +1,60 @@
+from datetime import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from news.benchmarks.api import Operations, run_benchmarks
+from news.benchmarks.base import change, load_results, save_results, test_database
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the throughput of the news API and ET tasks against a '
+            'fake ET, in a throwaway test database, and save the results as '
+            'JSON.')
+    option_list = BaseCommand.option_list + (
+        make_option('--iterations', type='int', default=100,
+                    help='Number of times to run each operation.'),
+        make_option('--latency', type='float', default=0.05,
+                    help='Seconds each fake ET call takes.'),
+        make_option('--jitter', type='float', default=0,
+                    help='Up to this many more seconds are added to each '
+                         'fake ET call at random.'),
+        make_option('--ops', default=','.join(Operations.names),
+                    help='Comma separated operations to run, out of '
+                         '%s.' % ', '.join(Operations.names)),
+        make_option('--output',
+                    help='File to save the results to. Defaults to '
+                         'benchmark-api-<time>.json.'),
+        make_option('--compare',
+                    help='Results file of an earlier run to compare with.'),
+    )
+
+    def handle(self, *args, **options):
+        names = [n.strip() for n in options['ops'].split(',') if n.strip()]
+        unknown = set(names) - set(Operations.names)
+        if unknown:
+            raise CommandError('Unknown operations: %s' % ', '.join(sorted(unknown)))
+        previous = load_results(options['compare']) if options['compare'] else {}
+
+        with test_database(max(int(options['verbosity']) - 1, 0)):
+            results = run_benchmarks(options['iterations'], options['latency'],
+                                     options['jitter'], names)
+
+        output = options['output'] or datetime.now().strftime(
+            'benchmark-api-%Y%m%d-%H%M%S.json')
+        save_results(output, results, iterations=options['iterations'],
+                     latency=options['latency'], jitter=options['jitter'])
+
+        for name in names:
+            result = results[name]
+            line = ('%-14s %8s ops/s  p50 %8sms  p99 %8sms  %5s queries/op  '
+                    'ET/op %s  errors %d' % (
+                        name, result['ops_per_sec'], result['p50_ms'],
+                        result['p99_ms'], result['db_queries_per_op'],
+                        result['et_calls_per_op'], result['errors']))
+            if name in previous:
+                line += '  (ops/s %+.1f%%, p99 %+.1f%%)' % (
+                    change(previous[name]['ops_per_sec'], result['ops_per_sec']) or 0,
+                    change(previous[name]['p99_ms'], result['p99_ms']) or 0)
+            self.stdout.write(line)
+        self.stdout.write('Results saved to %s' % output)
@@ -0,0 +1,53 @@
+from datetime import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from news.benchmarks.base import change, load_results, ms, save_results
+from news.benchmarks.startup import TARGETS, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Time how long cold web and worker processes take to start, and '
+            'the imports that take longest, and save the results as JSON.')
+    option_list = BaseCommand.option_list + (
+        make_option('--targets', default=','.join(TARGETS),
+                    help='Comma separated modules, or .wsgi files relative to '
+                         'the project, to start. Defaults to %s.' % ', '.join(TARGETS)),
+        make_option('--repeat', type='int', default=3,
+                    help='Number of times to start each target, keeping the '
+                         'fastest.'),
+        make_option('--top', type='int', default=15,
+                    help='Number of the slowest imports to show.'),
+        make_option('--fast-start', action='store_true', default=False,
+                    help='Start with BASKET_FAST_START set.'),
+        make_option('--output',
+                    help='File to save the results to. Defaults to '
+                         'benchmark-startup-<time>.json.'),
+        make_option('--compare',
+                    help='Results file of an earlier run to compare with.'),
+    )
+
+    def handle(self, *args, **options):
+        targets = [t.strip() for t in options['targets'].split(',') if t.strip()]
+        previous = load_results(options['compare']) if options['compare'] else {}
+        env = {'BASKET_FAST_START': '1'} if options['fast_start'] else {}
+
+        results = run_benchmarks(targets, options['repeat'], env, options['top'])
+
+        output = options['output'] or datetime.now().strftime(
+            'benchmark-startup-%Y%m%d-%H%M%S.json')
+        save_results(output, results, repeat=options['repeat'],
+                     fast_start=options['fast_start'])
+
+        for target in targets:
+            result = results[target]
+            line = '%s: %sms' % (target, ms(result['seconds']))
+            if target in previous:
+                line += ' (%+.1f%%)' % (
+                    change(previous[target]['seconds'], result['seconds']) or 0)
+            self.stdout.write(line)
+            self.stdout.write('  %-50s %10s %10s' % ('module', 'total ms', 'own ms'))
+            for name, cumulative, own in result['modules']:
+                self.stdout.write('  %-50s %10s %10s' % (name, ms(cumulative), ms(own)))
+        self.stdout.write('Results saved to %s' % output)
@@ -0,0 +1,72 @@
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from news.benchmarks.base import change, load_results, save_results, test_database
+from news.benchmarks.micro import SIZES, case_names, regressions, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Time the news.utils helpers against synthetic newsletter '
+            'registries and block lists, in a throwaway test database, and '
+            'check them against a stored baseline.')
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', default=','.join(str(s) for s in SIZES),
+                    help='Comma separated numbers of newsletters and '
+                         'blocked domains to time with.'),
+        make_option('--cases',
+                    help='Comma separated cases to run, out of %s. '
+                         'Defaults to all of them.' % ', '.join(case_names())),
+        make_option('--repeat', type='int', default=3,
+                    help='Number of timing runs of each case to take the '
+                         'best of.'),
+        make_option('--baseline', default='benchmark-utils-baseline.json',
+                    help='Baseline results file.'),
+        make_option('--save-baseline', action='store_true', default=False,
+                    help='Save the results as the baseline, rather than '
+                         'checking them against it.'),
+        make_option('--tolerance', type='float', default=0.25,
+                    help='Fraction slower than the baseline a case can be '
+                         'before it counts as a regression.'),
+    )
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options['sizes'].split(',') if s.strip()]
+        names = None
+        if options['cases']:
+            names = [n.strip() for n in options['cases'].split(',') if n.strip()]
+            unknown = set(names) - set(case_names())
+            if unknown:
+                raise CommandError('Unknown cases: %s' % ', '.join(sorted(unknown)))
+        baseline_path = options['baseline']
+        if not options['save_baseline'] and not os.path.exists(baseline_path):
+            raise CommandError('No baseline at %s. Make one with --save-baseline.'
+                               % baseline_path)
+        baseline = {} if options['save_baseline'] else load_results(baseline_path)
+
+        with test_database(max(int(options['verbosity']) - 1, 0)):
+            results = run_benchmarks(sizes, options['repeat'], names)
+
+        for key in sorted(results):
+            now = results[key]['us_per_call']
+            if now is None:
+                self.stdout.write('%-40s %15s' % (key, 'too slow'))
+                continue
+            line = '%-40s %12.3f us' % (key, now)
+            if baseline.get(key, {}).get('us_per_call'):
+                line += '  %+.1f%%' % change(baseline[key]['us_per_call'], now)
+            self.stdout.write(line)
+
+        if options['save_baseline']:
+            save_results(baseline_path, results, sizes=sizes)
+            self.stdout.write('Baseline saved to %s' % baseline_path)
+            return
+
+        slower = regressions(results, baseline, options['tolerance'])
+        if slower:
+            raise CommandError('Slower than the baseline:\n' + '\n'.join(
+                '%s: %s us, was %.3f us' % (key, 'too slow' if now is None else '%.3f' % now,
+                                            before)
+                for key, before, now in slower))
+        self.stdout.write('No regressions against %s' % baseline_path)
@@ -0,0 +1,32 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from news.spool import drain_spool
+
+
+class Command(BaseCommand):
+    help = ('Replay the writes to ExactTarget that were spooled while it '
+            'was down. Only run one of these at a time.')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=100,
+                    help='Number of spooled writes to replay at a time.'),
+        make_option('--delay', type='float', default=1,
+                    help='Seconds to wait between batches.'),
+        make_option('--forever', action='store_true', default=False,
+                    help='Keep running, checking the spool every --idle '
+                         'seconds once it is empty or ET is still down.'),
+        make_option('--idle', type='float', default=60,
+                    help='Seconds to wait between checks with --forever.'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        while True:
+            count = drain_spool(options['batch_size'], options['delay'])
+            if count or verbosity > 1:
+                self.stdout.write('Replayed %d spooled writes' % count)
+            if not options['forever']:
+                break
+            time.sleep(options['idle'])
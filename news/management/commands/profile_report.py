@@ -0,0 +1,50 @@
+import os
+import pstats
+from cStringIO import StringIO
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from news.middleware import PROFILE_DIR, profile_files
+
+
+class Command(BaseCommand):
+    help = ('Report the functions where the most time went in the request '
+            'profiles saved by news.middleware.ProfilerMiddleware.')
+    option_list = BaseCommand.option_list + (
+        make_option('--dir', default=PROFILE_DIR,
+                    help='Directory of the saved profiles.'),
+        make_option('--view',
+                    help='Only use the profiles of views whose dotted name '
+                         'starts with this, e.g. news.views.subscribe.'),
+        make_option('--top', type='int', default=25,
+                    help='Number of functions to list.'),
+        make_option('--sort', default='cumulative',
+                    choices=['cumulative', 'tottime', 'calls'],
+                    help='What to rank the functions by: cumulative, '
+                         'tottime or calls.'),
+    )
+
+    def handle(self, *args, **options):
+        paths = profile_files(options['dir'])
+        if options['view']:
+            paths = [p for p in paths
+                     if os.path.basename(p).startswith(options['view'] + '.')]
+        if not paths:
+            raise CommandError('No profiles found in %s' % options['dir'])
+
+        views = {}
+        for path in paths:
+            # <view>.<time>.<ms>ms.<pid>.<random>.prof
+            view = os.path.basename(path).rsplit('.', 5)[0]
+            views[view] = views.get(view, 0) + 1
+        for view, count in sorted(views.items()):
+            self.stdout.write('%6d  %s' % (count, view))
+        self.stdout.write('')
+
+        report = StringIO()
+        stats = pstats.Stats(paths[0], stream=report)
+        for path in paths[1:]:
+            stats.add(path)
+        stats.strip_dirs().sort_stats(options['sort']).print_stats(options['top'])
+        self.stdout.write(report.getvalue())
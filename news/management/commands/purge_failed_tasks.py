@@ -0,0 +1,43 @@
+import gzip
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+
+from news.retention import FAILED_TASK_ARCHIVE_DIR, purge_failed_tasks
+
+
+class Command(BaseCommand):
+    help = ('Delete the FailedTasks older than FAILED_TASK_RETENTION allows, '
+            'archiving them first.')
+    option_list = BaseCommand.option_list + (
+        make_option('--archive-dir', default=FAILED_TASK_ARCHIVE_DIR,
+                    help='Directory to write the gzipped JSON lines archive '
+                         'to. Defaults to FAILED_TASK_ARCHIVE_DIR.'),
+        make_option('--no-archive', action='store_true', default=False,
+                    help="Just delete them, don't archive them."),
+        make_option('--batch-size', type='int', default=1000,
+                    help='Number of tasks to delete at a time.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['no_archive']:
+            count = purge_failed_tasks(batch_size=options['batch_size'])
+            self.stdout.write('Deleted %d failed tasks' % count)
+            return
+
+        archive_dir = options['archive_dir']
+        if not archive_dir:
+            raise CommandError('Set FAILED_TASK_ARCHIVE_DIR or pass '
+                               '--archive-dir or --no-archive')
+        path = os.path.join(archive_dir, now().strftime(
+            'failed-tasks-%Y%m%d-%H%M%S.jsonl.gz'))
+        archive = gzip.open(path, 'wb')
+        try:
+            count = purge_failed_tasks(archive, options['batch_size'])
+        finally:
+            archive.close()
+        if not count:
+            os.remove(path)
+        self.stdout.write('Archived and deleted %d failed tasks' % count)
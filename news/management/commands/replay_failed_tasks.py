@@ -0,0 +1,68 @@
+import time
+from datetime import datetime
+from optparse import make_option
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import make_aware, utc
+
+from news.models import FailedTaskName
+from news.replay import (REPLAY_BATCH_SIZE, REPLAY_RATE, batch_delay,
+                         failed_tasks, replay_batch)
+
+
+def parse_time(value):
+    for fmt in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return make_aware(datetime.strptime(value, fmt), utc)
+        except ValueError:
+            pass
+    raise CommandError('Times are "YYYY-MM-DD" or "YYYY-MM-DD HH:MM" in '
+                       'UTC, not %r' % value)
+
+
+class Command(BaseCommand):
+    help = ('Queue FailedTasks to run again, oldest first, and delete them. '
+            'Repeats of the same call for a subscriber are only queued once.')
+    option_list = BaseCommand.option_list + (
+        make_option('--name',
+                    help='Only replay tasks with this name, e.g. '
+                         'news.tasks.update_user.'),
+        make_option('--since',
+                    help='Only replay tasks that failed at or after this '
+                         'time (UTC).'),
+        make_option('--until',
+                    help='Only replay tasks that failed before this time '
+                         '(UTC).'),
+        make_option('--start-id', type='int', default=0,
+                    help='Only replay tasks after this id, to resume an '
+                         'earlier run.'),
+        make_option('--batch-size', type='int', default=REPLAY_BATCH_SIZE,
+                    help='Number of tasks to replay at a time.'),
+        make_option('--rate', type='float', default=REPLAY_RATE,
+                    help='Tasks to queue per second. 0 for no limit.'),
+    )
+
+    def handle(self, *args, **options):
+        since = options['since'] and parse_time(options['since'])
+        until = options['until'] and parse_time(options['until'])
+        start_id = options['start_id']
+        run_id = uuid4().hex
+        total_queued = total_skipped = 0
+        while True:
+            queryset = failed_tasks(options['name'], since, until,
+                                    start_id=start_id)
+            queued, skipped, last_id = replay_batch(
+                queryset, options['batch_size'], run_id)
+            if last_id is None:
+                break
+            start_id = last_id
+            total_queued += queued
+            total_skipped += skipped
+            if int(options['verbosity']) > 1:
+                self.stdout.write('Replayed up to id %d' % last_id)
+            time.sleep(batch_delay(queued, options['rate']))
+
+        FailedTaskName.prune()
+        self.stdout.write('Queued %d tasks, skipped %d duplicates'
+                          % (total_queued, total_skipped))
@@ -0,0 +1,40 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from news.backends.fake_et import FakeETServer
+
+
+class Command(BaseCommand):
+    help = ('Run a local stand-in for ExactTarget to load test against. '
+            'Point basket at it with the EXACTTARGET_FAKE_URL setting.')
+    option_list = BaseCommand.option_list + (
+        make_option('--host', default='127.0.0.1',
+                    help='Address to listen on.'),
+        make_option('--port', type='int', default=8111,
+                    help='Port to listen on.'),
+        make_option('--latency', type='float', default=0,
+                    help='Seconds every call takes.'),
+        make_option('--jitter', type='float', default=0,
+                    help='Up to this many more seconds are added to each '
+                         'call at random.'),
+        make_option('--error-rate', type='float', default=0,
+                    help='Share of calls, 0 to 1, that fail.'),
+        make_option('--error-status', type='int', default=503,
+                    help='HTTP status the failed calls get. 500 gives a '
+                         'SOAP fault.'),
+    )
+
+    def handle(self, *args, **options):
+        server = FakeETServer((options['host'], options['port']),
+                              latency=options['latency'],
+                              jitter=options['jitter'],
+                              error_rate=options['error_rate'],
+                              error_status=options['error_status'])
+        self.stdout.write('Fake ExactTarget running at %s' % server.url)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,22 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from news.stewards import STEWARD_BATCH_SIZE, send_notifications
+
+
+class Command(BaseCommand):
+    help = ('Email the interests\' stewards about the contributor '
+            'inquiries waiting to be sent.')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=STEWARD_BATCH_SIZE,
+                    help='Number of inquiries to send at a time.'),
+        make_option('--digest', action='store_true', default=None,
+                    help='Send each steward one email of all their inquiries, '
+                         'whether or not STEWARD_DIGEST_MINUTES is set.'),
+    )
+
+    def handle(self, *args, **options):
+        count = send_notifications(options['batch_size'], options['digest'])
+        if count or int(options['verbosity']) > 1:
+            self.stdout.write('Sent %d steward notifications' % count)
@@ -1,3 +1,11 @@
+import cProfile
+import os
+import random
+import tempfile
+import time
+
+from django.conf import settings
+
 from django_statsd.clients import statsd
 from django_statsd.middleware import GraphiteRequestTimingMiddleware
 
@@ -14,3 +22,89 @@ class GraphiteViewHitCountMiddleware(GraphiteRequestTimingMiddleware):
             statsd.incr('view.count.{module}.{name}.{method}'.format(**data))
             statsd.incr('view.count.{module}.{method}'.format(**data))
             statsd.incr('view.count.{method}'.format(**data))
+
+
+PROFILE_SAMPLE_RATE = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+PROFILE_SLOW_SECONDS = getattr(settings, 'PROFILE_SLOW_SECONDS', None)
+PROFILE_DIR = getattr(settings, 'PROFILE_DIR',
+                      os.path.join(tempfile.gettempdir(), 'basket-profiles'))
+PROFILE_MAX_FILES = getattr(settings, 'PROFILE_MAX_FILES', 500)
+
+
+class ProfilerMiddleware(object):
+    """
+    Profile a sample of requests with cProfile, and save the profiles
+    as pstats files in PROFILE_DIR, for the profile_report command.
+
+    PROFILE_SAMPLE_RATE (0 to 1) of requests are profiled and saved. With
+    PROFILE_SLOW_SECONDS set every request is profiled, which has a cost,
+    and those that take longer are saved too.
+
+    Files are named <view>.<time>.<ms>ms.<pid>.<random>.prof, and only
+    the newest PROFILE_MAX_FILES are kept.
+    """
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        sampled = PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE
+        if not (sampled or PROFILE_SLOW_SECONDS is not None):
+            return None
+
+        request._profiler = cProfile.Profile()
+        request._profiler_sampled = sampled
+        request._profiler_view = '%s.%s' % (view_func.__module__,
+                                            getattr(view_func, '__name__', 'view'))
+        request._profiler_start = time.time()
+        request._profiler.enable()
+
+    def process_response(self, request, response):
+        profiler = getattr(request, '_profiler', None)
+        if profiler is None:
+            return response
+
+        profiler.disable()
+        del request._profiler
+        duration = time.time() - request._profiler_start
+        if request._profiler_sampled or duration > PROFILE_SLOW_SECONDS:
+            save_profile(profiler, request._profiler_view, duration)
+        return response
+
+
+def save_profile(profiler, view, duration):
+    if not os.path.isdir(PROFILE_DIR):
+        os.makedirs(PROFILE_DIR)
+    name = '%s.%s.%dms.%d.%08x.prof' % (view, time.strftime('%Y%m%d%H%M%S'),
+                                        duration * 1000, os.getpid(),
+                                        random.getrandbits(32))
+    path = os.path.join(PROFILE_DIR, name)
+    # write it under another name, so it's never read half written
+    profiler.dump_stats(path + '.tmp')
+    os.rename(path + '.tmp', path)
+    statsd.incr('news.profiler.saved')
+    rotate_profiles()
+
+
+def profile_files(directory=None):
+    """The paths of the saved profiles, oldest first."""
+    directory = directory or PROFILE_DIR
+    if not os.path.isdir(directory):
+        return []
+    paths = []
+    for name in os.listdir(directory):
+        if name.endswith('.prof'):
+            path = os.path.join(directory, name)
+            try:
+                paths.append((os.path.getmtime(path), path))
+            except OSError:
+                # removed since it was listed
+                continue
+    return [p for mtime, p in sorted(paths)]
+
+
+def rotate_profiles():
+    """Remove the oldest profiles past PROFILE_MAX_FILES."""
+    paths = profile_files()
+    for path in paths[:max(len(paths) - PROFILE_MAX_FILES, 0)]:
+        try:
+            os.remove(path)
+        except OSError:
+            # another process got to it first
+            pass
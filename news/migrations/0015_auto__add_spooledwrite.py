@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'SpooledWrite'
+        db.create_table(u'news_spooledwrite', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('when', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+            ('kind', self.gf('django.db.models.fields.CharField')(max_length=10, db_index=True)),
+            ('target', self.gf('django.db.models.fields.CharField')(max_length=255)),
+            ('key', self.gf('django.db.models.fields.CharField')(max_length=255, blank=True)),
+            ('data', self.gf('jsonfield.fields.JSONField')(default={})),
+        ))
+        db.send_create_signal(u'news', ['SpooledWrite'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'SpooledWrite'
+        db.delete_table(u'news_spooledwrite')
+
+
+    models = {
+        u'news.apiuser': {
+            'Meta': {'object_name': 'APIUser'},
+            'api_key': ('django.db.models.fields.CharField', [], {'default': "'8bbd75c7-2a2b-455e-8655-2b2dd5742da2'", 'max_length': '40', 'db_index': 'True'}),
+            'enabled': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '256'})
+        },
+        u'news.blockedemail': {
+            'Meta': {'object_name': 'BlockedEmail'},
+            'email_domain': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'news.failedtask': {
+            'Meta': {'object_name': 'FailedTask'},
+            'args': ('jsonfield.fields.JSONField', [], {'default': '[]'}),
+            'einfo': ('django.db.models.fields.TextField', [], {'default': 'None', 'null': 'True'}),
+            'exc': ('django.db.models.fields.TextField', [], {'default': 'None', 'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kwargs': ('jsonfield.fields.JSONField', [], {'default': '{}'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'task_id': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'when': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'})
+        },
+        u'news.interest': {
+            'Meta': {'object_name': 'Interest'},
+            '_welcome_id': ('django.db.models.fields.CharField', [], {'max_length': '64', 'blank': 'True'}),
+            'default_steward_emails': ('news.fields.CommaSeparatedEmailField', [], {'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'interest_id': ('django.db.models.fields.SlugField', [], {'unique': 'True', 'max_length': '50'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '128'})
+        },
+        u'news.localestewards': {
+            'Meta': {'unique_together': "(('interest', 'locale'),)", 'object_name': 'LocaleStewards'},
+            'emails': ('news.fields.CommaSeparatedEmailField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'interest': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['news.Interest']"}),
+            'locale': ('news.fields.LocaleField', [], {'max_length': '32'})
+        },
+        u'news.newsletter': {
+            'Meta': {'ordering': "['order']", 'object_name': 'Newsletter'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'confirm_message': ('django.db.models.fields.CharField', [], {'max_length': '64', 'blank': 'True'}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '256', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'languages': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'order': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'requires_double_optin': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'show': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'unique': 'True', 'max_length': '50'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'vendor_id': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'welcome': ('django.db.models.fields.CharField', [], {'max_length': '64', 'blank': 'True'})
+        },
+        u'news.newslettergroup': {
+            'Meta': {'object_name': 'NewsletterGroup'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '256', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'newsletters': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'newsletter_groups'", 'symmetrical': 'False', 'to': u"orm['news.Newsletter']"}),
+            'show': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'unique': 'True', 'max_length': '50'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '128'})
+        },
+        u'news.smsmessage': {
+            'Meta': {'object_name': 'SMSMessage'},
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '200', 'blank': 'True'}),
+            'message_id': ('django.db.models.fields.SlugField', [], {'max_length': '50', 'primary_key': 'True'}),
+            'vendor_id': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        u'news.spooledwrite': {
+            'Meta': {'object_name': 'SpooledWrite'},
+            'data': ('jsonfield.fields.JSONField', [], {'default': '{}'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'key': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '10', 'db_index': 'True'}),
+            'target': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'when': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'})
+        },
+        u'news.subscriber': {
+            'Meta': {'object_name': 'Subscriber'},
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'primary_key': 'True'}),
+            'fxa_id': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            'token': ('django.db.models.fields.CharField', [], {'default': "'d928961a-f5b2-4952-bc79-cb1dc0d9cb87'", 'max_length': '40', 'db_index': 'True'})
+        }
+    }
+
+    complete_apps = ['news']
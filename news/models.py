@@ -1,12 +1,9 @@
 from uuid import uuid4
 
 from django.conf import settings
-from django.core.mail import send_mail
 from django.db import models
-from django.template.loader import render_to_string
 from django.utils.timezone import now
 
-import product_details
 from celery.task import subtask
 from jsonfield import JSONField
 
@@ -194,18 +191,46 @@ def _is_query_dict(arg):
     return all(isinstance(i, list) for i in arg.values())
 
 
+class TaskTraceback(models.Model):
+    """A traceback shared by all the FailedTasks that failed the same way."""
+    hash = models.CharField(max_length=40, unique=True, help_text=u"sha1 of the text")
+    text = models.TextField()
+    last_used = models.DateTimeField(default=now, db_index=True,
+                                     help_text=u"When a FailedTask last got it")
+
+    def __unicode__(self):
+        return self.hash
+
+
 class FailedTask(models.Model):
-    when = models.DateTimeField(editable=False, default=now)
+    when = models.DateTimeField(editable=False, default=now, db_index=True)
     task_id = models.CharField(max_length=255, unique=True)
     name = models.CharField(max_length=255)
     args = JSONField(null=False, default=[])
     kwargs = JSONField(null=False, default={})
     exc = models.TextField(null=True, default=None, help_text=u"repr(exception)")
-    einfo = models.TextField(null=True, default=None, help_text=u"repr(einfo)")
+    # Tracebacks used to be stored with each task; now they're shared.
+    raw_einfo = models.TextField(null=True, default=None, db_column='einfo',
+                                 help_text=u"repr(einfo)")
+    traceback = models.ForeignKey(TaskTraceback, null=True, default=None,
+                                  on_delete=models.PROTECT)
+
+    class Meta:
+        index_together = [('name', 'when')]
 
     def __unicode__(self):
         return self.task_id
 
+    @property
+    def einfo(self):
+        if self.traceback_id:
+            return self.traceback.text
+        return self.raw_einfo
+
+    @einfo.setter
+    def einfo(self, value):
+        self.raw_einfo = value
+
     def formatted_call(self):
         """Return a string that could be evalled to repeat the original call"""
         formatted_args = [repr(arg) for arg in self.args]
@@ -248,6 +273,30 @@ class FailedTask(models.Model):
         self.delete()
 
 
+class FailedTaskName(models.Model):
+    """
+    The names of the tasks that have FailedTasks, kept up to date as they
+    fail and are cleaned up, so the admin can list them without scanning
+    the whole FailedTask table.
+    """
+    name = models.CharField(max_length=255, unique=True)
+
+    def __unicode__(self):
+        return self.name
+
+    @classmethod
+    def add(cls, name):
+        if not cls.objects.filter(name=name).exists():
+            cls.objects.get_or_create(name=name)
+
+    @classmethod
+    def prune(cls):
+        """Remove the names that no longer have any FailedTasks."""
+        for task_name in cls.objects.all():
+            if not FailedTask.objects.filter(name=task_name.name).exists():
+                task_name.delete()
+
+
 class Interest(models.Model):
     title = models.CharField(
         max_length=128,
@@ -280,16 +329,18 @@ class Interest(models.Model):
 
     def notify_stewards(self, name, email, lang, message):
         """
-        Send an email to the stewards about a new interested
-        subscriber.
+        Have the stewards emailed about a new interested subscriber,
+        which news.stewards does with others, and returns the
+        StewardNotification.
+
+        If the same inquiry is already waiting to be sent, e.g. as the
+        task making it is being retried, that's returned instead.
         """
-        email_body = render_to_string('news/get_involved/steward_email.txt', {
-            'contributor_name': name,
-            'contributor_email': email,
-            'interest': self,
-            'lang': lang,
-            'message': message,
-        })
+        message = message or ''
+        waiting = StewardNotification.objects.filter(
+            interest=self, email=email, lang=lang, message=message).first()
+        if waiting is not None:
+            return waiting
 
         # Find the right stewards for the given language.
         try:
@@ -297,10 +348,10 @@ class Interest(models.Model):
             emails = stewards.emails
         except LocaleStewards.DoesNotExist:
             emails = self.default_steward_emails
-        emails = emails.split(',')
 
-        send_mail('Inquiry about {0}'.format(self.title), email_body, 'basket@basket.mozilla.org',
-                  emails)
+        return StewardNotification.objects.create(
+            interest=self, name=name, email=email, lang=lang,
+            message=message, stewards=emails)
 
     def __unicode__(self):
         return self.title
@@ -323,12 +374,39 @@ class LocaleStewards(models.Model):
         verbose_name_plural = 'Locale Stewards'
 
     def __unicode__(self):
+        import product_details
+
         return u'Stewards for {lang_code} ({lang_name})'.format(
             lang_code=self.locale,
             lang_name=product_details.languages[self.locale]['English'],
         )
 
 
+class StewardNotification(models.Model):
+    """
+    A contributor's inquiry about an interest, waiting to be emailed to
+    its stewards. See news.stewards.
+    """
+    interest = models.ForeignKey(Interest)
+    name = models.CharField(max_length=255)
+    email = models.CharField(max_length=255)
+    lang = models.CharField(max_length=32)
+    message = models.TextField(blank=True)
+    stewards = models.TextField(help_text='Comma-separated list of the stewards\' '
+                                          'email addresses.')
+    created = models.DateTimeField(default=now, db_index=True)
+    # set while a send of it is under way
+    claim = models.CharField(max_length=32, null=True, default=None, db_index=True)
+    claimed = models.DateTimeField(null=True, default=None)
+
+    def __unicode__(self):
+        return u'{0} about {1}'.format(self.email, self.interest_id)
+
+    @property
+    def steward_list(self):
+        return [email.strip() for email in self.stewards.split(',') if email.strip()]
+
+
 class SMSMessage(models.Model):
     message_id = models.SlugField(
         primary_key=True,
@@ -345,3 +423,32 @@ class SMSMessage(models.Model):
 
     class Meta:
         verbose_name = "SMS message"
+
+
+class SpooledWrite(models.Model):
+    """
+    A write to ET that couldn't be made because ET was down (its circuit
+    breaker was open). They're replayed by the drain_et_spool command.
+    """
+    UPDATE = 'update'
+    SEND = 'send'
+    KIND_CHOICES = (
+        (UPDATE, 'Data extension update'),
+        (SEND, 'Triggered send'),
+    )
+
+    when = models.DateTimeField(editable=False, default=now)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, db_index=True)
+    target = models.CharField(
+        max_length=255,
+        help_text='Data extension or message ID the write is for',
+    )
+    key = models.CharField(
+        max_length=255, blank=True, db_index=True,
+        help_text='Token of the user the write is for, if known. Updates for '
+                  'the same data extension and token are combined.',
+    )
+    data = JSONField(null=False, default={})
+
+    def __unicode__(self):
+        return u'%s %s %s' % (self.kind, self.target, self.key)
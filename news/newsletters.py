@@ -4,18 +4,26 @@ backend-specific data for working with them in the email provider.
 It's used to lookup the backend-specific newsletter name from a
 generic one passed by the user. This decouples the API from any
 specific email provider."""
+from uuid import uuid4
+
 from django.db.models.signals import post_save
 from django.db.models.signals import post_delete
 from django.core.cache import cache
 
 from news.models import Newsletter, NewsletterGroup, SMSMessage
+from news.tracing import span
 
 
-__all__ = ('clear_newsletter_cache', 'get_sms_messages', 'newsletter_field',
-           'newsletter_name', 'newsletter_fields')
+__all__ = ('clear_newsletter_cache', 'confirm_message_id', 'get_sms_messages',
+           'mogrify_message_id', 'newsletter_field', 'newsletter_name',
+           'newsletter_fields', 'newsletters_version', 'optin_exempt',
+           'welcome_message_id')
 
 
-CACHE_KEY = "newsletters_cache_data"
+# Changed when what's cached changes, so that processes of the old and
+# new code running together during a deploy each build their own.
+CACHE_KEY = "newsletters_cache_data:2"
+VERSION_CACHE_KEY = "newsletters_cache_version"
 SMS_CACHE_KEY = "sms_messages_cache_data"
 # TODO remove after initial deployment. These values should be added to
 #   to the DB. This is so we don't miss any submissions.
@@ -30,7 +38,8 @@ def get_sms_messages():
     basket clients will send, and the values are the message IDs
     that our SMS vendor expects.
     """
-    data = cache.get(SMS_CACHE_KEY)
+    with span('cache', 'sms_messages'):
+        data = cache.get(SMS_CACHE_KEY)
     if data is None:
         # TODO have this be an empty dict when SMS_MESSAGES is removed.
         data = SMS_MESSAGES.copy()
@@ -61,10 +70,24 @@ def _newsletters():
             'groups': {
                 'group_slug': a NewsletterGroup object,
                 ...
-            }
+            },
+            'welcomes': {
+                ('newsletter_name_1', 'fr', 'T'): 'fr_WELCOME_ID_T',
+                ...
+            },
+            'optin_exempt': set of the names of newsletters that don't
+                require double opt-in,
+            'confirm_messages': [
+                ('newsletter_name_2', 'CONFIRM_ID'),
+                ...
+            ]
         }
+
+    The last three are the routing tables used by welcome_message_id,
+    optin_exempt and confirm_message_id.
     """
-    data = cache.get(CACHE_KEY)
+    with span('cache', 'newsletters'):
+        data = cache.get(CACHE_KEY)
     if data is None:
         data = _get_newsletters_data()
         data['groups'] = _get_newsletter_groups_data()
@@ -81,15 +104,80 @@ def _get_newsletter_groups_data():
 def _get_newsletters_data():
     by_name = {}
     by_vendor_id = {}
+    welcomes = {}
+    optin_exempt = set()
+    confirm_messages = []
     for nl in Newsletter.objects.all():
         by_name[nl.slug] = nl
         by_vendor_id[nl.vendor_id] = nl
+        welcome = nl.welcome.strip()
+        if welcome:
+            # Users whose language the newsletter doesn't support get it,
+            # and so its welcome, in English.
+            languages = set(lang[:2].lower() for lang in nl.language_list)
+            languages.add('en')
+            for lang in languages:
+                for fmt in ('H', 'T'):
+                    welcomes[nl.slug, lang, fmt] = mogrify_message_id(welcome, lang, fmt)
+        if not nl.requires_double_optin:
+            optin_exempt.add(nl.slug)
+        if nl.confirm_message:
+            confirm_messages.append((nl.slug, nl.confirm_message))
     return {
         'by_name': by_name,
         'by_vendor_id': by_vendor_id,
+        'welcomes': welcomes,
+        'optin_exempt': optin_exempt,
+        'confirm_messages': confirm_messages,
     }
 
 
+def mogrify_message_id(message_id, lang, format):
+    """Given a bare message ID, a language code, and a format (T or H),
+    return a message ID modified to specify that language and format.
+
+    E.g. on input ('MESSAGE', 'fr', 'T') it returns 'fr_MESSAGE_T',
+    or on input ('MESSAGE', 'pt', 'H') it returns 'pt_MESSAGE'
+
+    If `lang` is None or empty, it skips prefixing the language.
+    """
+    if lang:
+        result = "%s_%s" % (lang.lower()[:2], message_id)
+    else:
+        result = message_id
+    if format == 'T':
+        result += "_T"
+    return result
+
+
+def welcome_message_id(name, lang, format):
+    """Return the ID of the welcome message for newsletter ``name`` in
+    ``lang`` and ``format``, or None if it doesn't have one."""
+    # using get() in case old format cached
+    welcomes = _newsletters().get('welcomes', {})
+    lang = (lang or '')[:2].lower()
+    format = 'T' if format == 'T' else 'H'
+    try:
+        return welcomes[name, lang, format]
+    except KeyError:
+        return welcomes.get((name, 'en', format))
+
+
+def optin_exempt(names):
+    """Whether any of the newsletters ``names`` don't require double opt-in."""
+    exempt = _newsletters().get('optin_exempt', ())
+    return any(name in exempt for name in names)
+
+
+def confirm_message_id(names):
+    """Return the custom confirmation message of the first of the
+    newsletters ``names`` that has one, or None."""
+    for name, message_id in _newsletters().get('confirm_messages', []):
+        if name in names:
+            return message_id
+    return None
+
+
 def newsletter_field(name):
     """Lookup the backend-specific field (vendor ID) for the newsletter"""
     try:
@@ -141,6 +229,16 @@ def slug_to_vendor_id(slug):
     return _newsletters()['by_name'][slug].vendor_id
 
 
+def newsletter_ids():
+    """Return the ids of the newsletters by slug."""
+    return dict((slug, nl.id) for slug, nl in _newsletters()['by_name'].items())
+
+
+def newsletter_slugs_by_id():
+    """Return the slugs of the newsletters by id."""
+    return dict((nl.id, slug) for slug, nl in _newsletters()['by_name'].items())
+
+
 def newsletter_fields():
     """Get a list of all the newsletter backend-specific fields"""
     return _newsletters()['by_vendor_id'].keys()
@@ -165,8 +263,24 @@ def is_supported_newsletter_language(code):
     return code[:2].lower() in [lang[:2].lower() for lang in newsletter_languages()]
 
 
+def newsletters_version():
+    """
+    Return a string that changes whenever the newsletter data does, so
+    anything built from it can be kept around until it's out of date.
+
+    Returns None if the cache isn't keeping anything, in which case
+    nothing built from the newsletter data should be kept either.
+    """
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        # add() so that processes racing to set it all end up agreeing
+        cache.add(VERSION_CACHE_KEY, uuid4().hex)
+        version = cache.get(VERSION_CACHE_KEY)
+    return version
+
+
 def clear_newsletter_cache(*args, **kwargs):
-    cache.delete(CACHE_KEY)
+    cache.delete_many([CACHE_KEY, VERSION_CACHE_KEY])
 
 
 def clear_sms_cache(*args, **kwargs):
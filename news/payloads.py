@@ -0,0 +1,162 @@
+"""
+Compact Celery messages for the ET tasks.
+
+A task with an envelope in ENVELOPES has its dict arguments cut down to
+the keys it uses before it's queued, and their newsletters (lists, or
+comma separated strings of slugs) packed into a bitset of newsletter
+ids. The task unpacks them again before it runs.
+
+The 'zjson' serializer registered here sends messages as JSON, zlib
+compressed when that makes them smaller, and records the size of each
+task's messages as the timers <task name>.payload_bytes and, before
+compression, <task name>.payload_raw_bytes. Use it with::
+
+    CELERY_TASK_SERIALIZER = 'zjson'
+    CELERY_ACCEPT_CONTENT = ['pickle', 'json', 'zjson']
+"""
+import json
+import zlib
+
+from django_statsd.clients import statsd
+from kombu.serialization import register
+
+from news.newsletters import newsletter_ids, newsletter_slugs_by_id
+
+
+# marks a packed dict argument
+PACKED = '_p'
+# messages shorter than this aren't worth compressing
+COMPRESS_MIN_BYTES = 200
+JSON_PREFIX = 'j'
+ZLIB_PREFIX = 'z'
+
+
+def pack_newsletters(newsletters):
+    """
+    Return the slugs in ``newsletters``, a list or a comma separated
+    string, as {'b': bitset of their ids in hex, 'x': any slugs that
+    aren't newsletters, 's': whether it was a string}.
+    """
+    is_string = isinstance(newsletters, basestring)
+    slugs = newsletters.split(',') if is_string else newsletters
+    ids = newsletter_ids()
+    bits = 0
+    others = []
+    for slug in slugs:
+        slug = slug.strip()
+        if slug in ids:
+            bits |= 1 << ids[slug]
+        elif slug:
+            others.append(slug)
+    return {'b': '%x' % bits, 'x': others, 's': is_string}
+
+
+def unpack_newsletters(packed):
+    """The newsletters ``packed`` by pack_newsletters, in id order."""
+    bits = int(packed['b'], 16)
+    by_id = newsletter_slugs_by_id()
+    slugs = [by_id[i] for i in sorted(by_id) if bits & (1 << i)]
+    slugs.extend(packed['x'])
+    return ','.join(slugs) if packed['s'] else slugs
+
+
+class Envelope(object):
+    """
+    How to pack a task's arguments: ``fields`` is {argument position:
+    the keys of that dict argument to keep}, and ``newsletters`` the keys
+    that are lists of newsletters.
+    """
+    def __init__(self, fields, newsletters=('newsletters',)):
+        self.fields = fields
+        self.newsletters = newsletters
+
+    def pack(self, args):
+        args = list(args)
+        for position, keep in self.fields.items():
+            if position >= len(args):
+                continue
+            data = args[position]
+            if not isinstance(data, dict) or PACKED in data:
+                continue
+            packed = dict((key, data[key]) for key in keep if key in data)
+            for key in self.newsletters:
+                if packed.get(key):
+                    packed[key] = pack_newsletters(packed[key])
+            packed[PACKED] = 1
+            args[position] = packed
+        return args
+
+    def unpack(self, args):
+        args = list(args)
+        for position in self.fields:
+            if position >= len(args):
+                continue
+            data = args[position]
+            if not isinstance(data, dict) or PACKED not in data:
+                continue
+            data = dict(data)
+            del data[PACKED]
+            for key in self.newsletters:
+                if isinstance(data.get(key), dict):
+                    data[key] = unpack_newsletters(data[key])
+            args[position] = data
+        return args
+
+
+ENVELOPES = {
+    'news.tasks.update_user': Envelope({
+        0: ('format', 'newsletters', 'trigger_welcome', 'country', 'lang',
+            'source_url'),
+    }),
+    'news.tasks.confirm_user': Envelope({
+        1: ('confirmed', 'email', 'newsletters', 'format', 'lang', 'token'),
+    }),
+    'news.tasks.add_fxa_activity': Envelope({
+        0: ('fxa_id', 'first_device', 'user_agent'),
+    }),
+}
+
+
+def pack_args(name, args):
+    """Pack the arguments of a call of task ``name``, if it has an envelope."""
+    envelope = ENVELOPES.get(name)
+    if envelope is None or not args:
+        return args
+    return envelope.pack(args)
+
+
+def unpack_args(name, args):
+    """Undo pack_args."""
+    envelope = ENVELOPES.get(name)
+    if envelope is None or not args:
+        return args
+    return envelope.unpack(args)
+
+
+def dumps(body):
+    data = json.dumps(body, separators=(',', ':'))
+    raw_size = len(data)
+    if raw_size >= COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(data)
+        if len(compressed) < raw_size:
+            data = ZLIB_PREFIX + compressed
+        else:
+            data = JSON_PREFIX + data
+    else:
+        data = JSON_PREFIX + data
+    if isinstance(body, dict) and 'task' in body:
+        statsd.timing(body['task'] + '.payload_raw_bytes', raw_size)
+        statsd.timing(body['task'] + '.payload_bytes', len(data))
+    return data
+
+
+def loads(data):
+    if data[:1] == ZLIB_PREFIX:
+        data = zlib.decompress(data[1:])
+    else:
+        data = data[1:]
+    return json.loads(data)
+
+
+register('zjson', dumps, loads, content_type='application/x-zjson',
+         content_encoding='binary')
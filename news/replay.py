@@ -0,0 +1,163 @@
+"""
+Bulk replay of FailedTasks.
+
+After an ET outage there can be tens of thousands of FailedTasks.
+Retrying them one at a time from the admin times out, and queueing them
+all at once floods the queue and ET. Instead they're replayed here in
+batches, oldest first, at no more than a given number of tasks per
+second. Each batch is deleted with a single query once it's queued.
+
+Failures of the same call, e.g. a subscriber's form that was submitted
+several times while ET was down, are only queued once. Calls are matched
+by task and subscriber (token or email), so a repeat is only skipped if
+it's the same as the last call of that task queued for the subscriber,
+and they're matched across all the batches of a replay.
+
+The replay_failed_tasks management command does this in the foreground,
+and the admin's retry action starts the replay_failed_tasks task to do
+it in the background.
+"""
+import inspect
+import json
+from hashlib import sha1
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+from celery import current_app
+from celery.task import subtask
+from django_statsd.clients import statsd
+
+from news.models import FailedTask
+from news.payloads import unpack_args
+
+
+REPLAY_BATCH_SIZE = getattr(settings, 'FAILED_TASK_REPLAY_BATCH_SIZE', 500)
+# Tasks queued per second
+REPLAY_RATE = getattr(settings, 'FAILED_TASK_REPLAY_RATE', 50)
+# How long a replay remembers the calls it's queued, in seconds
+REPLAY_SEEN_TIMEOUT = getattr(settings, 'FAILED_TASK_REPLAY_SEEN_TIMEOUT', 24 * 60 * 60)
+
+
+def failed_tasks(name=None, since=None, until=None, ids=None, start_id=0):
+    """
+    Return the FailedTasks to replay, oldest first.
+
+    :param str name: Only tasks with this name, e.g. news.tasks.update_user
+    :param datetime since: Only tasks that failed at or after this time
+    :param datetime until: Only tasks that failed before this time
+    :param list ids: Only tasks with these ids
+    :param int start_id: Only tasks after this id, to resume a replay
+    """
+    queryset = FailedTask.objects.filter(id__gt=start_id)
+    if name:
+        queryset = queryset.filter(name=name)
+    if since:
+        queryset = queryset.filter(when__gte=since)
+    if until:
+        queryset = queryset.filter(when__lt=until)
+    if ids is not None:
+        queryset = queryset.filter(id__in=ids)
+    return queryset.order_by('id')
+
+
+def call_key(failed_task):
+    """Return a key that's the same for FailedTasks of the same call."""
+    call = [failed_task.name, failed_task.filtered_args, failed_task.kwargs]
+    return sha1(json.dumps(call, sort_keys=True)).hexdigest()
+
+
+def call_subscriber(failed_task):
+    """
+    Return the token or email of the subscriber a FailedTask's call is
+    for, or None if it can't be told.
+    """
+    # imported here, as news.tasks imports this, to register the tasks
+    import news.tasks  # noqa
+    task = current_app.tasks.get(failed_task.name)
+    # et_task keeps the function it wraps, whose arguments are the ones
+    # that name the subscriber
+    func = getattr(task, '__wrapped__', None) or getattr(task, 'run', None)
+    if func is None:
+        return None
+    args = unpack_args(failed_task.name, failed_task.filtered_args)
+    try:
+        callargs = inspect.getcallargs(func, *args, **failed_task.kwargs)
+    except TypeError:
+        return None
+
+    # e.g. update_user's email and token, or those in its data
+    sources = [callargs] + [v for v in callargs.values() if isinstance(v, dict)]
+    for name in ('token', 'email'):
+        for source in sources:
+            value = source.get(name)
+            if value and isinstance(value, basestring):
+                return value.lower() if name == 'email' else value
+    return None
+
+
+def subscriber_key(failed_task):
+    """
+    Return a key that's the same for the FailedTasks of the same task
+    for the same subscriber, or call_key() for calls of no subscriber.
+    """
+    subscriber = call_subscriber(failed_task)
+    if subscriber is None:
+        return call_key(failed_task)
+    key = [failed_task.name, subscriber]
+    return sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+def replay_batch(queryset, batch_size=REPLAY_BATCH_SIZE, run_id=None):
+    """
+    Queue the first ``batch_size`` of the FailedTasks in ``queryset`` again,
+    and delete them.
+
+    A FailedTask is skipped if it's the same call as the last one queued
+    of that task for its subscriber (see subscriber_key) by the replay.
+
+    :param str run_id: Identifies the replay, whose batches remember the
+        calls they queued in the cache under it. One batch on its own if
+        not given.
+    :returns: (number queued, number skipped as duplicates, id of the
+        last task in the batch or None if there weren't any)
+    """
+    batch = list(queryset[:batch_size])
+    if not batch:
+        return 0, 0, None
+
+    if run_id is None:
+        run_id = uuid4().hex
+    keys = {}
+    for failed_task in batch:
+        keys[failed_task.id] = 'replay:%s:%s' % (run_id, subscriber_key(failed_task))
+    # the last call queued of each task, for each subscriber
+    last_calls = cache.get_many(list(set(keys.values())))
+    queued_calls = {}
+    queued = 0
+    for failed_task in batch:
+        key = keys[failed_task.id]
+        call = call_key(failed_task)
+        if last_calls.get(key) == call:
+            continue
+        last_calls[key] = queued_calls[key] = call
+        subtask(failed_task.name, args=failed_task.filtered_args,
+                kwargs=failed_task.kwargs).apply_async()
+        queued += 1
+
+    if queued_calls:
+        cache.set_many(queued_calls, REPLAY_SEEN_TIMEOUT)
+    FailedTask.objects.filter(id__in=[t.id for t in batch]).delete()
+    skipped = len(batch) - queued
+    statsd.incr('news.replay.queued', queued)
+    if skipped:
+        statsd.incr('news.replay.collapsed', skipped)
+    return queued, skipped, batch[-1].id
+
+
+def batch_delay(queued, rate=REPLAY_RATE):
+    """Seconds to wait after queueing ``queued`` tasks to keep to ``rate``."""
+    if not rate:
+        return 0
+    return float(queued) / rate
@@ -0,0 +1,97 @@
+"""
+Retention of FailedTasks.
+
+FailedTasks are kept for the number of days set for their task name in
+FAILED_TASK_RETENTION, or its 'default' entry for the rest, e.g.::
+
+    FAILED_TASK_RETENTION = {
+        'default': 30,
+        'news.tasks.add_fxa_activity': 7,
+        # None keeps them for good
+        'news.tasks.confirm_user': None,
+    }
+
+The purge_failed_tasks management command deletes the ones that are
+older, in batches, after writing them to a gzipped file of JSON lines in
+FAILED_TASK_ARCHIVE_DIR. It then deletes the TaskTracebacks no FailedTask
+has, once they've gone unused for TASK_TRACEBACK_GRACE_SECONDS, so that
+one a worker is saving new FailedTasks with isn't deleted.
+"""
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils.timezone import now
+
+from django_statsd.clients import statsd
+
+from news.models import FailedTask, FailedTaskName, TaskTraceback
+
+
+FAILED_TASK_RETENTION = getattr(settings, 'FAILED_TASK_RETENTION',
+                                {'default': 30})
+FAILED_TASK_ARCHIVE_DIR = getattr(settings, 'FAILED_TASK_ARCHIVE_DIR', None)
+TASK_TRACEBACK_GRACE_SECONDS = getattr(settings, 'TASK_TRACEBACK_GRACE_SECONDS',
+                                       60 * 60)
+
+
+def expired_failed_tasks(retention=None):
+    """
+    Return a list of querysets of the FailedTasks that are older than
+    ``retention`` (FAILED_TASK_RETENTION by default) allows, one for each
+    entry in it.
+    """
+    policies = dict(retention or FAILED_TASK_RETENTION)
+    default = policies.pop('default', None)
+    querysets = []
+    for name, days in policies.items():
+        if days is not None:
+            querysets.append(FailedTask.objects.filter(
+                name=name, when__lt=now() - timedelta(days=days)))
+    if default is not None:
+        querysets.append(FailedTask.objects.exclude(name__in=policies.keys())
+                         .filter(when__lt=now() - timedelta(days=default)))
+    return querysets
+
+
+def archive_record(failed_task):
+    return {
+        'id': failed_task.id,
+        'when': failed_task.when.isoformat(),
+        'task_id': failed_task.task_id,
+        'name': failed_task.name,
+        'args': failed_task.args,
+        'kwargs': failed_task.kwargs,
+        'exc': failed_task.exc,
+        'einfo': failed_task.einfo,
+    }
+
+
+def purge_failed_tasks(archive=None, batch_size=1000, retention=None):
+    """
+    Delete the FailedTasks past their retention, ``batch_size`` at a time.
+
+    :param archive: File to write each one to as a line of JSON before
+        it's deleted, or None to just delete them.
+    :returns: The number deleted.
+    """
+    count = 0
+    for queryset in expired_failed_tasks(retention):
+        while True:
+            batch = list(queryset.select_related('traceback')
+                         .order_by('id')[:batch_size])
+            if not batch:
+                break
+            if archive is not None:
+                for failed_task in batch:
+                    archive.write(json.dumps(archive_record(failed_task)) + '\n')
+                archive.flush()
+            FailedTask.objects.filter(id__in=[t.id for t in batch]).delete()
+            count += len(batch)
+            statsd.incr('news.retention.deleted', len(batch))
+
+    FailedTaskName.prune()
+    unused_since = now() - timedelta(seconds=TASK_TRACEBACK_GRACE_SECONDS)
+    TaskTraceback.objects.filter(failedtask__isnull=True,
+                                 last_used__lt=unused_since).delete()
+    return count
@@ -0,0 +1,196 @@
+"""
+Spool for writes to ET that are made while it's down.
+
+When ET's circuit breaker is open (see news.backends.breaker), the data
+extension updates from apply_updates and the triggered sends from
+send_message are saved here as SpooledWrite rows, instead of being
+retried until they end up as FailedTasks. The drain_et_spool management
+command replays them in batches once ET is back, oldest first, with all
+the updates going before any of the sends since the sends may depend on
+them.
+
+Updates to the same user in the token-keyed data extensions are combined
+into one, and the same message is only sent once to the same user. While
+a user has updates in the spool, later updates and sends for them are
+spooled after them, even once ET is back, so that replaying the spool
+can't undo them and no email goes out before the user's data is written.
+
+Spooling is off unless EXACTTARGET_SPOOL_WRITES is set, since it needs
+``./manage.py drain_et_spool --forever`` running. The drainer sends the
+age of the oldest spooled write as the gauge news.spool.age, to alert on.
+"""
+import logging
+import socket
+import time
+from urllib2 import URLError
+
+from django.conf import settings
+from django.utils.timezone import now
+
+from django_statsd.clients import statsd
+
+from news.backends.common import NewsletterException, ServiceBusyException
+from news.backends.exacttarget import ExactTarget
+from news.models import SpooledWrite
+
+
+log = logging.getLogger(__name__)
+
+SPOOL_ET_WRITES = getattr(settings, 'EXACTTARGET_SPOOL_WRITES', False)
+
+
+def token_keyed_data_extensions():
+    """The data extensions where a user has at most one record, keyed by
+    their token, so updates to the same token can be combined."""
+    return [settings.EXACTTARGET_DATA,
+            settings.EXACTTARGET_OPTIN_STAGE,
+            settings.EXACTTARGET_CONFIRMATION]
+
+
+def spool_update(target_et, record):
+    """Save an update of ``record`` to data extension ``target_et``."""
+    key = ''
+    if target_et in token_keyed_data_extensions():
+        key = record.get('TOKEN', '')
+    SpooledWrite.objects.create(kind=SpooledWrite.UPDATE, target=target_et,
+                                key=key, data=record)
+    statsd.incr('news.spool.update')
+
+
+def pending_updates(target_et, records):
+    """
+    The tokens of those of ``records`` that have updates to ``target_et``
+    waiting in the spool. Their updates have to be spooled too, to be
+    replayed after those rather than overwritten by them.
+    """
+    if target_et not in token_keyed_data_extensions():
+        return set()
+    tokens = [record['TOKEN'] for record in records if record.get('TOKEN')]
+    if not tokens:
+        return set()
+    return set(SpooledWrite.objects.filter(kind=SpooledWrite.UPDATE,
+                                           target=target_et, key__in=tokens)
+               .values_list('key', flat=True))
+
+
+def has_pending_updates(token):
+    """Whether the user with ``token`` has updates waiting in the spool,
+    which a send to them has to wait for."""
+    return bool(token) and SpooledWrite.objects.filter(
+        kind=SpooledWrite.UPDATE, key=token).exists()
+
+
+def spool_send(message_id, email, token, format):
+    """Save a triggered send of message ``message_id``."""
+    SpooledWrite.objects.create(kind=SpooledWrite.SEND, target=message_id,
+                                key=token,
+                                data={'email': email, 'format': format})
+    statsd.incr('news.spool.send')
+
+
+def drain_spool(batch_size=100, delay=0):
+    """
+    Replay everything in the spool, ``batch_size`` writes at a time,
+    sleeping ``delay`` seconds between batches.
+
+    Returns the number of spooled writes dealt with. Stops, leaving the
+    rest for next time, if ET is still unavailable.
+    """
+    oldest = SpooledWrite.objects.order_by('id').values_list('when', flat=True)[:1]
+    if oldest:
+        age = now() - oldest[0]
+        statsd.gauge('news.spool.age', age.days * 86400 + age.seconds)
+    else:
+        statsd.gauge('news.spool.age', 0)
+
+    count = 0
+    for kind, drain in ((SpooledWrite.UPDATE, drain_updates),
+                        (SpooledWrite.SEND, drain_sends)):
+        while True:
+            writes = list(SpooledWrite.objects.filter(kind=kind)
+                          .order_by('id')[:batch_size])
+            if not writes:
+                break
+            try:
+                drain(writes)
+            except (ServiceBusyException, URLError, socket.error) as e:
+                log.warn('Stopped draining ET spool: %s' % e)
+                return count
+            count += len(writes)
+            if delay:
+                time.sleep(delay)
+    return count
+
+
+def drain_updates(writes):
+    """Send the updates in ``writes``, combining those for the same user,
+    with one call per data extension."""
+    records = {}
+    by_target = {}
+    for write in writes:
+        key = (write.target, write.key or write.id)
+        if key in records:
+            # later updates win, as they would have
+            records[key][0].update(write.data)
+            records[key][1].append(write.id)
+        else:
+            records[key] = (dict(write.data), [write.id])
+            by_target.setdefault(write.target, []).append(key)
+
+    data_ext = ExactTarget(settings.EXACTTARGET_USER,
+                           settings.EXACTTARGET_PASS).data_ext()
+    for target, keys in sorted(by_target.items()):
+        try:
+            data_ext.add_records(target, [records[k][0] for k in keys])
+        except ServiceBusyException:
+            raise
+        except NewsletterException:
+            # ET didn't like something in the batch. Send them one at a
+            # time so the rest still get through.
+            for key in keys:
+                try:
+                    data_ext.add_records(target, [records[key][0]])
+                except ServiceBusyException:
+                    raise
+                except NewsletterException as e:
+                    drop(target, records[key][0], e)
+                done(records[key][1])
+            continue
+        done([write_id for k in keys for write_id in records[k][1]])
+
+
+def drain_sends(writes):
+    """Trigger the sends in ``writes``, skipping repeats."""
+    et = ExactTarget(settings.EXACTTARGET_USER, settings.EXACTTARGET_PASS)
+    sent = set()
+    done_ids = []
+    try:
+        for write in writes:
+            if (write.target, write.key) not in sent:
+                try:
+                    et.trigger_send(write.target, {
+                        'EMAIL_ADDRESS_': write.data['email'],
+                        'TOKEN': write.key,
+                        'EMAIL_FORMAT_': write.data['format'],
+                    })
+                except ServiceBusyException:
+                    raise
+                except NewsletterException as e:
+                    drop(write.target, write.data, e)
+                sent.add((write.target, write.key))
+            done_ids.append(write.id)
+    finally:
+        done(done_ids)
+
+
+def drop(target, data, e):
+    # It'll never work, and stopping here would hold up everything else.
+    log.error('Dropping spooled ET write to %s: %r (%s)' % (target, data, e))
+    statsd.incr('news.spool.dropped')
+
+
+def done(write_ids):
+    if not write_ids:
+        return
+    SpooledWrite.objects.filter(id__in=write_ids).delete()
+    statsd.incr('news.spool.replayed', len(write_ids))
@@ -0,0 +1,143 @@
+"""
+Emailing interests' stewards about the contributors who get in touch.
+
+Interest.notify_stewards saves a StewardNotification rather than
+sending the email there and then, and the send_steward_notifications
+task sends those waiting in batches of STEWARD_BATCH_SIZE, all over one
+SMTP connection, so a slow mail server doesn't hold up the ET task. Only
+one send is queued at a time, and the inquiries made while it's waiting
+are sent with it.
+
+With STEWARD_DIGEST_MINUTES set, it's sent that many minutes after the
+first inquiry since the last send instead, and each steward gets one
+email listing all the inquiries for them in that time. The
+send_steward_notifications management command sends any waiting.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils.timezone import now
+
+from news.models import StewardNotification
+
+
+log = logging.getLogger(__name__)
+
+STEWARD_DIGEST_MINUTES = getattr(settings, 'STEWARD_DIGEST_MINUTES', 0)
+STEWARD_BATCH_SIZE = getattr(settings, 'STEWARD_BATCH_SIZE', 100)
+# a send that's had its notifications this long has died
+STEWARD_CLAIM_TIMEOUT = getattr(settings, 'STEWARD_CLAIM_TIMEOUT', 60 * 60)
+
+FROM_EMAIL = 'basket@basket.mozilla.org'
+# set while a send is queued, until it starts
+SEND_SCHEDULED_KEY = 'steward-send-scheduled'
+# after which a send that's not started is given up on, and another queued
+STEWARD_SEND_TIMEOUT = getattr(settings, 'STEWARD_SEND_TIMEOUT', 5 * 60)
+
+
+def claim_notifications(batch_size=STEWARD_BATCH_SIZE):
+    """
+    Claim up to ``batch_size`` of the waiting notifications, oldest
+    first, for this send, and return them. Notifications claimed by a
+    send that died are claimed again.
+    """
+    stale = now() - timedelta(seconds=STEWARD_CLAIM_TIMEOUT)
+    unclaimed = Q(claim=None) | Q(claimed__lt=stale)
+    ids = list(StewardNotification.objects.filter(unclaimed)
+               .order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    claim = uuid4().hex
+    StewardNotification.objects.filter(unclaimed, id__in=ids).update(
+        claim=claim, claimed=now())
+    return list(StewardNotification.objects.filter(claim=claim)
+                .select_related('interest').order_by('id'))
+
+
+def release_notifications(notifications):
+    """Put claimed ``notifications`` back to be sent by another send."""
+    StewardNotification.objects.filter(
+        id__in=[n.id for n in notifications]).update(claim=None, claimed=None)
+
+
+def notification_message(notification):
+    body = render_to_string('news/get_involved/steward_email.txt', {
+        'contributor_name': notification.name,
+        'contributor_email': notification.email,
+        'interest': notification.interest,
+        'lang': notification.lang,
+        'message': notification.message,
+    })
+    return EmailMessage('Inquiry about {0}'.format(notification.interest.title),
+                        body, FROM_EMAIL, notification.steward_list)
+
+
+def digest_messages(notifications):
+    """One email for each steward, of all their ``notifications``."""
+    by_steward = defaultdict(list)
+    for notification in notifications:
+        for steward in notification.steward_list:
+            by_steward[steward].append(notification)
+
+    messages = []
+    for steward, theirs in sorted(by_steward.items()):
+        if len(theirs) == 1:
+            message = notification_message(theirs[0])
+            message.to = [steward]
+            messages.append(message)
+            continue
+        titles = sorted(set(n.interest.title for n in theirs))
+        body = render_to_string('news/get_involved/steward_digest.txt', {
+            'notifications': theirs,
+            'minutes': STEWARD_DIGEST_MINUTES,
+        })
+        messages.append(EmailMessage(
+            '{0} inquiries about {1}'.format(len(theirs), ', '.join(titles)),
+            body, FROM_EMAIL, [steward]))
+    return messages
+
+
+def send_notifications(batch_size=STEWARD_BATCH_SIZE, digest=None):
+    """
+    Send all the waiting notifications, ``batch_size`` at a time, over
+    one SMTP connection, and return how many were sent. ``digest``
+    defaults to whether STEWARD_DIGEST_MINUTES is set.
+
+    If sending fails, the batch is put back and the error raised. Some
+    of its emails may have gone already, and will be sent again.
+    """
+    if digest is None:
+        digest = bool(STEWARD_DIGEST_MINUTES)
+    sent = 0
+    connection = get_connection()
+    # opened here, the connection's kept open for every batch
+    connection.open()
+    try:
+        while True:
+            notifications = claim_notifications(batch_size)
+            if not notifications:
+                break
+            if digest:
+                messages = digest_messages(notifications)
+            else:
+                messages = [notification_message(n) for n in notifications]
+            try:
+                connection.send_messages(messages)
+            except Exception:
+                release_notifications(notifications)
+                raise
+            StewardNotification.objects.filter(
+                id__in=[n.id for n in notifications]).delete()
+            sent += len(notifications)
+    finally:
+        connection.close()
+
+    if sent:
+        log.info('Sent %d steward notifications', sent)
+    return sent
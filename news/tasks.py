@@ -1,31 +1,55 @@
 from __future__ import absolute_import
 import datetime
+import inspect
+import json
 import logging
 from email.utils import formatdate
 from functools import wraps
+from hashlib import sha1
 from time import mktime
 from urllib2 import URLError
+from uuid import uuid4
 
 from django.conf import settings
-from django.core.cache import get_cache
+from django.core.cache import cache, get_cache
 from django_statsd.clients import statsd
 
-import user_agents
+from celery.exceptions import RetryTaskError
 from celery.task import Task, task
 
-from news.backends.common import NewsletterException, NewsletterNoResultsException
+from news.backends.common import (CircuitOpenException, NewsletterException,
+                                  NewsletterNoResultsException,
+                                  ServiceBusyException)
 from news.backends.exacttarget import ExactTarget, ExactTargetDataExt
 from news.backends.exacttarget_rest import ETRestError, ExactTargetRest
-from news.models import FailedTask, Newsletter, Subscriber, Interest
-from news.newsletters import get_sms_messages, is_supported_newsletter_language
-from news.utils import (get_user_data, lookup_subscriber, MSG_USER_NOT_FOUND,
-                        SUBSCRIBE, parse_newsletters)
+from news.failures import failure_recorder
+from news.models import FailedTaskName, Interest, Subscriber
+from news.newsletters import (confirm_message_id, get_sms_messages,
+                              is_supported_newsletter_language, mogrify_message_id,
+                              newsletter_name, optin_exempt, welcome_message_id)
+from news.payloads import pack_args, unpack_args
+from news.replay import REPLAY_RATE, batch_delay, failed_tasks, replay_batch
+from news.spool import (SPOOL_ET_WRITES, has_pending_updates, pending_updates,
+                        spool_send, spool_update)
+from news.stewards import (SEND_SCHEDULED_KEY, STEWARD_DIGEST_MINUTES,
+                           STEWARD_SEND_TIMEOUT, send_notifications)
+from news.tracing import trace_task
+from news.utils import (get_user_data, get_users_data, lookup_subscriber,
+                        MSG_USER_NOT_FOUND, SUBSCRIBE, parse_newsletters)
+# connects the worker warm up to celery's worker_init
+from news.warmup import warm_up_worker  # noqa
 
 
 log = logging.getLogger(__name__)
 
 BAD_MESSAGE_ID_CACHE = get_cache('bad_message_ids')
 
+# Seconds for which a queued ET task identical to one already run is
+# taken to be a duplicate (a double submit or a client retry) and
+# dropped, unless another call for the same subscriber has run since.
+# 0 turns this off.
+ET_TASK_DEDUP_TIMEOUT = getattr(settings, 'ET_TASK_DEDUP_TIMEOUT', 60)
+
 # Base message ID for confirmation email
 CONFIRMATION_MESSAGE = "confirmation_email"
 
@@ -86,6 +110,12 @@ class ETTask(Task):
     default_retry_delay = 60 * 5  # 5 minutes
     max_retries = 8  # ~ 30 min
 
+    @classmethod
+    def apply_async(cls, args=None, kwargs=None, **options):
+        # see news.payloads. A classmethod, as it is in celery.task.Task.
+        return super(ETTask, cls).apply_async(pack_args(cls.name, args),
+                                              kwargs, **options)
+
     def on_success(self, retval, task_id, args, kwargs):
         """Success handler.
 
@@ -122,14 +152,8 @@ class ETTask(Task):
         """
         statsd.incr(self.name + '.failure')
         log.error("Task failed: %s" % self.name, exc_info=einfo.exc_info)
-        FailedTask.objects.create(
-            task_id=task_id,
-            name=self.name,
-            args=args,
-            kwargs=kwargs,
-            exc=repr(exc),
-            einfo=str(einfo),  # str() gives more info than repr() on celery.datastructures.ExceptionInfo
-        )
+        failure_recorder.record(task_id, self.name, unpack_args(self.name, args),
+                                kwargs, exc, einfo, flush=self.request.is_eager)
 
     def on_retry(self, exc, task_id, args, kwargs, einfo):
         """Retry handler.
@@ -151,19 +175,93 @@ class ETTask(Task):
         log.warn("Task retrying: %s" % self.name, exc_info=einfo.exc_info)
 
 
+def task_dedup_key(name, args, kwargs):
+    """Return the cache key for a call of task ``name`` with these args."""
+    payload = json.dumps([name, args, kwargs], sort_keys=True, default=repr)
+    return 'et-task-dedup:%s' % sha1(payload).hexdigest()
+
+
+def task_subscriber_keys(func, args, kwargs):
+    """Return the cache keys of the latest ET task call for the subscriber
+    (by email and by token) that a call of ``func`` is for."""
+    try:
+        callargs = inspect.getcallargs(func, *args, **kwargs)
+    except TypeError:
+        return []
+    keys = []
+    for name in ('email', 'token'):
+        value = callargs.get(name)
+        if value and isinstance(value, basestring):
+            if name == 'email':
+                value = value.lower()
+            keys.append('et-task-latest:%s:%s' % (
+                name, sha1(value.encode('utf-8')).hexdigest()))
+    return keys
+
+
+def forget_earlier_calls(dedup_key, subscriber_keys):
+    """Record the call with ``dedup_key`` as the latest for its subscriber,
+    so that a repeat of an earlier, different call isn't a duplicate."""
+    if not subscriber_keys:
+        return
+    latest = cache.get_many(subscriber_keys)
+    earlier = set(latest.values()) - set([dedup_key])
+    if earlier:
+        cache.delete_many(list(earlier))
+    cache.set_many(dict((key, dedup_key) for key in subscriber_keys),
+                   ET_TASK_DEDUP_TIMEOUT)
+
+
 def et_task(func):
-    """Decorator to standardize ET Celery tasks."""
+    """Decorator to standardize ET Celery tasks.
+
+    A task queued with the same args as one that ran in the last
+    ET_TASK_DEDUP_TIMEOUT seconds is dropped without running, as long as
+    no other call for the same subscriber (by its email or token
+    argument) has run in between. So SET A, SET B, SET A all run.
+    """
     @task(base=ETTask)
     @wraps(func)
     def wrapped(*args, **kwargs):
         statsd.incr(wrapped.name + '.total')
+        args = unpack_args(wrapped.name, args)
+        request = wrapped.request
+        dedup_key = None
+        # Only a first attempt can be a duplicate; retries are our own.
+        if (ET_TASK_DEDUP_TIMEOUT and not request.retries and
+                not (request.is_eager or request.called_directly)):
+            dedup_key = task_dedup_key(wrapped.name, args, kwargs)
+            if not cache.add(dedup_key, 1, ET_TASK_DEDUP_TIMEOUT):
+                statsd.incr(wrapped.name + '.dedup')
+                return
+            forget_earlier_calls(dedup_key,
+                                 task_subscriber_keys(func, args, kwargs))
         try:
-            return func(*args, **kwargs)
+            try:
+                with trace_task(wrapped.name):
+                    return func(*args, **kwargs)
+            except Exception:
+                # It didn't work, so trying again isn't a duplicate.
+                if dedup_key:
+                    cache.delete(dedup_key)
+                raise
+        except ServiceBusyException as e:
+            if request.is_eager or request.called_directly:
+                wrapped.retry(exc=e, countdown=(2 ** request.retries) * 60)
+            # ET is known to be failing or we're over our quota, so this
+            # attempt shouldn't count against the task's retries. Try again
+            # once calls will be let through again.
+            statsd.incr(wrapped.name + '.deferred')
+            wrapped.apply_async(args, kwargs, countdown=e.retry_after,
+                                retries=request.retries)
+            raise RetryTaskError(exc=e, when=e.retry_after)
         except (URLError, NewsletterException) as e:
             # URLError or NewsletterException could be a connection issue,
             # so try again later.
             wrapped.retry(exc=e, countdown=(2 ** wrapped.request.retries) * 60)
 
+    # as on Python 3, for news.replay to see func's arguments
+    wrapped.__wrapped__ = func
     return wrapped
 
 
@@ -181,6 +279,8 @@ def get_external_user_data(email=None, token=None, fields=None, database=None):
         'COUNTRY_',
         'LANGUAGE_ISO2',
         'TOKEN',
+        'FXA_ID',
+        'FXA_LANGUAGE_ISO2',
     ]
     ext = ExactTargetDataExt(settings.EXACTTARGET_USER,
                              settings.EXACTTARGET_PASS)
@@ -196,12 +296,18 @@ def get_external_user_data(email=None, token=None, fields=None, database=None):
         'country': user['COUNTRY_'] or '',
         'lang': user['LANGUAGE_ISO2'] or '',  # Never None
         'token': user['TOKEN'],
+        'fxa_id': user.get('FXA_ID'),
+        'fxa_lang': user.get('FXA_LANGUAGE_ISO2'),
     }
     return user_data
 
 
 @et_task
 def add_fxa_activity(data):
+    # loading its regexes is slow, and only this task needs them, so
+    # workers start without
+    import user_agents
+
     user_agent = user_agents.parse(data['user_agent'])
     device_type = 'D'
     if user_agent.is_mobile:
@@ -237,6 +343,11 @@ def update_fxa_info(email, lang, fxa_id, source_url=None, skip_welcome=False):
         welcome_format = user['format']
         token = user['token']
         Subscriber.objects.get_and_sync(email, token, fxa_id)
+        if user.get('fxa_id') == fxa_id and user.get('fxa_lang') == lang:
+            # ET already has all this, and they were welcomed when it
+            # was first recorded.
+            statsd.incr('news.tasks.write_suppressed')
+            return
     else:
         sub, created = Subscriber.objects.get_or_create(email=email, defaults={'fxa_id': fxa_id})
         if not created:
@@ -310,14 +421,16 @@ def update_get_involved(interest_id, lang, name, email, country, email_format,
     else:
         to_subscribe = None
 
-    apply_updates(settings.EXACTTARGET_DATA, record)
+    if user and is_noop_update(record, user):
+        statsd.incr('news.tasks.write_suppressed')
+    else:
+        apply_updates(settings.EXACTTARGET_DATA, record)
     apply_updates(settings.EXACTTARGET_INTERESTS, {
         'TOKEN': token,
         'INTEREST': interest_id,
     })
     welcome_id = mogrify_message_id(interest.welcome_id, lang, email_format)
     send_message.delay(welcome_id, email, token, email_format)
-    interest.notify_stewards(name, email, lang, message)
 
     if to_subscribe:
         if not user:
@@ -328,6 +441,10 @@ def update_get_involved(interest_id, lang, name, email, country, email_format,
             }
         send_welcomes(user, to_subscribe, email_format)
 
+    # last, so a retry of the ET writes doesn't notify them again
+    interest.notify_stewards(name, email, lang, message)
+    queue_steward_notifications()
+
 
 @et_task
 def update_phonebook(data, email, token):
@@ -388,6 +505,104 @@ def update_user(data, email, token, api_call_type, optin):
         sub, user_data, created = lookup_subscriber(email=email)
         token = sub.token
 
+    # Get the user's current settings from ET, if any
+    user_data = get_user_data(token=token)
+    return process_user_update(data, email, token, user_data, api_call_type,
+                               optin, ImmediateUpdates())
+
+
+class ImmediateUpdates(object):
+    """Sends each ET write as soon as it's made, then runs the action
+    that depends on it."""
+
+    def apply(self, target_et, record):
+        apply_updates(target_et, record)
+
+    def then(self, func, *args):
+        func(*args)
+
+
+class BatchedUpdates(object):
+    """Collects ET writes, and the actions (welcomes, confirmations) that
+    must only happen after those writes, for many users. flush() sends
+    all the writes for each database in one Update call and then runs
+    the actions in order.
+
+    Call start() with a key for each user before handing over their
+    writes and actions, so that if any of them fail only that user is
+    left out."""
+
+    def __init__(self):
+        self.records = {}
+        self.actions = []
+        self.owner = None
+
+    def start(self, owner):
+        self.owner = owner
+
+    def apply(self, target_et, record):
+        self.records.setdefault(target_et, []).append((self.owner, record))
+
+    def then(self, func, *args):
+        self.actions.append((self.owner, func, args))
+
+    def drop(self, owner):
+        """Forget the writes and actions handed over for ``owner``."""
+        for target_et, entries in self.records.items():
+            self.records[target_et] = [e for e in entries if e[0] != owner]
+        self.actions = [a for a in self.actions if a[0] != owner]
+
+    def flush(self):
+        """Make the writes and run the actions, and return the keys of
+        the users any of whose writes or actions failed, in order."""
+        failed = []
+
+        def fail(owner):
+            log.exception('Batched update failed for %r' % (owner,))
+            if owner not in failed:
+                failed.append(owner)
+
+        for target_et, entries in self.records.items():
+            if not entries:
+                continue
+            try:
+                apply_updates_bulk(target_et, [record for owner, record in entries])
+            except ServiceBusyException:
+                raise
+            except NewsletterException:
+                # ET didn't like something in the batch. Find the records
+                # it won't take, writing the rest. Anything else, like a
+                # timeout, is raised for the whole batch to be retried.
+                for owner, record in entries:
+                    try:
+                        apply_updates(target_et, record)
+                    except ServiceBusyException:
+                        raise
+                    except NewsletterException:
+                        fail(owner)
+        for owner, func, args in self.actions:
+            if owner in failed:
+                continue
+            try:
+                func(*args)
+            except Exception:
+                fail(owner)
+        return failed
+
+
+def process_user_update(data, email, token, user_data, api_call_type, optin,
+                        updates):
+    """Work out and make the changes to a user's ET records for update_user.
+
+    :param dict user_data: User's current data from ET as returned by
+        get_user_data(), or None if they're not known there.
+    :param updates: ImmediateUpdates or BatchedUpdates instance that
+        the ET writes and follow-up messages are handed to.
+
+    The other parameters are the same as update_user's.
+
+    :returns: One of the return codes UU_ALREADY_CONFIRMED, etc.
+    """
     # Parse the parameters
     # `record` will contain the data we send to ET in the format they want.
     record = {
@@ -410,8 +625,10 @@ def update_user(data, email, token, api_call_type, optin):
 
     lang = record.get('LANGUAGE_ISO2', '') or ''
 
-    # Get the user's current settings from ET, if any
-    user_data = get_user_data(token=token)
+    # Keep what ET has now, before we start changing user_data, to see
+    # whether the update would change anything there.
+    known_data = dict(user_data) if user_data is not None else None
+
     # If we don't find the user, get_user_data returns None. Create
     # a minimal dictionary to use going forward. This will happen
     # often due to new people signing up.
@@ -462,9 +679,7 @@ def update_user(data, email, token, api_call_type, optin):
     # When including any newsletter that does not
     # require confirmation, user gets a pass on confirming and goes straight
     # to confirmed.
-    exempt_from_confirmation = optin or Newsletter.objects\
-        .filter(slug__in=to_subscribe, requires_double_optin=False)\
-        .exists()
+    exempt_from_confirmation = optin or optin_exempt(to_subscribe)
 
     # Send welcomes when api_call_type is SUBSCRIBE and trigger_welcome
     # arg is absent or 'Y'.
@@ -473,14 +688,23 @@ def update_user(data, email, token, api_call_type, optin):
     MASTER = settings.EXACTTARGET_DATA
     OPT_IN = settings.EXACTTARGET_OPTIN_STAGE
 
+    # Repeat subscribes and the like needn't cost an ET write, as long as
+    # they already have a record to leave alone.
+    needs_write = True
+    if known_data and (known_data['confirmed'] or known_data['pending']):
+        needs_write = not is_noop_update(record, known_data)
+    if not needs_write:
+        statsd.incr('news.tasks.write_suppressed')
+
     if user_data['confirmed']:
         # The user is already confirmed.
         # Just add any new subs to whichever of master or optin list is
         # appropriate, and send welcomes.
         target_et = MASTER if user_data['master'] else OPT_IN
-        apply_updates(target_et, record)
+        if needs_write:
+            updates.apply(target_et, record)
         if should_send_welcomes:
-            send_welcomes(user_data, to_subscribe, fmt)
+            updates.then(send_welcomes, user_data, to_subscribe, fmt)
         return_code = UU_ALREADY_CONFIRMED
     elif exempt_from_confirmation:
         # This user is not confirmed, but they
@@ -489,16 +713,17 @@ def update_user(data, email, token, api_call_type, optin):
             # We were waiting for them to confirm.  Update the data in
             # their record (currently in the Opt-in table), then go
             # ahead and confirm them. This will also send welcomes.
-            apply_updates(OPT_IN, record)
-            confirm_user(user_data['token'], user_data)
+            if needs_write:
+                updates.apply(OPT_IN, record)
+            updates.then(confirm_user, user_data['token'], user_data)
             return_code = UU_EXEMPT_PENDING
         else:
             # Brand new user: Add them directly to master subscriber DB
             # and send welcomes.
             record['CREATED_DATE_'] = gmttime()
-            apply_updates(MASTER, record)
+            updates.apply(MASTER, record)
             if should_send_welcomes:
-                send_welcomes(user_data, to_subscribe, fmt)
+                updates.then(send_welcomes, user_data, to_subscribe, fmt)
             return_code = UU_EXEMPT_NEW
     else:
         # This user must confirm
@@ -512,11 +737,61 @@ def update_user(data, email, token, api_call_type, optin):
             return_code = UU_MUST_CONFIRM_NEW
         # Create or update OPT_IN record and send email telling them (or
         # reminding them) to confirm.
-        apply_updates(OPT_IN, record)
-        send_confirm_notice(email, token, lang, fmt, to_subscribe)
+        if needs_write:
+            updates.apply(OPT_IN, record)
+        updates.then(send_confirm_notice, email, token, lang, fmt, to_subscribe)
     return return_code
 
 
+# Fields sent with every update that don't mean anything changed on their
+# own. SOURCE_URL is only kept from a user's first contact anyway.
+BOOKKEEPING_FIELDS = (
+    'EMAIL_ADDRESS_',
+    'TOKEN',
+    'EMAIL_PERMISSION_STATUS_',
+    'MODIFIED_DATE_',
+    'SOURCE_URL',
+)
+
+# ET fields whose current value get_user_data returns, and its key for them
+USER_DATA_FIELDS = {
+    'EMAIL_FORMAT_': 'format',
+    'COUNTRY_': 'country',
+    'LANGUAGE_ISO2': 'lang',
+}
+
+
+def is_noop_update(record, user_data):
+    """Whether writing ``record`` to ET would leave the user as they are.
+
+    :param dict record: Data that would be sent to ET
+    :param dict user_data: User's current data from ET as returned by
+        get_user_data().
+
+    Anything we can't check against ``user_data`` counts as a change.
+    """
+    newsletters = user_data.get('newsletters')
+    for field, value in record.items():
+        if field in BOOKKEEPING_FIELDS:
+            continue
+        if field in USER_DATA_FIELDS:
+            current = user_data.get(USER_DATA_FIELDS[field]) or ''
+            if current.lower() != (value or '').lower():
+                return False
+        elif field.endswith('_FLG'):
+            slug = newsletter_name(field[:-len('_FLG')])
+            if newsletters is None or slug is None:
+                return False
+            if (value == 'Y') != (slug in newsletters):
+                return False
+        elif field.endswith('_DATE') and field[:-len('_DATE')] + '_FLG' in record:
+            # goes along with the flag
+            continue
+        else:
+            return False
+    return True
+
+
 def apply_updates(target_et, record):
     """Send the record data to ET to update the database named
     target_et.
@@ -525,8 +800,100 @@ def apply_updates(target_et, record):
         or settings.EXACTTARGET_CONFIRMATION.
     :param dict record: Data to send
     """
+    if SPOOL_ET_WRITES and pending_updates(target_et, [record]):
+        spool_update(target_et, record)
+        return
+
     et = ExactTarget(settings.EXACTTARGET_USER, settings.EXACTTARGET_PASS)
-    et.data_ext().add_record(target_et, record.keys(), record.values())
+    try:
+        et.data_ext().add_record(target_et, record.keys(), record.values())
+    except CircuitOpenException:
+        if not SPOOL_ET_WRITES:
+            raise
+        spool_update(target_et, record)
+
+
+def apply_updates_bulk(target_et, records):
+    """Send several records to ET in one call to update the database
+    named target_et.
+
+    :param str target_et: Target database, e.g. settings.EXACTTARGET_DATA
+    :param list records: dicts of data to send, one per user
+    """
+    if SPOOL_ET_WRITES:
+        pending = pending_updates(target_et, records)
+        if pending:
+            for record in records:
+                if record.get('TOKEN') in pending:
+                    spool_update(target_et, record)
+            records = [record for record in records
+                       if record.get('TOKEN') not in pending]
+            if not records:
+                return
+
+    et = ExactTarget(settings.EXACTTARGET_USER, settings.EXACTTARGET_PASS)
+    try:
+        et.data_ext().add_records(target_et, records)
+    except CircuitOpenException:
+        if not SPOOL_ET_WRITES:
+            raise
+        for record in records:
+            spool_update(target_et, record)
+
+
+@et_task
+def bulk_subscribe(records, optin):
+    """Task for subscribing many users at once.
+
+    Does what update_user does for a SUBSCRIBE for each of the records,
+    but looks the users up in ET with one Retrieve per database and
+    sends the changes with one Update per database, instead of making
+    those calls for every user.
+
+    :param list records: dicts like the POST data update_user takes.
+        Each must have an 'email', and the records should all be for
+        different email addresses.
+    :param boolean optin: Whether the users should bypass the
+        double-optin process.
+    """
+    emails = [record['email'] for record in records]
+    known_users = get_users_data(emails=emails)
+    subscribers = dict((sub.email, sub) for sub in
+                       Subscriber.objects.filter(email__in=emails))
+
+    updates = BatchedUpdates()
+    failed = []
+    for index, data in enumerate(records):
+        email = data['email']
+        updates.start(index)
+        try:
+            user_data = known_users.get(email)
+            sub = subscribers.get(email)
+            if user_data:
+                token = user_data['token']
+                if sub is None or sub.token != token:
+                    Subscriber.objects.get_and_sync(email, token)
+            elif sub:
+                token = sub.token
+            else:
+                sub, created = Subscriber.objects.get_or_create(email=email)
+                token = sub.token
+
+            process_user_update(data, email, token, user_data, SUBSCRIBE,
+                                optin, updates)
+        except ServiceBusyException:
+            raise
+        except Exception:
+            log.exception('bulk_subscribe failed for %s' % email)
+            updates.drop(index)
+            failed.append(index)
+
+    # Retry those that failed on their own, so one bad record doesn't
+    # sink the rest of the batch.
+    for index in sorted(failed + updates.flush()):
+        statsd.incr(bulk_subscribe.name + '.requeued')
+        data = records[index]
+        update_user.delay(data, data['email'], None, SUBSCRIBE, optin)
 
 
 @et_task
@@ -546,6 +913,10 @@ def send_message(message_id, email, token, format):
 
     if BAD_MESSAGE_ID_CACHE.get(message_id, False):
         return
+    if SPOOL_ET_WRITES and has_pending_updates(token):
+        # it has to go after them, or it could use their old data
+        spool_send(message_id, email, token, format)
+        return
     log.debug("Sending message %s to %s %s in %s" %
               (message_id, email, token, format))
     et = ExactTarget(settings.EXACTTARGET_USER, settings.EXACTTARGET_PASS)
@@ -558,6 +929,10 @@ def send_message(message_id, email, token, format):
                 'EMAIL_FORMAT_': format,
             }
         )
+    except CircuitOpenException:
+        if not SPOOL_ET_WRITES:
+            raise
+        spool_send(message_id, email, token, format)
     except NewsletterException as e:
         # Better error messages for some cases. Also there's no point in
         # retrying these
@@ -569,24 +944,6 @@ def send_message(message_id, email, token, format):
         raise
 
 
-def mogrify_message_id(message_id, lang, format):
-    """Given a bare message ID, a language code, and a format (T or H),
-    return a message ID modified to specify that language and format.
-
-    E.g. on input ('MESSAGE', 'fr', 'T') it returns 'fr_MESSAGE_T',
-    or on input ('MESSAGE', 'pt', 'H') it returns 'pt_MESSAGE'
-
-    If `lang` is None or empty, it skips prefixing the language.
-    """
-    if lang:
-        result = "%s_%s" % (lang.lower()[:2], message_id)
-    else:
-        result = message_id
-    if format == 'T':
-        result += "_T"
-    return result
-
-
 def send_confirm_notice(email, token, lang, format, newsletter_slugs):
     """
     Send email to user with link to confirm their subscriptions.
@@ -609,12 +966,7 @@ def send_confirm_notice(email, token, lang, format, newsletter_slugs):
 
     # See if any newsletters have a custom confirmation message
     # We only need to find one; if so, we'll use the first we find.
-    newsletters = Newsletter.objects.filter(slug__in=newsletter_slugs)\
-        .exclude(confirm_message='')[:1]
-    if newsletters:
-        welcome = newsletters[0].confirm_message
-    else:
-        welcome = CONFIRMATION_MESSAGE
+    welcome = confirm_message_id(newsletter_slugs) or CONFIRMATION_MESSAGE
 
     welcome = mogrify_message_id(welcome, lang, format)
     send_message.delay(welcome, email, token, format)
@@ -635,26 +987,13 @@ def send_welcomes(user_data, newsletter_slugs, format):
                   % user_data)
         return
 
-    newsletters = Newsletter.objects.filter(
-        slug__in=newsletter_slugs
-    )
-
     # We don't want any duplicate welcome messages, so make a set
     # of the ones to send, then send them
     welcomes_to_send = set()
-    for nl in newsletters:
-        welcome = nl.welcome.strip()
-        if not welcome:
-            continue
-        languages = [lang[:2].lower() for lang in nl.language_list]
-        lang_code = user_data.get('lang', 'en')[:2].lower()
-        if lang_code not in languages:
-            # Newsletter does not support their preferred language, so
-            # it doesn't have a welcome in that language either. Settle
-            # for English, same as they'll be getting the newsletter in.
-            lang_code = 'en'
-        welcome = mogrify_message_id(welcome, lang_code, format)
-        welcomes_to_send.add(welcome)
+    for slug in newsletter_slugs:
+        welcome = welcome_message_id(slug, user_data.get('lang', 'en'), format)
+        if welcome:
+            welcomes_to_send.add(welcome)
     # Note: it's okay not to send a welcome if none of the newsletters
     # have one configured.
     for welcome in welcomes_to_send:
@@ -773,3 +1112,55 @@ def send_recovery_message_task(email):
 
     message_id = mogrify_message_id(RECOVERY_MESSAGE_ID, lang, format)
     send_message.delay(message_id, email, user_data['token'], format)
+
+
+@task(ignore_result=True)
+def replay_failed_tasks(name=None, since=None, until=None, ids=None,
+                        start_id=0, rate=REPLAY_RATE, run_id=None):
+    """
+    Replay a batch of FailedTasks, then queue this task again to do the
+    next, spaced out to keep to ``rate`` tasks per second.
+
+    The filters are those of news.replay.failed_tasks, and ``run_id``
+    that of news.replay.replay_batch, made up by the first batch.
+    """
+    if run_id is None:
+        run_id = uuid4().hex
+    queryset = failed_tasks(name, since, until, ids, start_id)
+    queued, skipped, last_id = replay_batch(queryset, run_id=run_id)
+    if last_id is None or (ids and last_id >= max(ids)):
+        FailedTaskName.prune()
+        log.info('Finished replaying failed tasks')
+        return
+
+    log.info('Replayed failed tasks up to %d (%d queued, %d duplicates)'
+             % (last_id, queued, skipped))
+    replay_failed_tasks.apply_async(
+        (name, since, until, ids, last_id, rate, run_id),
+        countdown=batch_delay(queued, rate))
+
+
+@task(ignore_result=True, default_retry_delay=5 * 60, max_retries=12)
+def send_steward_notifications():
+    """Email the stewards the waiting notifications. See news.stewards."""
+    cache.delete(SEND_SCHEDULED_KEY)
+    try:
+        send_notifications()
+    except Exception as e:
+        log.exception('Sending steward notifications failed')
+        send_steward_notifications.retry(exc=e)
+
+
+def queue_steward_notifications():
+    """
+    Have the waiting steward notifications sent: now, or with
+    STEWARD_DIGEST_MINUTES set, that many minutes from now, unless a
+    send is already queued, which will send these too.
+    """
+    if not STEWARD_DIGEST_MINUTES:
+        if cache.add(SEND_SCHEDULED_KEY, 1, STEWARD_SEND_TIMEOUT):
+            send_steward_notifications.delay()
+        return
+    window = STEWARD_DIGEST_MINUTES * 60
+    if cache.add(SEND_SCHEDULED_KEY, 1, window):
+        send_steward_notifications.apply_async(countdown=window)
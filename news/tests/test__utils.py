@@ -2,6 +2,7 @@
 
 import json
 
+from django.core.cache import cache
 from django.test import TestCase
 from django.test.client import RequestFactory
 
@@ -16,9 +17,11 @@ from news.utils import (
     email_is_blocked,
     EmailValidationError,
     get_accept_languages,
+    get_best_accept_language,
     get_best_language,
     get_email_block_list,
     language_code_is_valid,
+    LRUCache,
     update_user_task,
     validate_email,
 )
@@ -374,3 +377,71 @@ class TestValidateEmail(TestCase):
 
         with self.assertRaises(EmailValidationError):
             validate_email(None)
+
+    @patch('news.utils.EMAIL_VALIDATE_DOMAINS', True)
+    @patch('news.email.EMAIL_DOMAIN_RESOLVER', 'news.email.local_resolver')
+    def test_domain(self):
+        """With EMAIL_VALIDATE_DOMAINS, the domain must have a mail exchanger."""
+        self.addCleanup(cache.clear)
+        self.assertIsNone(validate_email('dude@example.com'))
+        self.assertIsNone(validate_email('dude@黒川.日本'))
+        with self.assertRaises(EmailValidationError):
+            validate_email('dude@example.invalid')
+
+    @patch('news.utils.EMAIL_VALIDATE_DOMAINS', True)
+    @patch('news.email.get_resolver')
+    def test_domain_lookup_fails(self, resolver_mock):
+        """An address isn't turned away because DNS is having trouble."""
+        from news.email import ResolverError
+
+        self.addCleanup(cache.clear)
+        resolver_mock.return_value.side_effect = ResolverError('timed out')
+        self.assertIsNone(validate_email('dude@example.com'))
+
+
+class GetBestAcceptLanguageTests(TestCase):
+    def setUp(self):
+        patcher = patch('news.utils.newsletter_languages', return_value=[
+            'de', 'en', 'es', 'fr', 'id', 'pt-BR', 'ru', 'pl', 'hu'])
+        self.languages_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('news.utils.newsletters_version', return_value='1')
+        self.version_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_memoized(self):
+        self.assertEqual(get_best_accept_language('pt-PT,es-AR;q=0.8'), 'es')
+        calls = self.languages_mock.call_count
+        self.assertEqual(get_best_accept_language('pt-PT,es-AR;q=0.8'), 'es')
+        self.assertEqual(self.languages_mock.call_count, calls)
+        self.assertIsNone(get_best_accept_language('en/us'))
+        self.assertIsNone(get_best_accept_language('en/us'))
+        self.assertEqual(self.languages_mock.call_count, calls)
+
+    def test_newsletters_changed(self):
+        """Headers are resolved again once the newsletters change."""
+        self.assertEqual(get_best_accept_language('pt-PT,es;q=0.8'), 'es')
+        self.languages_mock.return_value = ['pt-PT']
+        self.version_mock.return_value = '2'
+        self.assertEqual(get_best_accept_language('pt-PT,es;q=0.8'), 'pt-PT')
+
+    def test_not_cached(self):
+        """Nothing is kept when the cache doesn't keep the version."""
+        self.version_mock.return_value = None
+        get_best_accept_language('pt-PT,es;q=0.8')
+        calls = self.languages_mock.call_count
+        get_best_accept_language('pt-PT,es;q=0.8')
+        self.assertTrue(self.languages_mock.call_count > calls)
+
+
+class LRUCacheTests(TestCase):
+    def test_least_recently_used_dropped(self):
+        cache = LRUCache(4)
+        for key in 'abcd':
+            cache.set(key, key.upper())
+        self.assertEqual(cache.get('a'), 'A')
+        cache.set('e', 'E')
+        # b and c are the least recently used
+        self.assertEqual(sorted(cache.items), ['a', 'd', 'e'])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('b', 'default'), 'default')
@@ -1,10 +1,22 @@
+import socket
+import urllib2
+
+from django.core.cache import cache
 from django.test import TestCase
 from django.test.utils import override_settings
 
+from basket import errors
 from mock import patch, Mock
 from nose.tools import ok_
+from suds.transport import TransportError
 
-from news.backends.exacttarget import logged_in
+from news.backends.breaker import (BREAKER_RESET, BREAKER_THRESHOLD, CLOSED,
+                                   HALF_OPEN, OPEN, CircuitBreaker)
+from news.backends.common import (CircuitOpenException, NewsletterException,
+                                  RateLimitedException)
+from news.backends.deadline import current_deadline, et_call, et_deadline
+from news.backends.exacttarget import ETTransport, logged_in
+from news.backends.throttle import wait_for_capacity
 
 
 @patch('news.backends.exacttarget.Client')
@@ -29,3 +41,228 @@ class TestWSDLSwitch(TestCase):
 
         call_args = client_mock.call_args
         ok_(call_args[0][0].endswith('et-wsdl.txt'))
+
+
+class TestETTransport(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.transport = ETTransport(timeout=5)
+        patcher = patch.object(self.transport, 'u2opener')
+        self.addCleanup(patcher.stop)
+        self.opener = patcher.start()()
+
+    def test_no_deadline(self):
+        """Without a deadline calls get the normal timeout."""
+        self.transport.u2open('request')
+        self.opener.open.assert_called_with('request', timeout=5)
+
+    def test_remaining_time(self):
+        """Calls only get the time left before the deadline."""
+        with et_deadline('test', 2):
+            self.transport.u2open('request')
+        timeout = self.opener.open.call_args[1]['timeout']
+        ok_(0 < timeout <= 2)
+
+    def test_deadline_passed(self):
+        """Once the deadline has passed calls fail without being made."""
+        with et_deadline('test', 0):
+            with self.assertRaises(NewsletterException) as cm:
+                self.transport.u2open('request')
+        self.assertEqual(cm.exception.error_code, errors.BASKET_NETWORK_FAILURE)
+        ok_(not self.opener.open.called)
+
+    @patch('news.backends.exacttarget.HttpAuthenticated.send')
+    def test_timeout_during_deadline(self, send_mock):
+        send_mock.side_effect = socket.timeout()
+        request = Mock(headers={'SOAPAction': '"Retrieve"'})
+        with et_deadline('test', 2):
+            with self.assertRaises(NewsletterException):
+                self.transport.send(request)
+        with self.assertRaises(socket.timeout):
+            self.transport.send(request)
+
+    @patch('news.backends.breaker.BREAKER_THRESHOLD', 2)
+    @patch('news.backends.exacttarget.HttpAuthenticated.send')
+    def test_deadline_timeout_not_failure(self, send_mock):
+        """Timeouts cut short by the deadline don't count against ET."""
+        send_mock.side_effect = socket.timeout()
+        request = Mock(headers={'SOAPAction': '"Retrieve"'})
+        for i in range(3):
+            with et_deadline('test', 2):
+                with self.assertRaises(NewsletterException):
+                    self.transport.send(request)
+
+        # but timeouts with the full timeout do
+        for i in range(2):
+            with et_deadline('test', 10):
+                with self.assertRaises(NewsletterException):
+                    self.transport.send(request)
+        with self.assertRaises(CircuitOpenException):
+            self.transport.send(request)
+
+    @patch('news.backends.breaker.BREAKER_THRESHOLD', 2)
+    @patch('news.backends.exacttarget.HttpAuthenticated.send')
+    def test_circuit_breaker(self, send_mock):
+        """Failing calls open the breaker for that operation only."""
+        send_mock.side_effect = urllib2.URLError('down')
+        retrieve = Mock(headers={'SOAPAction': '"Retrieve"'})
+        for i in range(2):
+            with self.assertRaises(urllib2.URLError):
+                self.transport.send(retrieve)
+
+        send_mock.reset_mock()
+        with self.assertRaises(CircuitOpenException) as cm:
+            self.transport.send(retrieve)
+        self.assertEqual(cm.exception.op, 'Retrieve')
+        ok_(not send_mock.called)
+
+        # SOAP faults mean ET is up
+        send_mock.side_effect = TransportError('fault', 500)
+        update = Mock(headers={'SOAPAction': '"Update"'})
+        for i in range(3):
+            with self.assertRaises(TransportError):
+                self.transport.send(update)
+
+
+@patch('news.backends.breaker.statsd')
+@patch('news.backends.breaker.time')
+class TestCircuitBreaker(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker('Update')
+
+    def fail(self, times=1):
+        for i in range(times):
+            self.breaker.failure(self.breaker.before_call())
+
+    def test_opens(self, time_mock, statsd_mock):
+        time_mock.time.return_value = 1000
+        self.fail(BREAKER_THRESHOLD - 1)
+        self.assertEqual(self.breaker.before_call(), CLOSED)
+        self.fail()
+        with self.assertRaises(CircuitOpenException) as cm:
+            self.breaker.before_call()
+        self.assertEqual(cm.exception.retry_after, BREAKER_RESET)
+        statsd_mock.gauge.assert_called_with('news.et_breaker.Update.state', OPEN)
+
+    def test_half_open(self, time_mock, statsd_mock):
+        """Once the reset time is up, one call at a time gets through,
+        and the breaker closes if it works."""
+        time_mock.time.return_value = 1000
+        self.fail(BREAKER_THRESHOLD)
+
+        time_mock.time.return_value = 1000 + BREAKER_RESET
+        state = self.breaker.before_call()
+        self.assertEqual(state, HALF_OPEN)
+        with self.assertRaises(CircuitOpenException):
+            self.breaker.before_call()
+
+        self.breaker.success(state)
+        self.assertEqual(self.breaker.before_call(), CLOSED)
+        statsd_mock.gauge.assert_called_with('news.et_breaker.Update.state', CLOSED)
+
+    def test_half_open_failure(self, time_mock, statsd_mock):
+        """If the trial call fails the breaker opens again."""
+        time_mock.time.return_value = 1000
+        self.fail(BREAKER_THRESHOLD)
+
+        time_mock.time.return_value = 1000 + BREAKER_RESET
+        self.fail()
+        with self.assertRaises(CircuitOpenException):
+            self.breaker.before_call()
+
+    def test_separate_operations(self, time_mock, statsd_mock):
+        time_mock.time.return_value = 1000
+        self.fail(BREAKER_THRESHOLD)
+        self.assertEqual(CircuitBreaker('Retrieve').before_call(), CLOSED)
+
+
+@patch('news.backends.throttle.statsd')
+@patch('news.backends.throttle.time')
+@patch('news.backends.throttle.RATE_LIMITS', {'Update': '2/s', 'REST': '1/m'})
+class TestThrottle(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_unlimited(self, time_mock, statsd_mock):
+        for i in range(5):
+            wait_for_capacity('Retrieve')
+        ok_(not time_mock.sleep.called)
+
+    def clock(self, time_mock, now):
+        """Have the throttle's time start at ``now``, and move on when it
+        sleeps."""
+        clock = [now]
+        time_mock.time.side_effect = lambda: clock[0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+
+        time_mock.sleep.side_effect = sleep
+        return clock
+
+    def test_waits_for_refill(self, time_mock, statsd_mock):
+        clock = self.clock(time_mock, 100.0)
+        wait_for_capacity('Update')
+        wait_for_capacity('Update')
+        statsd_mock.gauge.assert_called_with('news.et_throttle.Update.fill', 0)
+        ok_(not time_mock.sleep.called)
+
+        # a quarter second later half a token has come back, so the third
+        # call waits for the other half
+        clock[0] = 100.25
+        wait_for_capacity('Update')
+        time_mock.sleep.assert_called_once_with(0.25)
+        statsd_mock.timing.assert_called_with('news.et_throttle.Update.wait', 250)
+
+    def test_no_burst_at_boundary(self, time_mock, statsd_mock):
+        """Unlike a window counter, the bucket doesn't allow the whole
+        next period's calls as soon as it starts."""
+        clock = self.clock(time_mock, 100.9)
+        wait_for_capacity('Update')
+        wait_for_capacity('Update')
+        clock[0] = 101.0
+        wait_for_capacity('Update')
+        self.assertAlmostEqual(time_mock.sleep.call_args[0][0], 0.4)
+
+    @patch('news.backends.throttle.RATE_LIMIT_BURST', 0.1)
+    def test_burst_capped(self, time_mock, statsd_mock):
+        """After a quiet spell only the burst's worth of calls go at once."""
+        self.clock(time_mock, 100.0)
+        with patch('news.backends.throttle.RATE_LIMITS', {'Update': '50/s'}):
+            for i in range(5):
+                wait_for_capacity('Update')
+            ok_(not time_mock.sleep.called)
+            wait_for_capacity('Update')
+        self.assertAlmostEqual(time_mock.sleep.call_args[0][0], 0.02)
+
+    def test_gives_up(self, time_mock, statsd_mock):
+        self.clock(time_mock, 120.0)
+        wait_for_capacity('REST')
+        with self.assertRaises(RateLimitedException) as cm:
+            wait_for_capacity('REST')
+        self.assertEqual(cm.exception.retry_after, 60)
+        ok_(not time_mock.sleep.called)
+
+    def test_deadline_limits_wait(self, time_mock, statsd_mock):
+        self.clock(time_mock, 100.5)
+        wait_for_capacity('Update')
+        wait_for_capacity('Update')
+        with et_deadline('test', 0.25):
+            with self.assertRaises(RateLimitedException):
+                wait_for_capacity('Update')
+
+
+@patch('news.backends.deadline.statsd')
+class TestETDeadline(TestCase):
+    def test_calls_recorded(self, statsd_mock):
+        with et_deadline('outer', 5) as deadline:
+            with et_deadline('inner', 1) as inner:
+                with et_call():
+                    pass
+            with et_call():
+                pass
+        ok_(inner is deadline)
+        self.assertEqual(deadline.calls, 2)
+        statsd_mock.timing.assert_any_call('news.et_deadline.outer.calls', 2)
+        ok_(current_deadline() is None)
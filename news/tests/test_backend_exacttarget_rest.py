@@ -1,9 +1,13 @@
 from django.conf import settings
+from django.core.cache import cache
 from django.test import TestCase
 from django.test.utils import override_settings
 
+import requests
 from mock import Mock, patch
 
+from news.backends.common import CircuitOpenException
+from news.backends.deadline import et_deadline
 from news.backends.exacttarget_rest import ETRestError, ExactTargetRest
 
 
@@ -87,3 +91,36 @@ class ExactTargetRestTests(TestCase):
             backend.auth_token
 
         self.assertEqual(str(ETRE.exception), '17: SNAKES')
+
+    @patch('news.backends.breaker.BREAKER_THRESHOLD', 2)
+    def test_circuit_breaker(self):
+        """Server errors open the REST circuit breaker."""
+        cache.clear()
+        backend = ExactTargetRest()
+        self.request.return_value.status_code = 503
+        backend._request('auth', {})
+        backend._request('auth', {})
+
+        self.request.reset_mock()
+        with self.assertRaises(CircuitOpenException):
+            backend._request('auth', {})
+        self.assertFalse(self.request.called)
+        cache.clear()
+
+    @patch('news.backends.breaker.BREAKER_THRESHOLD', 2)
+    def test_circuit_breaker_errors(self):
+        """Other server errors, and timeouts cut short by the deadline,
+        are ET answering, and don't open the breaker."""
+        cache.clear()
+        self.addCleanup(cache.clear)
+        backend = ExactTargetRest()
+        self.request.return_value.status_code = 500
+        for i in range(3):
+            backend._request('auth', {})
+
+        self.request.side_effect = requests.Timeout()
+        for i in range(3):
+            with et_deadline('test', 2):
+                with self.assertRaises(requests.Timeout):
+                    backend._request('auth', {})
+        self.assertEqual(self.request.call_count, 6)
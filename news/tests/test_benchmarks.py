@@ -0,0 +1,121 @@
+import logging
+
+from django.test import TestCase
+
+from mock import patch
+
+from news.benchmarks.api import run_benchmarks
+from news.benchmarks import micro, startup
+from news.benchmarks.base import change, percentile, summarize
+from news.newsletters import (clear_newsletter_cache, newsletter_group_newsletter_slugs,
+                              newsletter_slugs)
+from news.utils import email_block_list_cache
+
+
+class BaseTest(TestCase):
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3], 99), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summarize(self):
+        summary = summarize([0.1, 0.3])
+        self.assertEqual(summary['ops'], 2)
+        self.assertEqual(summary['ops_per_sec'], 5.0)
+        self.assertEqual(summary['p50_ms'], 100.0)
+        self.assertEqual(summary['p99_ms'], 300.0)
+
+    def test_change(self):
+        self.assertEqual(change(10, 12), 20.0)
+        self.assertIsNone(change(0, 12))
+
+
+class APIBenchmarkTest(TestCase):
+    def setUp(self):
+        # suds' debug logging of the messages breaks nose's log capture
+        suds_log = logging.getLogger('suds')
+        self.addCleanup(suds_log.setLevel, suds_log.level)
+        suds_log.setLevel(logging.INFO)
+
+    def test_run(self):
+        results = run_benchmarks(iterations=2, latency=0,
+                                 names=['user', 'send_message'])
+        self.assertEqual(results['user']['ops'], 2)
+        self.assertEqual(results['user']['errors'], 0)
+        self.assertEqual(results['user']['et_calls_per_op'], {'Retrieve': 1.0})
+        self.assertTrue(results['user']['db_queries_per_op'] >= 1)
+        self.assertEqual(results['send_message']['et_calls_per_op'], {'Create': 1.0})
+
+
+class MicroBenchmarkTest(TestCase):
+    def tearDown(self):
+        clear_newsletter_cache()
+        email_block_list_cache.clear()
+
+    @patch('news.benchmarks.micro.MIN_SECONDS', 0)
+    def test_run(self):
+        results = micro.run_benchmarks(sizes=[10, 20], repeat=1, names=[
+            'language_code_is_valid', 'email_is_blocked', 'look_for_user.flags'])
+        self.assertEqual(sorted(results), [
+            'email_is_blocked/10', 'email_is_blocked/20',
+            'language_code_is_valid',
+            'look_for_user.flags/10', 'look_for_user.flags/20',
+        ])
+        self.assertEqual(results['language_code_is_valid']['number'], 1)
+
+    @patch('news.benchmarks.micro.MIN_SECONDS', 0)
+    @patch('news.benchmarks.micro.SLOW_CALL', 0)
+    def test_too_slow(self):
+        """Cases too slow to time are skipped at the larger sizes."""
+        results = micro.run_benchmarks(sizes=[20, 10], names=['email_is_blocked'])
+        self.assertIsNotNone(results['email_is_blocked/10']['us_per_call'])
+        self.assertIsNone(results['email_is_blocked/20']['us_per_call'])
+
+    def test_registry(self):
+        micro.make_registry(20)
+        self.assertEqual(len(newsletter_slugs()), 20)
+        self.assertEqual(sorted(newsletter_group_newsletter_slugs('group-0')),
+                         ['newsletter-0', 'newsletter-1', 'newsletter-2',
+                          'newsletter-3', 'newsletter-4'])
+
+    def test_regressions(self):
+        baseline = {
+            'a/10': {'us_per_call': 10.0},
+            'b/10': {'us_per_call': 10.0},
+            'c/10': {'us_per_call': 10.0},
+            'd/10': {'us_per_call': None, 'skipped': True},
+        }
+        results = {
+            'a/10': {'us_per_call': 12.0},
+            'b/10': {'us_per_call': 13.0},
+            'c/10': {'us_per_call': None, 'skipped': True},
+            'd/10': {'us_per_call': None, 'skipped': True},
+            'e/10': {'us_per_call': 100.0},
+        }
+        self.assertEqual(micro.regressions(results, baseline), [
+            ('b/10', 10.0, 13.0),
+            ('c/10', 10.0, None),
+        ])
+
+
+class StartupBenchmarkTest(TestCase):
+    def test_run(self):
+        results = startup.run_benchmarks(['news.models'], repeat=1, top=1000)
+        self.assertTrue(results['news.models']['seconds'] > 0)
+        modules = [name for name, cumulative, own in results['news.models']['modules']]
+        self.assertIn('news.fields', modules)
+
+    def test_import_timer(self):
+        timer = startup.ImportTimer()
+        timer.install()
+        try:
+            import news.benchmarks.startup  # noqa, already imported
+            import news.benchmarks.base  # noqa
+            __import__('this_module_does_not_exist_%s' % id(timer))
+        except ImportError:
+            pass
+        finally:
+            timer.uninstall()
+        self.assertEqual(timer.modules, {})
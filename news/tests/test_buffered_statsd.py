@@ -0,0 +1,87 @@
+import socket
+
+from django.test import TestCase
+
+from mock import Mock, patch
+
+from news.buffered_statsd import StatsClient
+
+
+@patch('news.buffered_statsd.threading.Timer')
+class BufferedStatsClientTest(TestCase):
+    def setUp(self):
+        self.client = StatsClient(prefix='basket', buffer_size=5,
+                                  flush_interval=10, maxudpsize=60)
+        self.client._sock = Mock()
+
+    def sent(self):
+        return [c[0][0] for c in self.client._sock.sendto.call_args_list]
+
+    def test_aggregated(self, timer_mock):
+        """Counters are added up, and sent together on flush."""
+        self.client.incr('view.count.GET')
+        self.client.incr('view.count.GET')
+        self.client.decr('view.count.GET', 5)
+        self.client.timing('view.news.GET', 12)
+        self.assertFalse(self.client._sock.sendto.called)
+        timer_mock.assert_called_once_with(10, self.client.flush)
+
+        self.client.flush()
+        self.assertEqual(self.sent(), [
+            'basket.view.news.GET:12|ms\nbasket.view.count.GET:-3|c',
+        ])
+        self.assertTrue(timer_mock().cancel.called)
+
+    def test_forked(self, timer_mock):
+        """A forked process doesn't send what its parent buffered, and
+        gets its own lock and flush timer."""
+        self.client.incr('parent.count')
+        self.client.timing('parent.time', 1)
+        parent_lock = self.client.lock
+        parent_lock.acquire()
+        self.addCleanup(parent_lock.release)
+
+        with patch('news.buffered_statsd.os.getpid', return_value=self.client.pid + 1):
+            self.client.incr('child.count')
+            self.assertIsNot(self.client.lock, parent_lock)
+            self.assertEqual(timer_mock.call_count, 2)
+            self.client.flush()
+        self.assertEqual(self.sent(), ['basket.child.count:1|c'])
+
+    def test_buffer_size(self, timer_mock):
+        for i in range(5):
+            self.client.incr('counter.%d' % i)
+        # two to a packet
+        self.assertEqual(len(self.sent()), 3)
+        self.assertEqual(self.client.lines, [])
+        self.assertEqual(self.client.counters, {})
+
+    def test_packet_size(self, timer_mock):
+        """Packets are kept to maxudpsize."""
+        self.client.timing('a.long.timer.name', 1)
+        self.client.timing('a.long.timer.name', 2)
+        self.client.timing('a.long.timer.name', 3)
+        self.client.flush()
+        self.assertEqual(self.sent(), [
+            'basket.a.long.timer.name:1|ms\nbasket.a.long.timer.name:2|ms',
+            'basket.a.long.timer.name:3|ms',
+        ])
+
+    @patch('news.buffered_statsd.random.random')
+    def test_sample_rate(self, random_mock, timer_mock):
+        random_mock.return_value = 0.9
+        self.client.incr('sampled', rate=0.5)
+        random_mock.return_value = 0.1
+        self.client.incr('sampled', rate=0.5)
+        self.client.flush()
+        self.assertEqual(self.sent(), ['basket.sampled:1|c|@0.5'])
+
+    def test_dropped(self, timer_mock):
+        self.client._sock.sendto.side_effect = socket.error
+        self.client.incr('counter')
+        self.client.flush()
+        self.assertEqual(self.client.dropped, 1)
+
+        self.client._sock.sendto.side_effect = None
+        self.client.flush()
+        self.assertEqual(self.sent()[-1], 'basket.news.statsd.dropped:1|c')
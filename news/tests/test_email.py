@@ -1,17 +1,24 @@
+from django.core.cache import cache
 from django.test import TestCase
 
+from flanker.addresslib import address
 from flanker.addresslib.address import EmailAddress
-from mock import patch
+from mock import Mock, patch
 from nose.tools import ok_, eq_
 
-from news.email import get_valid_email
+from news.email import (UNRESOLVED, ResolverError, dns_resolver, get_mail_exchanger,
+                        get_mail_exchangers, get_valid_email, get_valid_emails, mx_cache)
 
 
+@patch('news.email.EMAIL_DOMAIN_RESOLVER', 'news.email.local_resolver')
 @patch('news.email.validate.suggest_alternate')
 @patch('news.email.address.validate_address')
 class TestGetValidEmail(TestCase):
     email = 'dude@example.com'
 
+    def tearDown(self):
+        cache.clear()
+
     def test_valid_email(self, mock_validate, mock_suggest):
         """Should allow a valid email to pass through."""
         mock_suggest.return_value = None
@@ -44,3 +51,109 @@ class TestGetValidEmail(TestCase):
         mock_validate.return_value = None
         result = get_valid_email(self.email)[0]
         ok_(not result)
+
+
+class MailExchangerTests(TestCase):
+    def setUp(self):
+        def resolve(domain):
+            if 'flaky' in domain:
+                raise ResolverError('timed out')
+            return None if 'bad' in domain else 'mx.' + domain
+
+        self.resolver = Mock(side_effect=resolve)
+        patcher = patch('news.email.get_resolver', return_value=self.resolver)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(cache.clear)
+
+    @patch('news.email.cache')
+    def test_ttls(self, cache_mock):
+        """Domains with and without exchangers are cached for their TTLs."""
+        cache_mock.get.return_value = None
+        with patch('news.email.EMAIL_DOMAIN_TTL', 100):
+            with patch('news.email.EMAIL_DOMAIN_NEGATIVE_TTL', 10):
+                eq_(get_mail_exchanger('example.com'), 'mx.example.com')
+                eq_(get_mail_exchanger('bad.example.com'), None)
+        eq_([c[0][1:] for c in cache_mock.set.call_args_list],
+            [('mx.example.com', 100), ('False', 10)])
+
+    def test_cached(self):
+        eq_(get_mail_exchanger('example.com'), 'mx.example.com')
+        eq_(get_mail_exchanger('EXAMPLE.com'), 'mx.example.com')
+        eq_(get_mail_exchanger('bad.example.com'), None)
+        eq_(get_mail_exchanger('bad.example.com'), None)
+        eq_(self.resolver.call_count, 2)
+
+    def test_batch(self):
+        """Only the domains not cached are looked up, once each."""
+        get_mail_exchanger('example.com')
+        exchangers = get_mail_exchangers(['example.com', 'example.org',
+                                          'Example.org', 'bad.example.org'])
+        eq_(exchangers, {
+            'example.com': 'mx.example.com',
+            'example.org': 'mx.example.org',
+            'bad.example.org': None,
+        })
+        eq_(sorted(c[0][0] for c in self.resolver.call_args_list),
+            ['bad.example.org', 'example.com', 'example.org'])
+        eq_(mx_cache['bad.example.org'], 'False')
+
+    def test_unresolved(self):
+        """A domain that couldn't be looked up isn't cached."""
+        ok_(get_mail_exchanger('flaky.example.com') is UNRESOLVED)
+        exchangers = get_mail_exchangers(['flaky.example.com', 'example.com'])
+        ok_(exchangers['flaky.example.com'] is UNRESOLVED)
+        eq_(self.resolver.call_count, 3)
+        eq_(mx_cache['flaky.example.com'], None)
+
+    @patch('news.email.get_resolver')
+    def test_unresolved_valid(self, resolver_mock):
+        """An address at a domain that couldn't be looked up is accepted
+        if it's well formed."""
+        resolver_mock.return_value.side_effect = ResolverError('timed out')
+        eq_(get_valid_email('dude@example.com'), ('dude@example.com', False))
+        eq_(get_valid_emails(['dude@example.com', 'dude@@example.com']),
+            [('dude@example.com', False), (None, False)])
+
+
+@patch('news.email.validate.connect_to_mail_exchanger')
+@patch('news.email.dnsq.mx_hosts_for')
+class DNSResolverTests(TestCase):
+    def test_found(self, mx_hosts_mock, connect_mock):
+        mx_hosts_mock.return_value = ['mx1.example.com', 'mx2.example.com']
+        connect_mock.return_value = 'mx1.example.com'
+        eq_(dns_resolver('example.com'), 'mx1.example.com')
+        mx_hosts_mock.assert_called_once_with('example.com.')
+        connect_mock.assert_called_once_with(['mx1.example.com', 'mx2.example.com'])
+
+    def test_no_domain(self, mx_hosts_mock, connect_mock):
+        """A domain that doesn't exist has no mail exchanger."""
+        mx_hosts_mock.return_value = []
+        eq_(dns_resolver('example.invalid'), None)
+        ok_(not connect_mock.called)
+
+    def test_dns_failure(self, mx_hosts_mock, connect_mock):
+        """A DNS failure, after trying twice, isn't taken as no mail exchanger."""
+        mx_hosts_mock.side_effect = Exception('DNS failure for example.com.')
+        with self.assertRaises(ResolverError):
+            dns_resolver('example.com')
+        eq_(mx_hosts_mock.call_count, 2)
+
+
+@patch('news.email.EMAIL_DOMAIN_RESOLVER', 'news.email.local_resolver')
+class FlankerValidationTests(TestCase):
+    def tearDown(self):
+        cache.clear()
+
+    def test_flanker_uses_cache(self):
+        """flanker's own MX lookups get the cached domains."""
+        get_mail_exchanger('example.com')
+        get_mail_exchanger('example.invalid')
+        with patch('news.email.validate.lookup_domain') as lookup_mock:
+            ok_(isinstance(address.validate_address('dude@example.com'), EmailAddress))
+            ok_(address.validate_address('dude@example.invalid') is None)
+        ok_(not lookup_mock.called)
+
+    def test_get_valid_emails(self):
+        eq_(get_valid_emails(['dude@example.com', None, 'dude@example.invalid']),
+            [('dude@example.com', False), (None, None), (None, False)])
@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.db import DatabaseError
+from django.test import TestCase
+from django.utils.timezone import now
+
+from mock import patch
+
+from news.failures import FailureRecorder, save_failures
+from news.models import FailedTask, FailedTaskName, TaskTraceback
+
+
+@patch('news.failures.threading.Timer')
+class FailureRecorderTest(TestCase):
+    def setUp(self):
+        self.spill_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spill_dir)
+        self.recorder = FailureRecorder(size=3, seconds=10,
+                                        spill_dir=self.spill_dir)
+
+    def record(self, task_id, einfo='Traceback: it broke'):
+        self.recorder.record(task_id, 'news.tasks.update_user',
+                             ['dude@example.com'], {'token': 'abides'},
+                             Exception('broke'), einfo)
+
+    def test_buffered(self, timer_mock):
+        """Failures are saved together once enough have built up."""
+        self.record('1')
+        self.record('2')
+        self.assertFalse(FailedTask.objects.exists())
+        timer_mock.assert_called_once_with(10, self.recorder.flush_in_thread)
+        self.assertTrue(timer_mock().start.called)
+
+        self.record('3', einfo='Traceback: something else')
+        self.assertEqual(FailedTask.objects.count(), 3)
+        self.assertTrue(timer_mock().cancel.called)
+        self.assertTrue(FailedTaskName.objects.filter(name='news.tasks.update_user')
+                        .exists())
+
+        fail = FailedTask.objects.get(task_id='1')
+        self.assertEqual(fail.args, ['dude@example.com'])
+        self.assertEqual(fail.kwargs, {'token': 'abides'})
+        self.assertEqual(fail.exc, "Exception('broke',)")
+        self.assertEqual(fail.einfo, 'Traceback: it broke')
+
+    def test_tracebacks_shared(self, timer_mock):
+        self.record('1')
+        self.record('2')
+        self.recorder.flush()
+        self.record('3')
+        self.recorder.flush()
+        self.assertEqual(TaskTraceback.objects.count(), 1)
+        self.assertEqual(FailedTask.objects.filter(traceback__isnull=False).count(), 3)
+
+        # each use of it is noted, for the purge to leave it be
+        TaskTraceback.objects.update(last_used=now() - timedelta(days=1))
+        self.record('4')
+        self.recorder.flush()
+        self.assertTrue(TaskTraceback.objects.get().last_used > now() - timedelta(hours=1))
+
+    def test_flush_now(self, timer_mock):
+        self.recorder.record('1', 'news.tasks.update_user', [], {},
+                             Exception('broke'), 'Traceback', flush=True)
+        self.assertTrue(FailedTask.objects.filter(task_id='1').exists())
+        self.assertFalse(timer_mock.called)
+
+    def test_spill(self, timer_mock):
+        """Failures are kept on disk while the database is unavailable."""
+        self.record('1')
+        with patch('news.failures.save_failures') as save_mock:
+            save_mock.side_effect = DatabaseError('gone')
+            self.recorder.flush()
+        self.assertFalse(FailedTask.objects.exists())
+        self.assertEqual(len(os.listdir(self.spill_dir)), 1)
+
+        self.record('2')
+        self.recorder.flush()
+        self.assertEqual(sorted(FailedTask.objects.values_list('task_id', flat=True)),
+                         ['1', '2'])
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_byte_string_traceback(self, timer_mock):
+        """A traceback that's a byte string of anything is saved."""
+        self.record('1', einfo='Traceback: \xe2\x80\x9cbroke\xe2\x80\x9d \xff')
+        self.recorder.flush()
+        fail = FailedTask.objects.get(task_id='1')
+        self.assertEqual(fail.einfo, u'Traceback: \u201cbroke\u201d \ufffd')
+
+    def test_unexpected_error(self, timer_mock):
+        """If the batch can't be saved, the failures that can be are."""
+        self.record('1')
+        self.record('2')
+
+        def save(failures):
+            if len(failures) > 1 or failures[0]['task_id'] == '1':
+                raise ValueError('bad')
+            return save_failures(failures)
+
+        with patch('news.failures.save_failures') as save_mock:
+            save_mock.side_effect = save
+            with patch('news.failures.log') as log_mock:
+                self.recorder.flush()
+        self.assertEqual(list(FailedTask.objects.values_list('task_id', flat=True)),
+                         ['2'])
+        self.assertIn('"task_id": "1"', log_mock.exception.call_args[0][0])
+        self.assertEqual(self.recorder.buffer, [])
+
+
+class SaveFailuresTest(TestCase):
+    def test_already_saved(self):
+        """Failures already saved, e.g. from a spill, aren't saved again."""
+        FailedTask.objects.create(task_id='1', name='news.tasks.update_user')
+        save_failures([{'when': 0, 'task_id': '1', 'name': 'news.tasks.update_user',
+                        'args': [], 'kwargs': {}, 'exc': '', 'einfo': ''}])
+        self.assertEqual(FailedTask.objects.count(), 1)
@@ -0,0 +1,90 @@
+import logging
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from mock import patch
+
+from news.backends.common import NewsletterException, NewsletterNoResultsException
+from news.backends.exacttarget import ExactTarget, logged_in
+from news.backends.exacttarget_rest import ETRestError, ExactTargetRest
+from news.backends.fake_et import FakeET, FakeETServer
+
+
+@override_settings(ET_CLIENT_ID='client_id', ET_CLIENT_SECRET='client_secret')
+class FakeETTest(TestCase):
+    def setUp(self):
+        self.server = FakeETServer(('127.0.0.1', 0), et=FakeET(page_size=2))
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        for module in ('exacttarget', 'exacttarget_rest'):
+            patcher = patch('news.backends.%s.ET_FAKE_URL' % module, self.server.url)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # clear the cached client, and don't leave ours around
+        logged_in.cached_client = None
+        self.addCleanup(setattr, logged_in, 'cached_client', None)
+        self.data_ext = ExactTarget('user', 'pass').data_ext()
+        # suds' debug logging of the messages breaks nose's log capture
+        suds_log = logging.getLogger('suds')
+        self.addCleanup(suds_log.setLevel, suds_log.level)
+        suds_log.setLevel(logging.INFO)
+
+    def test_records(self):
+        self.data_ext.add_record('Master', ['TOKEN', 'EMAIL_ADDRESS_', 'LANGUAGE_ISO2'],
+                                 ['abides', 'dude@example.com', 'en'])
+        self.data_ext.add_records('Master', [
+            {'TOKEN': 'abides', 'LANGUAGE_ISO2': 'fr'},
+            {'TOKEN': 'bowls', 'EMAIL_ADDRESS_': 'walter@example.com'},
+        ])
+        self.assertEqual(self.data_ext.get_record('Master', 'DUDE@example.com',
+                                                  ['TOKEN', 'LANGUAGE_ISO2'],
+                                                  field='EMAIL_ADDRESS_'),
+                         {'TOKEN': 'abides', 'LANGUAGE_ISO2': 'fr'})
+        self.assertEqual(self.server.et.calls, {'Update': 2, 'Retrieve': 1})
+
+        self.data_ext.delete_record('Master', 'abides')
+        with self.assertRaises(NewsletterNoResultsException):
+            self.data_ext.get_record('Master', 'abides', ['TOKEN'])
+        with self.assertRaises(NewsletterException):
+            self.data_ext.delete_record('Master', 'abides')
+
+    def test_paging(self):
+        """Results past the page size are fetched with ContinueRequest."""
+        tokens = ['a', 'b', 'c', 'd', 'e']
+        self.data_ext.add_records('Master', [{'TOKEN': t} for t in tokens])
+        records = self.data_ext.get_records('Master', tokens + ['x'], ['TOKEN'])
+        self.assertEqual(sorted(r['TOKEN'] for r in records), tokens)
+        self.assertEqual(self.server.et.calls['Retrieve'], 3)
+
+    def test_trigger_send(self):
+        ExactTarget('user', 'pass').trigger_send('Welcome', {
+            'EMAIL_ADDRESS_': 'dude@example.com',
+            'TOKEN': 'abides',
+            'EMAIL_FORMAT_': 'H',
+        })
+        send = self.server.et.sends[0]
+        self.assertEqual(send['definition'], 'Welcome')
+        self.assertEqual(send['subscribers'][0]['email'], 'dude@example.com')
+        self.assertEqual(send['subscribers'][0]['format'], 'HTML')
+        self.assertEqual(send['subscribers'][0]['attributes']['TOKEN'], 'abides')
+
+    def test_sms(self):
+        rest = ExactTargetRest()
+        rest.send_sms(['5555555555'], 'SMS_Android')
+        self.assertEqual(self.server.et.sms, [
+            {'message_id': 'SMS_Android', 'numbers': ['5555555555']},
+        ])
+        with self.assertRaises(ETRestError):
+            rest.send_sms([], 'SMS_Android')
+
+    def test_errors(self):
+        self.server.error_rate = 1
+        with self.assertRaises(Exception) as cm:
+            self.data_ext.get_record('Master', 'abides', ['TOKEN'])
+        # suds reports statuses other than 200 and 500 as (status, reason)
+        self.assertEqual(cm.exception.args[0][0], 503)
+
+        self.server.error_status = 500
+        with self.assertRaises(NewsletterException):
+            self.data_ext.add_record('Master', ['TOKEN'], ['abides'])
@@ -2,7 +2,7 @@ from django.test import TestCase
 
 from mock import call, Mock, patch
 
-from news.fields import CommaSeparatedEmailField
+from news.fields import CommaSeparatedEmailField, LazyChoices
 
 
 class CommaSeparatedEmailFieldTests(TestCase):
@@ -50,3 +50,17 @@ class CommaSeparatedEmailFieldTests(TestCase):
         instance.blah = 'bob@example.com  ,,,, larry@example.com '
         self.assertEqual(self.field.pre_save(instance, False),
                          'bob@example.com,larry@example.com')
+
+
+class LazyChoicesTests(TestCase):
+    def test_lazy(self):
+        """The choices should only be made once, when first used."""
+        make_choices = Mock(return_value=[('en', 'English'), ('fr', 'French')])
+        choices = LazyChoices(make_choices)
+        self.assertTrue(choices)
+        self.assertFalse(make_choices.called)
+
+        self.assertEqual(list(choices), [('en', 'English'), ('fr', 'French')])
+        self.assertEqual(len(choices), 2)
+        self.assertEqual(choices[1], ('fr', 'French'))
+        make_choices.assert_called_once_with()
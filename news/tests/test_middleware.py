@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from mock import patch
+
+from news.middleware import ProfilerMiddleware, profile_files
+
+
+def profiled_view(request):
+    return HttpResponse('ok')
+
+
+class ProfilerMiddlewareTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        patcher = patch('news.middleware.PROFILE_DIR', self.dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.middleware = ProfilerMiddleware()
+
+    def request(self, duration=0.1):
+        request = RequestFactory().get('/news/')
+        with patch('news.middleware.time.time') as time_mock:
+            time_mock.return_value = 1000
+            self.middleware.process_view(request, profiled_view, (), {})
+            profiled_view(request)
+            time_mock.return_value = 1000 + duration
+            self.middleware.process_response(request, HttpResponse())
+        return request
+
+    def test_not_sampled(self):
+        self.request()
+        self.assertEqual(profile_files(), [])
+
+    @patch('news.middleware.PROFILE_SAMPLE_RATE', 1)
+    def test_sampled(self):
+        self.request()
+        files = [os.path.basename(p) for p in profile_files()]
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith(
+            'news.tests.test_middleware.profiled_view.'))
+        self.assertTrue('.100ms.' in files[0])
+
+    @patch('news.middleware.PROFILE_SLOW_SECONDS', 0.5)
+    def test_slow(self):
+        """Only requests slower than PROFILE_SLOW_SECONDS are saved."""
+        self.request(duration=0.1)
+        self.assertEqual(profile_files(), [])
+        self.request(duration=1)
+        self.assertEqual(len(profile_files()), 1)
+
+    @patch('news.middleware.PROFILE_SAMPLE_RATE', 1)
+    @patch('news.middleware.PROFILE_MAX_FILES', 2)
+    def test_rotate(self):
+        for i in range(3):
+            self.request()
+            # the newest are told apart by mtime
+            for j, path in enumerate(profile_files()):
+                os.utime(path, (j, j))
+        self.assertEqual(len(profile_files()), 2)
+
+    @patch('news.middleware.PROFILE_SAMPLE_RATE', 1)
+    def test_report(self):
+        self.request()
+        self.request()
+        out = StringIO()
+        call_command('profile_report', dir=self.dir, top=5, stdout=out)
+        self.assertTrue('     2  news.tests.test_middleware.profiled_view' in
+                        out.getvalue())
+        self.assertTrue('profiled_view' in out.getvalue().split('\n', 2)[2])
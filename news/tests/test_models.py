@@ -4,6 +4,7 @@ from django.test import TestCase
 from mock import patch
 
 from news import models
+from news.stewards import send_notifications
 
 
 class SubscriberTest(TestCase):
@@ -88,9 +89,11 @@ class InterestTests(TestCase):
         If there are no locale-specific stewards for the given language,
         notify the default stewards.
         """
-        interest = models.Interest(title='mytest',
-                                   default_steward_emails='bob@example.com,bill@example.com')
+        interest = models.Interest.objects.create(
+            title='mytest',
+            default_steward_emails='bob@example.com,bill@example.com')
         interest.notify_stewards('Steve', 'interested@example.com', 'en-US', 'BYE')
+        send_notifications()
 
         self.assertEqual(len(mail.outbox), 1)
         email = mail.outbox[0]
@@ -110,6 +113,7 @@ class InterestTests(TestCase):
             locale='ach',
             emails='ach@example.com')
         interest.notify_stewards('Steve', 'interested@example.com', 'ach', 'BYE')
+        send_notifications()
 
         self.assertEqual(len(mail.outbox), 1)
         email = mail.outbox[0]
@@ -1,5 +1,6 @@
 # -*- coding: utf8 -*-
 
+from django.core.cache import cache
 from django.test import TestCase
 
 from mock import patch
@@ -101,3 +102,59 @@ class TestNewsletterUtils(TestCase):
                                                    set(['bowling', 'surfing', 'extorting']))
         self.assertEqual(to_unsub, ['bowling'])
         self.assertEqual(record['BOWLING_FLG'], 'N')
+
+
+class TestMessageRouting(TestCase):
+    def setUp(self):
+        Newsletter.objects.create(slug='bowling', vendor_id='BOWLING',
+                                  welcome='BOWLING_WELCOME', languages='en,fr,pt-BR',
+                                  requires_double_optin=True,
+                                  confirm_message='BOWLING_CONFIRM', order=2)
+        Newsletter.objects.create(slug='surfing', vendor_id='SURFING',
+                                  languages='de', confirm_message='SURFING_CONFIRM',
+                                  order=1)
+
+    def test_welcome_message_id(self):
+        self.assertEqual(newsletters.welcome_message_id('bowling', 'fr', 'T'),
+                         'fr_BOWLING_WELCOME_T')
+        self.assertEqual(newsletters.welcome_message_id('bowling', 'pt-BR', 'H'),
+                         'pt_BOWLING_WELCOME')
+
+    def test_welcome_message_id_unsupported_lang(self):
+        """Languages the newsletter doesn't support get the English welcome."""
+        self.assertEqual(newsletters.welcome_message_id('bowling', 'de', 'H'),
+                         'en_BOWLING_WELCOME')
+        self.assertEqual(newsletters.welcome_message_id('bowling', '', 'T'),
+                         'en_BOWLING_WELCOME_T')
+
+    def test_welcome_message_id_none(self):
+        self.assertIsNone(newsletters.welcome_message_id('surfing', 'de', 'H'))
+        self.assertIsNone(newsletters.welcome_message_id('curling', 'en', 'H'))
+
+    def test_optin_exempt(self):
+        self.assertTrue(newsletters.optin_exempt(['bowling', 'surfing']))
+        self.assertFalse(newsletters.optin_exempt(['bowling']))
+        self.assertFalse(newsletters.optin_exempt([]))
+
+    def test_confirm_message_id(self):
+        """The first newsletter in order with a confirmation message wins."""
+        self.assertEqual(newsletters.confirm_message_id(['bowling', 'surfing']),
+                         'SURFING_CONFIRM')
+        self.assertEqual(newsletters.confirm_message_id(['bowling']),
+                         'BOWLING_CONFIRM')
+        self.assertIsNone(newsletters.confirm_message_id(['curling']))
+
+    def test_old_format_cached(self):
+        """Data cached in the format before routing tables doesn't break."""
+        self.addCleanup(newsletters.clear_newsletter_cache)
+        cache.set(newsletters.CACHE_KEY, {'by_name': {}, 'by_vendor_id': {}})
+        self.assertIsNone(newsletters.welcome_message_id('bowling', 'fr', 'T'))
+        self.assertFalse(newsletters.optin_exempt(['surfing']))
+        self.assertIsNone(newsletters.confirm_message_id(['bowling']))
+
+    def test_no_queries(self):
+        newsletters.welcome_message_id('bowling', 'fr', 'T')
+        with self.assertNumQueries(0):
+            newsletters.welcome_message_id('bowling', 'en', 'H')
+            newsletters.optin_exempt(['surfing'])
+            newsletters.confirm_message_id(['bowling'])
@@ -0,0 +1,90 @@
+import json
+
+from django.test import TestCase
+
+from kombu.serialization import dumps, loads
+from mock import patch
+
+from news import payloads
+from news.models import Newsletter
+from news.newsletters import clear_newsletter_cache
+from news.tasks import update_user
+
+
+class PayloadTestCase(TestCase):
+    def setUp(self):
+        self.addCleanup(clear_newsletter_cache)
+        self.ids = {}
+        for slug in ('slug', 'other', 'third'):
+            self.ids[slug] = Newsletter.objects.create(slug=slug, vendor_id=slug.upper(),
+                                                       languages='en').id
+
+
+class NewslettersTest(PayloadTestCase):
+    def test_string(self):
+        packed = payloads.pack_newsletters('third, slug,some-group')
+        self.assertEqual(int(packed['b'], 16),
+                         (1 << self.ids['slug']) | (1 << self.ids['third']))
+        self.assertEqual(packed['x'], ['some-group'])
+        self.assertEqual(payloads.unpack_newsletters(packed), 'slug,third,some-group')
+
+    def test_list(self):
+        packed = payloads.pack_newsletters(['other'])
+        self.assertEqual(payloads.unpack_newsletters(packed), ['other'])
+
+    def test_newsletter_added(self):
+        """Messages queued before the registry changed still unpack."""
+        packed = payloads.pack_newsletters(['other'])
+        Newsletter.objects.create(slug='new', vendor_id='NEW', languages='en')
+        self.assertEqual(payloads.unpack_newsletters(packed), ['other'])
+
+
+class EnvelopeTest(PayloadTestCase):
+    def test_update_user(self):
+        data = {'newsletters': 'slug,other', 'lang': 'en', 'email': 'dude@example.com',
+                'api-key': 'abides'}
+        args = payloads.pack_args('news.tasks.update_user',
+                                  (data, 'dude@example.com', None, 'SUBSCRIBE', True))
+        self.assertEqual(sorted(args[0]), [payloads.PACKED, 'lang', 'newsletters'])
+        self.assertEqual(args[1:], ['dude@example.com', None, 'SUBSCRIBE', True])
+        # packing again changes nothing
+        self.assertEqual(payloads.pack_args('news.tasks.update_user', args), args)
+
+        args = payloads.unpack_args('news.tasks.update_user', args)
+        self.assertEqual(args[0], {'newsletters': 'slug,other', 'lang': 'en'})
+
+    def test_confirm_user_no_data(self):
+        args = payloads.pack_args('news.tasks.confirm_user', ('abides', None))
+        self.assertEqual(args, ['abides', None])
+
+    def test_no_envelope(self):
+        args = ({'a': 1},)
+        self.assertIs(payloads.pack_args('news.tasks.send_message', args), args)
+
+    @patch('news.tasks.process_user_update')
+    @patch('news.tasks.get_user_data')
+    def test_task(self, get_user_data_mock, process_mock):
+        """The task gets its arguments back as they were, less the extras."""
+        update_user.delay({'newsletters': 'other,slug', 'format': 'T', 'extra': 'x'},
+                          'dude@example.com', 'abides', 'SUBSCRIBE', True)
+        data = process_mock.call_args[0][0]
+        self.assertEqual(data, {'newsletters': 'slug,other', 'format': 'T'})
+
+
+@patch('news.payloads.statsd')
+class SerializerTest(TestCase):
+    def test_round_trip(self, statsd_mock):
+        body = {'task': 'news.tasks.update_user', 'args': [{'lang': u'd\xe9'}],
+                'kwargs': {}}
+        content_type, encoding, data = dumps(body, 'zjson')
+        self.assertEqual(loads(data, content_type, encoding), body)
+        self.assertEqual(data[:1], payloads.JSON_PREFIX)
+        statsd_mock.timing.assert_any_call('news.tasks.update_user.payload_bytes',
+                                           len(data))
+
+    def test_compressed(self, statsd_mock):
+        body = {'task': 'news.tasks.update_user', 'args': ['dude@example.com'] * 50}
+        content_type, encoding, data = dumps(body, 'zjson')
+        self.assertEqual(data[:1], payloads.ZLIB_PREFIX)
+        self.assertTrue(len(data) < len(json.dumps(body)) / 4)
+        self.assertEqual(loads(data, content_type, encoding), body)
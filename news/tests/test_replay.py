@@ -0,0 +1,163 @@
+from datetime import datetime, timedelta
+from StringIO import StringIO
+
+from django.contrib.admin.sites import AdminSite
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.timezone import now
+
+from mock import ANY, call, patch
+
+from news.admin import FailedTaskAdmin
+from news.models import FailedTask
+from news.replay import batch_delay, failed_tasks, replay_batch
+from news.tasks import replay_failed_tasks
+
+
+@patch('news.replay.subtask')
+class ReplayBatchTest(TestCase):
+    def setUp(self):
+        self.addCleanup(cache.clear)
+
+    def add_failure(self, name='news.tasks.update_user', args=None, **kwargs):
+        return FailedTask.objects.create(task_id=str(FailedTask.objects.count()),
+                                         name=name, args=args or [], **kwargs)
+
+    def test_oldest_first(self, subtask_mock):
+        self.add_failure(args=['first'])
+        self.add_failure(args=['second'])
+        self.add_failure(args=['third'])
+
+        queued, skipped, last_id = replay_batch(failed_tasks(), batch_size=2)
+        self.assertEqual((queued, skipped), (2, 0))
+        subtask_mock.assert_has_calls([
+            call('news.tasks.update_user', args=['first'], kwargs={}),
+            call().apply_async(),
+            call('news.tasks.update_user', args=['second'], kwargs={}),
+            call().apply_async(),
+        ])
+        remaining = FailedTask.objects.get()
+        self.assertEqual(remaining.args, ['third'])
+        self.assertTrue(last_id < remaining.id)
+
+    def test_collapse_duplicates(self, subtask_mock):
+        """The same call that failed more than once is only queued once."""
+        self.add_failure(args=[{'newsletters': 'a', 'email': 'dude@example.com'}])
+        self.add_failure(args=[{'email': 'dude@example.com', 'newsletters': 'a'}])
+        self.add_failure(args=[{'email': 'walter@example.com', 'newsletters': 'a'}])
+
+        self.assertEqual(replay_batch(failed_tasks(), 2, 'run')[:2], (1, 1))
+        self.assertEqual(replay_batch(failed_tasks(), 2, 'run')[:2], (1, 0))
+        self.assertEqual(replay_batch(failed_tasks(), 2, 'run')[:2], (0, 0))
+        self.assertEqual(subtask_mock.call_count, 2)
+        self.assertFalse(FailedTask.objects.exists())
+
+    def test_collapse_by_subscriber(self, subtask_mock):
+        """Repeats are matched by task and subscriber, across batches, and
+        only skipped if nothing else was queued for them in between."""
+        data = {'newsletters': 'a', 'email': 'dude@example.com'}
+        a = [data, 'dude@example.com', None, 'SET', False]
+        b = [dict(data, newsletters='b'), 'Dude@Example.com', None, 'SET', False]
+        self.add_failure(args=a)
+        self.add_failure(args=a)
+        self.add_failure(args=b)
+        self.add_failure(args=b)
+        self.add_failure(args=a)
+        self.add_failure(name='news.tasks.send_message',
+                         args=['msg', 'dude@example.com', None, 'H'])
+
+        while replay_batch(failed_tasks(), 2, 'run')[2] is not None:
+            pass
+        queued = [c[1]['args'] for c in subtask_mock.call_args_list if c[1]]
+        self.assertEqual(queued, [a, b, a, ['msg', 'dude@example.com', None, 'H']])
+
+        # another replay doesn't remember this one's calls
+        self.add_failure(args=a)
+        self.assertEqual(replay_batch(failed_tasks(), 2, 'other')[:2], (1, 0))
+
+    def test_filters(self, subtask_mock):
+        old = self.add_failure(when=now() - timedelta(days=2))
+        self.add_failure(name='news.tasks.send_message')
+        recent = self.add_failure()
+
+        self.assertEqual(list(failed_tasks(name='news.tasks.update_user')),
+                         [old, recent])
+        self.assertEqual(list(failed_tasks(since=now() - timedelta(days=1),
+                                           name='news.tasks.update_user')),
+                         [recent])
+        self.assertEqual(list(failed_tasks(until=now() - timedelta(days=1))),
+                         [old])
+        self.assertEqual(list(failed_tasks(start_id=old.id, ids=[old.id, recent.id])),
+                         [recent])
+
+    def test_batch_delay(self, subtask_mock):
+        self.assertEqual(batch_delay(100, 50), 2)
+        self.assertEqual(batch_delay(100, 0), 0)
+
+
+@patch('news.replay.subtask')
+class ReplayFailedTasksTest(TestCase):
+    def setUp(self):
+        for i in range(3):
+            FailedTask.objects.create(task_id=str(i), name='news.tasks.update_user',
+                                      args=[i])
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_task_queues_next_batch(self, subtask_mock):
+        with patch.object(replay_failed_tasks, 'apply_async') as apply_async:
+            with patch('news.tasks.replay_batch') as replay_batch_mock:
+                replay_batch_mock.return_value = (2, 0, 42)
+                replay_failed_tasks(name='news.tasks.update_user', rate=4,
+                                    run_id='run')
+        replay_batch_mock.assert_called_with(ANY, run_id='run')
+        apply_async.assert_called_with(
+            ('news.tasks.update_user', None, None, None, 42, 4, 'run'),
+            countdown=0.5)
+
+    def test_task_ids_done(self, subtask_mock):
+        """A replay of some ids stops at the last of them."""
+        ids = list(FailedTask.objects.order_by('id').values_list('id', flat=True))
+        with patch.object(replay_failed_tasks, 'apply_async') as apply_async:
+            replay_failed_tasks(ids=ids[:2])
+        self.assertEqual(subtask_mock.call_count, 2)
+        self.assertFalse(apply_async.called)
+
+    def test_task_replays_everything(self, subtask_mock):
+        replay_failed_tasks.delay()
+        self.assertEqual(subtask_mock.call_count, 3)
+        self.assertFalse(FailedTask.objects.exists())
+
+    @patch('news.management.commands.replay_failed_tasks.time')
+    def test_command(self, time_mock, subtask_mock):
+        FailedTask.objects.filter(task_id='2').update(
+            when=datetime(2014, 1, 1, tzinfo=now().tzinfo))
+        out = StringIO()
+        call_command('replay_failed_tasks', since='2014-06-01',
+                     batch_size=1, rate=10, stdout=out)
+        self.assertEqual(subtask_mock.call_count, 2)
+        self.assertIn('Queued 2 tasks', out.getvalue())
+        time_mock.sleep.assert_called_with(0.1)
+        self.assertEqual(list(FailedTask.objects.values_list('task_id', flat=True)),
+                         ['2'])
+
+
+class RetryTaskActionTest(TestCase):
+    @patch('news.admin.REPLAY_BATCH_SIZE', 2)
+    @patch('news.admin.replay_failed_tasks')
+    def test_batches(self, task_mock):
+        """The admin's retry queues a task for each batch of the selection."""
+        for i in range(5):
+            FailedTask.objects.create(task_id=str(i), name='news.tasks.update_user',
+                                      args=[i])
+        ids = list(FailedTask.objects.order_by('id').values_list('id', flat=True))
+        with patch('news.admin.messages'):
+            FailedTaskAdmin(FailedTask, AdminSite()).retry_task_action(
+                None, FailedTask.objects.all())
+
+        calls = task_mock.apply_async.call_args_list
+        self.assertEqual([c[1]['kwargs']['ids'] for c in calls],
+                         [ids[:2], ids[2:4], ids[4:]])
+        self.assertEqual(len(set(c[1]['kwargs']['run_id'] for c in calls)), 1)
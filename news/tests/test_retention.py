@@ -0,0 +1,94 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils.timezone import now
+
+from mock import patch
+
+from news.models import FailedTask, FailedTaskName, TaskTraceback
+from news.retention import purge_failed_tasks
+
+
+class PurgeFailedTasksTest(TestCase):
+    def add_failure(self, name, days_ago):
+        FailedTaskName.add(name)
+        return FailedTask.objects.create(task_id='%s-%d' % (name, days_ago),
+                                         name=name, args=['dude'],
+                                         when=now() - timedelta(days=days_ago))
+
+    def setUp(self):
+        self.add_failure('update_user', 40)
+        self.add_failure('update_user', 10)
+        self.add_failure('add_fxa_activity', 10)
+        self.add_failure('add_fxa_activity', 1)
+        self.add_failure('confirm_user', 400)
+
+    def remaining(self):
+        return sorted(FailedTask.objects.values_list('task_id', flat=True))
+
+    def test_retention(self):
+        count = purge_failed_tasks(batch_size=1, retention={
+            'default': 30,
+            'add_fxa_activity': 7,
+            'confirm_user': None,
+        })
+        self.assertEqual(count, 2)
+        self.assertEqual(self.remaining(), ['add_fxa_activity-1',
+                                            'confirm_user-400',
+                                            'update_user-10'])
+
+    def test_archive(self):
+        archive = StringIO()
+        purge_failed_tasks(archive, retention={'default': 30})
+        records = [json.loads(line) for line in archive.getvalue().splitlines()]
+        self.assertEqual(sorted(r['task_id'] for r in records),
+                         ['confirm_user-400', 'update_user-40'])
+        self.assertEqual(records[0]['args'], ['dude'])
+
+    def test_prune_names(self):
+        purge_failed_tasks(retention={'default': 5})
+        self.assertEqual(list(FailedTaskName.objects.values_list('name', flat=True)),
+                         ['add_fxa_activity'])
+
+    def test_prune_tracebacks(self):
+        """Tracebacks no FailedTask has are deleted, unless they were used
+        lately, e.g. by failures being saved right now."""
+        long_ago = now() - timedelta(days=1)
+        used = TaskTraceback.objects.create(hash='used', text='', last_used=long_ago)
+        FailedTask.objects.filter(task_id='add_fxa_activity-1').update(traceback=used)
+        TaskTraceback.objects.create(hash='orphan', text='', last_used=long_ago)
+        TaskTraceback.objects.create(hash='new', text='')
+
+        purge_failed_tasks(retention={'default': 30})
+        self.assertEqual(sorted(TaskTraceback.objects.values_list('hash', flat=True)),
+                         ['new', 'used'])
+
+
+class PurgeFailedTasksCommandTest(TestCase):
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+        FailedTask.objects.create(task_id='old', name='update_user',
+                                  when=now() - timedelta(days=40))
+
+    @patch('news.retention.FAILED_TASK_RETENTION', {'default': 30})
+    def test_archive(self):
+        call_command('purge_failed_tasks', archive_dir=self.archive_dir,
+                     stdout=StringIO())
+        self.assertFalse(FailedTask.objects.exists())
+        filename, = os.listdir(self.archive_dir)
+        archive = gzip.open(os.path.join(self.archive_dir, filename))
+        self.assertEqual(json.loads(archive.readline())['task_id'], 'old')
+
+    def test_no_archive_dir(self):
+        with self.assertRaises(CommandError):
+            call_command('purge_failed_tasks', archive_dir=None)
+        self.assertTrue(FailedTask.objects.exists())
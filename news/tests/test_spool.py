@@ -0,0 +1,166 @@
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.test import TestCase
+from django.utils.timezone import now
+
+from mock import call, patch
+
+from news.backends.common import CircuitOpenException, NewsletterException
+from news.models import SpooledWrite
+from news.spool import drain_spool, spool_send, spool_update
+from news.tasks import apply_updates, apply_updates_bulk, send_message
+
+
+@patch('news.tasks.ExactTarget')
+class SpoolWritesTest(TestCase):
+    def setUp(self):
+        patcher = patch('news.tasks.SPOOL_ET_WRITES', True)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def test_apply_updates(self, et_mock):
+        """Updates are spooled while the circuit breaker is open."""
+        et_mock().data_ext().add_record.side_effect = CircuitOpenException('Update', 60)
+        apply_updates(settings.EXACTTARGET_DATA, {'TOKEN': 'token', 'COUNTRY_': 'us'})
+        write = SpooledWrite.objects.get()
+        self.assertEqual(write.kind, SpooledWrite.UPDATE)
+        self.assertEqual(write.target, settings.EXACTTARGET_DATA)
+        self.assertEqual(write.key, 'token')
+        self.assertEqual(write.data, {'TOKEN': 'token', 'COUNTRY_': 'us'})
+
+    def test_send_message(self, et_mock):
+        et_mock().trigger_send.side_effect = CircuitOpenException('Create', 60)
+        send_message('welcome', 'dude@example.com', 'token', 'H')
+        write = SpooledWrite.objects.get()
+        self.assertEqual(write.kind, SpooledWrite.SEND)
+        self.assertEqual(write.target, 'welcome')
+        self.assertEqual(write.data, {'email': 'dude@example.com', 'format': 'H'})
+
+    def test_pending_updates_first(self, et_mock):
+        """While a user has updates in the spool, later ones go after them
+        rather than straight to ET, so replaying can't undo them."""
+        spool_update(settings.EXACTTARGET_DATA, {'TOKEN': 't1', 'A_FLG': 'N'})
+        apply_updates(settings.EXACTTARGET_DATA, {'TOKEN': 't1', 'A_FLG': 'Y'})
+        apply_updates(settings.EXACTTARGET_DATA, {'TOKEN': 't2', 'A_FLG': 'Y'})
+
+        et_mock().data_ext().add_record.assert_called_once_with(
+            settings.EXACTTARGET_DATA, ['TOKEN', 'A_FLG'], ['t2', 'Y'])
+        writes = SpooledWrite.objects.order_by('id')
+        self.assertEqual([w.data for w in writes], [{'TOKEN': 't1', 'A_FLG': 'N'},
+                                                    {'TOKEN': 't1', 'A_FLG': 'Y'}])
+
+    def test_pending_updates_bulk(self, et_mock):
+        spool_update(settings.EXACTTARGET_DATA, {'TOKEN': 't1'})
+        apply_updates_bulk(settings.EXACTTARGET_DATA, [{'TOKEN': 't1'}, {'TOKEN': 't2'}])
+        et_mock().data_ext().add_records.assert_called_once_with(
+            settings.EXACTTARGET_DATA, [{'TOKEN': 't2'}])
+        self.assertEqual(SpooledWrite.objects.filter(key='t1').count(), 2)
+
+    def test_send_after_pending_updates(self, et_mock):
+        """A send to a user with updates in the spool is spooled after
+        them, so it can't go out before their data is written."""
+        spool_update(settings.EXACTTARGET_DATA, {'TOKEN': 't1', 'LANG': 'de'})
+        send_message('welcome', 'dude@example.com', 't1', 'H')
+        send_message('welcome', 'walter@example.com', 't2', 'H')
+
+        et_mock().trigger_send.assert_called_once_with('welcome', {
+            'EMAIL_ADDRESS_': 'walter@example.com',
+            'TOKEN': 't2',
+            'EMAIL_FORMAT_': 'H',
+        })
+        self.assertEqual(list(SpooledWrite.objects.order_by('id')
+                              .values_list('kind', 'key')),
+                         [(SpooledWrite.UPDATE, 't1'), (SpooledWrite.SEND, 't1')])
+
+    @patch('news.tasks.SPOOL_ET_WRITES', False)
+    def test_spooling_disabled(self, et_mock):
+        et_mock().data_ext().add_record.side_effect = CircuitOpenException('Update', 60)
+        with self.assertRaises(CircuitOpenException):
+            apply_updates(settings.EXACTTARGET_DATA, {'TOKEN': 'token'})
+        self.assertFalse(SpooledWrite.objects.exists())
+
+
+@patch('news.spool.ExactTarget')
+class DrainSpoolTest(TestCase):
+    def test_coalesce_updates(self, et_mock):
+        """Updates for the same token are combined, later ones winning,
+        except in data extensions that aren't keyed by token."""
+        spool_update(settings.EXACTTARGET_DATA, {'TOKEN': 't1', 'A_FLG': 'Y', 'LANG': 'en'})
+        spool_update(settings.EXACTTARGET_DATA, {'TOKEN': 't2', 'A_FLG': 'Y'})
+        spool_update(settings.EXACTTARGET_DATA, {'TOKEN': 't1', 'B_FLG': 'Y', 'LANG': 'de'})
+        spool_update('GET_INVOLVED', {'TOKEN': 't1', 'INTEREST': 'coding'})
+        spool_update('GET_INVOLVED', {'TOKEN': 't1', 'INTEREST': 'qa'})
+
+        self.assertEqual(drain_spool(), 5)
+        add_records = et_mock().data_ext().add_records
+        # in the same order every time, by data extension
+        add_records.assert_has_calls(sorted([
+            call(settings.EXACTTARGET_DATA, [
+                {'TOKEN': 't1', 'A_FLG': 'Y', 'B_FLG': 'Y', 'LANG': 'de'},
+                {'TOKEN': 't2', 'A_FLG': 'Y'},
+            ]),
+            call('GET_INVOLVED', [
+                {'TOKEN': 't1', 'INTEREST': 'coding'},
+                {'TOKEN': 't1', 'INTEREST': 'qa'},
+            ]),
+        ], key=lambda c: c[1][0]))
+        self.assertFalse(SpooledWrite.objects.exists())
+
+    def test_updates_before_sends(self, et_mock):
+        spool_send('welcome', 'dude@example.com', 't1', 'H')
+        spool_send('welcome', 'dude@example.com', 't1', 'H')
+        spool_update(settings.EXACTTARGET_DATA, {'TOKEN': 't1'})
+
+        self.assertEqual(drain_spool(), 3)
+        names = [name for name, args, kwargs in et_mock().mock_calls]
+        self.assertTrue(names.index('data_ext().add_records') <
+                        names.index('trigger_send'))
+        et_mock().trigger_send.assert_called_once_with('welcome', {
+            'EMAIL_ADDRESS_': 'dude@example.com',
+            'TOKEN': 't1',
+            'EMAIL_FORMAT_': 'H',
+        })
+
+    def test_still_down(self, et_mock):
+        """If ET is still unavailable the writes are left for later."""
+        et_mock().data_ext().add_records.side_effect = CircuitOpenException('Update', 60)
+        spool_update(settings.EXACTTARGET_DATA, {'TOKEN': 't1'})
+        spool_send('welcome', 'dude@example.com', 't1', 'H')
+
+        self.assertEqual(drain_spool(), 0)
+        self.assertEqual(SpooledWrite.objects.count(), 2)
+        self.assertFalse(et_mock().trigger_send.called)
+
+    def test_socket_error(self, et_mock):
+        """A timeout talking to ET stops the drain rather than crashing it."""
+        et_mock().data_ext().add_records.side_effect = socket.timeout()
+        spool_update(settings.EXACTTARGET_DATA, {'TOKEN': 't1'})
+        self.assertEqual(drain_spool(), 0)
+        self.assertEqual(SpooledWrite.objects.count(), 1)
+
+    @patch('news.spool.statsd')
+    def test_age_gauge(self, statsd_mock, et_mock):
+        spool_update(settings.EXACTTARGET_DATA, {'TOKEN': 't1'})
+        SpooledWrite.objects.update(when=now() - timedelta(minutes=5))
+        drain_spool()
+        age = statsd_mock.gauge.call_args[0]
+        self.assertEqual(age[0], 'news.spool.age')
+        self.assertTrue(300 <= age[1] < 310)
+
+    def test_bad_record(self, et_mock):
+        """A record ET rejects doesn't hold up the rest."""
+        def add_records(target, records):
+            if any(record['TOKEN'] == 'bad' for record in records):
+                raise NewsletterException('Bad field')
+
+        add_records_mock = et_mock().data_ext().add_records
+        add_records_mock.side_effect = add_records
+        spool_update(settings.EXACTTARGET_DATA, {'TOKEN': 'bad'})
+        spool_update(settings.EXACTTARGET_DATA, {'TOKEN': 'good'})
+
+        self.assertEqual(drain_spool(), 2)
+        add_records_mock.assert_called_with(settings.EXACTTARGET_DATA,
+                                            [{'TOKEN': 'good'}])
+        self.assertFalse(SpooledWrite.objects.exists())
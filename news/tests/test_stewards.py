@@ -0,0 +1,181 @@
+import socket
+from datetime import timedelta
+from smtplib import SMTPDataError
+
+from django.core import mail
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from mock import patch
+
+from news import tasks
+from news.backends.fake_smtp import FakeSMTPServer
+from news.models import Interest, LocaleStewards, StewardNotification
+from news.stewards import claim_notifications, send_notifications
+
+
+class StewardTestCase(TestCase):
+    def setUp(self):
+        self.bowling = Interest.objects.create(
+            title='Bowling', interest_id='bowling',
+            default_steward_emails='walter@example.com,donny@example.com')
+        self.rugs = Interest.objects.create(
+            title='Rugs', interest_id='rugs',
+            default_steward_emails='walter@example.com')
+        LocaleStewards.objects.create(interest=self.rugs, locale='de',
+                                      emails='uli@example.com')
+
+
+class NotifyStewardsTests(StewardTestCase):
+    def test_notify_once(self):
+        """The same inquiry made again while it's waiting, e.g. by a retry
+        of the task, isn't saved twice."""
+        first = self.rugs.notify_stewards('Dude', 'dude@example.com', 'de', 'Rug')
+        again = self.rugs.notify_stewards('Dude', 'dude@example.com', 'de', 'Rug')
+        self.assertEqual(first, again)
+        self.rugs.notify_stewards('Dude', 'dude@example.com', 'de', 'Other rug')
+        self.assertEqual(StewardNotification.objects.count(), 2)
+
+    def test_notify_saves(self):
+        """Notifying stewards saves the inquiry instead of emailing it."""
+        self.rugs.notify_stewards('Dude', 'dude@example.com', 'de', 'It tied the room')
+        self.assertEqual(len(mail.outbox), 0)
+        notification = StewardNotification.objects.get()
+        self.assertEqual(notification.interest, self.rugs)
+        self.assertEqual(notification.steward_list, ['uli@example.com'])
+        self.assertEqual(notification.message, 'It tied the room')
+        self.assertIsNone(notification.claim)
+
+    def test_send(self):
+        """Each inquiry is emailed to its stewards, and then deleted."""
+        self.bowling.notify_stewards('Dude', 'dude@example.com', 'en', 'Strike')
+        self.rugs.notify_stewards('Dude', 'dude@example.com', 'de', '')
+        self.assertEqual(send_notifications(digest=False), 2)
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].subject, 'Inquiry about Bowling')
+        self.assertEqual(mail.outbox[0].to, ['walter@example.com', 'donny@example.com'])
+        self.assertIn('Comment: Strike', mail.outbox[0].body)
+        self.assertEqual(mail.outbox[1].to, ['uli@example.com'])
+        self.assertFalse(StewardNotification.objects.exists())
+        self.assertEqual(send_notifications(digest=False), 0)
+
+    def test_digest(self):
+        """In a digest, each steward gets one email of all their inquiries."""
+        self.bowling.notify_stewards('Dude', 'dude@example.com', 'en', 'Strike')
+        self.bowling.notify_stewards('Smokey', 'smokey@example.com', 'en', '')
+        self.rugs.notify_stewards('Maude', 'maude@example.com', 'en', 'Mine')
+        self.rugs.notify_stewards('Jackie', 'jackie@example.com', 'de', '')
+        self.assertEqual(send_notifications(digest=True), 4)
+
+        emails = dict((email.to[0], email) for email in mail.outbox)
+        self.assertEqual(sorted(emails), ['donny@example.com', 'uli@example.com',
+                                          'walter@example.com'])
+        walter = emails['walter@example.com']
+        self.assertEqual(walter.subject, '3 inquiries about Bowling, Rugs')
+        for email in ('dude@example.com', 'smokey@example.com', 'maude@example.com'):
+            self.assertIn('Email: ' + email, walter.body)
+        self.assertNotIn('jackie@example.com', walter.body)
+        self.assertEqual(emails['donny@example.com'].subject,
+                         '2 inquiries about Bowling')
+        # a lone inquiry is sent as it is
+        self.assertEqual(emails['uli@example.com'].subject, 'Inquiry about Rugs')
+
+    def test_batches(self):
+        for i in range(5):
+            self.bowling.notify_stewards('Dude', 'dude@example.com', 'en', str(i))
+        self.assertEqual(send_notifications(batch_size=2, digest=False), 5)
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_claimed(self):
+        """Inquiries claimed by another send are left to it, unless it died."""
+        first = self.bowling.notify_stewards('Dude', 'dude@example.com', 'en', '')
+        second = self.bowling.notify_stewards('Maude', 'maude@example.com', 'en', '')
+        StewardNotification.objects.filter(id=first.id).update(
+            claim='other', claimed=now())
+        self.assertEqual([n.id for n in claim_notifications()], [second.id])
+
+        StewardNotification.objects.filter(id=first.id).update(
+            claimed=now() - timedelta(days=1))
+        self.assertEqual([n.id for n in claim_notifications()], [first.id])
+
+
+class SMTPTests(StewardTestCase):
+    def setUp(self):
+        super(SMTPTests, self).setUp()
+        self.server = FakeSMTPServer(('127.0.0.1', 0))
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        settings = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.server.port,
+            EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='', EMAIL_USE_TLS=False)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_one_connection(self):
+        """All the batches are sent over one SMTP connection."""
+        for i in range(5):
+            self.bowling.notify_stewards('Dude', 'dude@example.com', 'en', str(i))
+        self.assertEqual(send_notifications(batch_size=2, digest=False), 5)
+
+        self.assertEqual(self.server.counts, {'connections': 1, 'messages': 5})
+        sender, recipients, data = self.server.messages[0]
+        self.assertEqual(sender, '<basket@basket.mozilla.org>')
+        self.assertEqual(recipients, ['<walter@example.com>', '<donny@example.com>'])
+        self.assertIn('Subject: Inquiry about Bowling', data)
+
+    def test_error(self):
+        """If sending fails, the batch is put back to send again."""
+        self.bowling.notify_stewards('Dude', 'dude@example.com', 'en', '')
+        self.server.error_rate = 1
+        with self.assertRaises(SMTPDataError):
+            send_notifications(digest=False)
+        notification = StewardNotification.objects.get()
+        self.assertIsNone(notification.claim)
+
+        self.server.error_rate = 0
+        self.assertEqual(send_notifications(digest=False), 1)
+        self.assertEqual(self.server.counts['messages'], 1)
+
+
+class QueueStewardNotificationsTests(TestCase):
+    def setUp(self):
+        patcher = patch.object(tasks, 'send_steward_notifications')
+        self.addCleanup(patcher.stop)
+        self.task = patcher.start()
+        patcher = patch('news.tasks.cache')
+        self.addCleanup(patcher.stop)
+        self.cache = patcher.start()
+
+    def test_immediate(self):
+        """Without a digest, a send is queued now, unless one's waiting."""
+        self.cache.add.side_effect = [True, False]
+        tasks.queue_steward_notifications()
+        tasks.queue_steward_notifications()
+        self.task.delay.assert_called_once_with()
+        self.cache.add.assert_called_with(tasks.SEND_SCHEDULED_KEY, 1,
+                                          tasks.STEWARD_SEND_TIMEOUT)
+        self.assertFalse(self.task.apply_async.called)
+
+    @patch('news.tasks.STEWARD_DIGEST_MINUTES', 15)
+    def test_digest(self):
+        """A digest is scheduled by the first inquiry since the last one."""
+        self.cache.add.side_effect = [True, False]
+        tasks.queue_steward_notifications()
+        tasks.queue_steward_notifications()
+        self.task.apply_async.assert_called_once_with(countdown=900)
+        self.cache.add.assert_called_with(tasks.SEND_SCHEDULED_KEY, 1, 900)
+        self.assertFalse(self.task.delay.called)
+
+
+class SendStewardNotificationsTests(TestCase):
+    @patch('news.tasks.send_notifications')
+    def test_retries(self, send_mock):
+        """A failed send is retried."""
+        error = socket.error()
+        send_mock.side_effect = error
+        with patch.object(tasks.send_steward_notifications, 'retry') as retry_mock:
+            tasks.send_steward_notifications()
+        retry_mock.assert_called_once_with(exc=error)
@@ -1,13 +1,16 @@
 from urllib2 import URLError
 
+from django.core.cache import cache
 from django.test import TestCase
 from django.test.utils import override_settings
 
 import celery
+from celery.exceptions import RetryTaskError
 from mock import Mock, patch
 
+from news.backends.common import CircuitOpenException
 from news.backends.exacttarget_rest import ETRestError, ExactTargetRest
-from news.models import FailedTask, Subscriber
+from news.models import FailedTask, FailedTaskName, Subscriber
 from news.newsletters import clear_sms_cache
 from news.tasks import (
     add_fxa_activity,
@@ -41,6 +44,7 @@ class FailedTaskTest(TestCase):
         self.assertEqual(kwargs, fail.kwargs)
         self.assertEqual(u"Exception('Test exception',)", fail.exc)
         self.assertIn("Exception: Test exception", fail.einfo)
+        self.assertTrue(FailedTaskName.objects.filter(name=fail.name).exists())
 
 
 class RetryTaskTest(TestCase):
@@ -91,6 +95,21 @@ class RecoveryMessageTask(TestCase):
 
         self.assertFalse(mock_send.called)
 
+    def test_circuit_open(self, mock_look_for_user, mock_send):
+        """An open breaker during the lookup defers the task."""
+        mock_look_for_user.side_effect = CircuitOpenException('Retrieve', 30)
+        task = send_recovery_message_task
+        request = Mock(retries=2, is_eager=False, called_directly=False)
+        with patch.object(type(task), 'request', request), \
+                patch.object(task, 'apply_async') as apply_mock, \
+                patch.object(task, 'retry') as retry_mock:
+            with self.assertRaises(RetryTaskError):
+                task(self.email)
+
+        apply_mock.assert_called_with((self.email,), {}, countdown=30, retries=2)
+        self.assertFalse(retry_mock.called)
+        self.assertFalse(mock_send.called)
+
     def test_email_only_in_et(self, mock_look_for_user, mock_send):
         """Email not in basket but in ET"""
         # Should create new subscriber with ET data, then trigger message
@@ -234,6 +253,106 @@ class ETTaskTests(TestCase):
 
         myfunc.retry.assert_called_with(exc=error, countdown=16 * 60)
 
+    def test_circuit_open_defers(self):
+        """
+        While the ET circuit breaker is open the task is put off until it
+        might close, without using up one of its retries.
+        """
+        error = CircuitOpenException('Update', 30)
+
+        @et_task
+        def open_circuit_func(arg):
+            raise error
+
+        request = Mock(retries=3, is_eager=False, called_directly=False)
+        open_circuit_func.apply_async = Mock()
+        open_circuit_func.retry = Mock()
+        with patch.object(type(open_circuit_func), 'request', request):
+            with self.assertRaises(RetryTaskError):
+                open_circuit_func('stuff')
+
+        open_circuit_func.apply_async.assert_called_with(('stuff',), {}, countdown=30,
+                                              retries=3)
+        self.assertFalse(open_circuit_func.retry.called)
+
+
+dedup_mock = Mock()
+
+
+@et_task
+def dedup_func(*args, **kwargs):
+    return dedup_mock(*args, **kwargs)
+
+
+@et_task
+def dedup_user_func(data, email, token=None):
+    return dedup_mock(data, email, token)
+
+
+class ETTaskDedupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        dedup_mock.reset_mock()
+        dedup_mock.side_effect = None
+        self.func = dedup_mock
+        self.task = dedup_func
+        self.request = Mock(retries=0, is_eager=False, called_directly=False)
+        for task in (dedup_func, dedup_user_func):
+            patcher = patch.object(type(task), 'request', self.request)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+
+    def test_duplicate_dropped(self):
+        """A task queued again with the same args doesn't run twice."""
+        self.task('dude@example.com', {'newsletters': 'a,b', 'lang': 'en'})
+        self.task('dude@example.com', {'lang': 'en', 'newsletters': 'a,b'})
+        self.assertEqual(self.func.call_count, 1)
+
+        self.task('walter@example.com', {'lang': 'en', 'newsletters': 'a,b'})
+        self.assertEqual(self.func.call_count, 2)
+
+    def test_later_call_for_subscriber(self):
+        """A call repeated after a different one for the same subscriber
+        isn't a duplicate: SET A, SET B, SET A leaves them with A."""
+        task = dedup_user_func
+        task({'newsletters': 'a'}, 'dude@example.com')
+        task({'newsletters': 'b'}, 'Dude@example.com')
+        task({'newsletters': 'a'}, 'dude@example.com')
+        self.assertEqual(self.func.call_count, 3)
+        task({'newsletters': 'a'}, 'dude@example.com')
+        self.assertEqual(self.func.call_count, 3)
+
+        # the same user by token
+        task({'newsletters': 'b'}, None, 'token')
+        task({'newsletters': 'a'}, None, 'token')
+        task({'newsletters': 'b'}, None, 'token')
+        self.assertEqual(self.func.call_count, 6)
+
+        # other users' calls don't count
+        task({'newsletters': 'b'}, 'walter@example.com')
+        task({'newsletters': 'b'}, None, 'token')
+        self.assertEqual(self.func.call_count, 7)
+
+    def test_retries_not_dropped(self):
+        self.task('dude@example.com')
+        self.request.retries = 1
+        self.task('dude@example.com')
+        self.assertEqual(self.func.call_count, 2)
+
+    def test_failure_forgotten(self):
+        """A task that failed isn't a duplicate if it's queued again."""
+        self.func.side_effect = [ValueError, None]
+        with self.assertRaises(ValueError):
+            self.task('dude@example.com')
+        self.task('dude@example.com')
+        self.assertEqual(self.func.call_count, 2)
+
+    @patch('news.tasks.ET_TASK_DEDUP_TIMEOUT', 0)
+    def test_disabled(self):
+        self.task('dude@example.com')
+        self.task('dude@example.com')
+        self.assertEqual(self.func.call_count, 2)
+
 
 class AddFxaActivityTests(TestCase):
     def _base_test(self, user_agent=None, fxa_id='123', first_device=True):
@@ -0,0 +1,60 @@
+import json
+
+from django.db import connection
+from django.test import TestCase
+
+from mock import ANY, call, patch
+
+from news.backends.deadline import et_call
+from news.models import Subscriber
+from news.tracing import current_trace, span, trace_task
+
+
+@patch('news.tracing.statsd')
+class TraceTaskTest(TestCase):
+    @patch('news.tracing.TASK_TRACE_SAMPLE_RATE', 1)
+    def test_spans(self, statsd_mock):
+        with trace_task('news.tasks.update_user'):
+            with et_call('Retrieve') as et_span:
+                et_span.size = 1234
+            with span('cache', 'newsletters'):
+                pass
+            Subscriber.objects.filter(email='dude@example.com').exists()
+
+        statsd_mock.timing.assert_has_calls([
+            call('news.trace.et.Retrieve', ANY),
+            call('news.trace.et.Retrieve.size', 1234),
+            call('news.trace.cache.newsletters', ANY),
+            call('news.trace.db.queries', ANY),
+            call('news.trace.db.queries.size', 1),
+        ])
+        statsd_mock.timing.assert_any_call('news.trace.news.tasks.update_user.et', ANY)
+        statsd_mock.timing.assert_any_call('news.trace.news.tasks.update_user.db', ANY)
+        self.assertIsNone(current_trace())
+        self.assertFalse(connection.use_debug_cursor)
+
+    @patch('news.tracing.TASK_TRACE_SAMPLE_RATE', 0)
+    def test_not_sampled(self, statsd_mock):
+        with trace_task('news.tasks.update_user'):
+            self.assertIsNone(current_trace())
+            with et_call('Retrieve'):
+                pass
+        self.assertFalse(statsd_mock.timing.called)
+
+    @patch('news.tracing.TASK_TRACE_SAMPLE_RATE', 1)
+    @patch('news.tracing.TASK_TRACE_LOG', True)
+    @patch('news.tracing.log')
+    def test_log(self, log_mock, statsd_mock):
+        with trace_task('news.tasks.update_user'):
+            with span('et', 'Update', 10):
+                pass
+        logged = json.loads(log_mock.info.call_args[0][0])
+        self.assertEqual(logged['task'], 'news.tasks.update_user')
+        self.assertEqual(logged['spans'], [
+            {'kind': 'et', 'name': 'Update', 'ms': ANY, 'size': 10},
+        ])
+
+    def test_span_without_trace(self, statsd_mock):
+        with span('et', 'Update') as s:
+            s.size = 10
+        self.assertFalse(statsd_mock.timing.called)
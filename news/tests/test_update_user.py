@@ -1,15 +1,18 @@
 import datetime
+from urllib2 import URLError
 
 from django.conf import settings
 from django.test import TestCase
 from django.test.client import RequestFactory
 from django.utils.unittest import skip
 
-from mock import patch, ANY
+from mock import call, patch, ANY
 
 from news import models
 from news.backends.common import NewsletterException
-from news.tasks import update_user, UU_EXEMPT_NEW, UU_ALREADY_CONFIRMED
+from news.tasks import (BasketError, BatchedUpdates, bulk_subscribe, process_user_update,
+                        update_user, UU_EXEMPT_NEW, UU_ALREADY_CONFIRMED,
+                        UU_MUST_CONFIRM_PENDING)
 from news.utils import SET, SUBSCRIBE, UNSUBSCRIBE
 
 
@@ -413,10 +416,11 @@ class UpdateUserTest(TestCase):
             languages='en-US,fr',
             vendor_id='TITLE_UNKNOWN',
         )
-        # We're going to ask to subscribe to this one again
+        # We're going to ask to subscribe to this one again, from a
+        # new country so there's still something to update
         data = {
             'lang': 'en',
-            'country': 'US',
+            'country': 'CA',
             'newsletters': 'slug',
             'format': 'H',
         }
@@ -441,7 +445,7 @@ class UpdateUserTest(TestCase):
                                           'TOKEN': ANY,
                                           'MODIFIED_DATE_': ANY,
                                           'EMAIL_PERMISSION_STATUS_': 'I',
-                                          'COUNTRY_': 'US',
+                                          'COUNTRY_': 'CA',
                                           })
 
     @patch('news.tasks.get_user_data')
@@ -463,10 +467,11 @@ class UpdateUserTest(TestCase):
             languages='en-US,fr',
             vendor_id='TITLE_UNKNOWN',
         )
-        # We're going to ask to subscribe to this one again
+        # We're going to ask to subscribe to this one again, from a
+        # new country so there's still something to update
         data = {
             'lang': 'en',
-            'country': 'US',
+            'country': 'CA',
             'newsletters': 'slug',
             'format': 'H',
         }
@@ -488,9 +493,47 @@ class UpdateUserTest(TestCase):
              'EMAIL_PERMISSION_STATUS_', 'COUNTRY_'],
             ['H', 'dude@example.com', 'en',
              ANY, ANY,
-             'I', 'US'],
+             'I', 'CA'],
         )
 
+    @patch('news.tasks.apply_updates')
+    @patch('news.tasks.send_message')
+    @patch('news.tasks.get_user_data')
+    def test_resubscribe_nothing_changed(self, get_user_data, send_message,
+                                         apply_updates):
+        """Nothing is written to ET if the update wouldn't change anything."""
+        models.Newsletter.objects.create(slug='slug', vendor_id='TITLE_UNKNOWN',
+                                         welcome='39', languages='en')
+        get_user_data.return_value = self.get_user_data
+        data = {
+            'lang': 'EN',
+            'country': 'US',
+            'newsletters': 'slug',
+            'format': 'H',
+        }
+        rc = update_user(data, self.sub.email, self.sub.token, SUBSCRIBE, True)
+        self.assertEqual(UU_ALREADY_CONFIRMED, rc)
+        self.assertFalse(apply_updates.called)
+        self.assertFalse(send_message.delay.called)
+
+    @patch('news.tasks.send_confirm_notice')
+    @patch('news.tasks.apply_updates')
+    @patch('news.tasks.get_user_data')
+    def test_pending_nothing_changed(self, get_user_data, apply_updates,
+                                     send_confirm_notice):
+        """A pending user is still reminded to confirm when nothing changed."""
+        models.Newsletter.objects.create(slug='slug', vendor_id='TITLE_UNKNOWN',
+                                         requires_double_optin=True,
+                                         languages='en')
+        self.get_user_data.update(confirmed=False, pending=True, master=False)
+        get_user_data.return_value = self.get_user_data
+        rc = update_user({'newsletters': 'slug'}, self.sub.email,
+                         self.sub.token, SUBSCRIBE, False)
+        self.assertEqual(UU_MUST_CONFIRM_PENDING, rc)
+        self.assertFalse(apply_updates.called)
+        send_confirm_notice.assert_called_with(self.sub.email, self.sub.token,
+                                               'en', 'H', [])
+
     @skip("FIXME: What should we do if we can't talk to ET")  # FIXME
     @patch('news.tasks.ExactTarget')
     @patch('news.tasks.get_user_data')
@@ -786,3 +829,173 @@ class UpdateUserTest(TestCase):
              'EMAIL_ADDRESS_': 'dude@example.com',
              'TOKEN': ANY}
         )
+
+
+@patch('news.tasks.send_message')
+@patch('news.tasks.apply_updates_bulk')
+@patch('news.tasks.get_users_data')
+class BulkSubscribeTest(TestCase):
+    def setUp(self):
+        models.Newsletter.objects.create(slug='slug', vendor_id='SLUG',
+                                         welcome='WELCOME', languages='en')
+        models.Newsletter.objects.create(slug='optin', vendor_id='OPTIN',
+                                         requires_double_optin=True,
+                                         languages='en')
+
+    def test_batched_writes(self, get_users_data, apply_updates_bulk,
+                            send_message):
+        """
+        All users are looked up in one go and each database gets one
+        write with everyone's records.
+        """
+        known = models.Subscriber.objects.create(email='known@example.com')
+        get_users_data.return_value = {
+            'known@example.com': {
+                'email': 'known@example.com',
+                'token': known.token,
+                'lang': 'en',
+                'format': 'H',
+                'newsletters': [],
+                'confirmed': True,
+                'master': True,
+                'pending': False,
+                'status': 'ok',
+            },
+            'new@example.com': None,
+            'confirm@example.com': None,
+        }
+        records = [
+            {'email': 'known@example.com', 'newsletters': 'slug'},
+            {'email': 'new@example.com', 'newsletters': 'slug', 'lang': 'en'},
+            {'email': 'confirm@example.com', 'newsletters': 'optin'},
+        ]
+        bulk_subscribe(records, False)
+
+        get_users_data.assert_called_once_with(
+            emails=['known@example.com', 'new@example.com',
+                    'confirm@example.com'])
+        new = models.Subscriber.objects.get(email='new@example.com')
+        confirm = models.Subscriber.objects.get(email='confirm@example.com')
+
+        self.assertEqual(2, apply_updates_bulk.call_count)
+        writes = dict(c[0] for c in apply_updates_bulk.call_args_list)
+        master = writes[settings.EXACTTARGET_DATA]
+        self.assertEqual([known.token, new.token],
+                         [record['TOKEN'] for record in master])
+        self.assertTrue(all(record['SLUG_FLG'] == 'Y' for record in master))
+        optin = writes[settings.EXACTTARGET_OPTIN_STAGE]
+        self.assertEqual([confirm.token], [record['TOKEN'] for record in optin])
+
+        sent = sorted(c[0][:2] for c in send_message.delay.call_args_list)
+        self.assertEqual([
+            ('en_WELCOME', 'known@example.com'),
+            ('en_WELCOME', 'new@example.com'),
+            ('en_confirmation_email', 'confirm@example.com'),
+        ], sent)
+
+    def test_token_from_et(self, get_users_data, apply_updates_bulk,
+                           send_message):
+        """A user found in ET gets their ET token in basket too."""
+        models.Subscriber.objects.create(email='dude@example.com',
+                                         token='basket-token')
+        get_users_data.return_value = {
+            'dude@example.com': {
+                'email': 'dude@example.com',
+                'token': 'et-token',
+                'lang': 'en',
+                'newsletters': ['slug'],
+                'confirmed': True,
+                'master': True,
+                'pending': False,
+                'status': 'ok',
+            },
+        }
+        bulk_subscribe([{'email': 'dude@example.com', 'newsletters': 'slug',
+                         'country': 'us'}],
+                       False)
+
+        sub = models.Subscriber.objects.get(email='dude@example.com')
+        self.assertEqual('et-token', sub.token)
+        record = apply_updates_bulk.call_args[0][1][0]
+        self.assertEqual('et-token', record['TOKEN'])
+        # already subscribed, so no welcome
+        self.assertFalse(send_message.delay.called)
+
+    @patch('news.tasks.update_user')
+    @patch('news.tasks.apply_updates')
+    def test_bad_record_isolated(self, apply_updates, update_user,
+                                 get_users_data, apply_updates_bulk,
+                                 send_message):
+        """
+        A record ET rejects, or whose follow-up action fails, is retried
+        on its own, and the rest of the batch still goes through.
+        """
+        get_users_data.return_value = {}
+        apply_updates_bulk.side_effect = NewsletterException('Bad record')
+
+        def apply(target_et, record):
+            if record['EMAIL_ADDRESS_'] == 'bad@example.com':
+                raise NewsletterException('Bad record')
+
+        apply_updates.side_effect = apply
+        records = [
+            {'email': 'bad@example.com', 'newsletters': 'slug'},
+            {'email': 'good@example.com', 'newsletters': 'slug'},
+            {'email': 'confirm@example.com', 'newsletters': 'optin'},
+        ]
+        with patch('news.tasks.send_confirm_notice') as confirm_mock:
+            confirm_mock.side_effect = BasketError('Oops')
+            bulk_subscribe(records, False)
+
+        self.assertEqual(3, apply_updates.call_count)
+        sent = [c[0][:2] for c in send_message.delay.call_args_list]
+        self.assertEqual([('en_WELCOME', 'good@example.com')], sent)
+        self.assertEqual([
+            call(records[0], 'bad@example.com', None, SUBSCRIBE, False),
+            call(records[2], 'confirm@example.com', None, SUBSCRIBE, False),
+        ], update_user.delay.call_args_list)
+
+    @patch('news.tasks.update_user')
+    def test_bad_record_processing_isolated(self, update_user, get_users_data,
+                                            apply_updates_bulk, send_message):
+        """
+        A record that can't be processed, e.g. for a bad newsletter, is
+        retried on its own, and the rest are still written.
+        """
+        get_users_data.return_value = {}
+        records = [
+            {'email': 'good@example.com', 'newsletters': 'slug'},
+            {'email': 'bad@example.com', 'newsletters': 'slug'},
+            {'email': 'other@example.com', 'newsletters': 'slug'},
+        ]
+        real_process = process_user_update
+
+        def process(data, email, *args):
+            real_process(data, email, *args)
+            if email == 'bad@example.com':
+                raise BasketError('Oops')
+
+        with patch('news.tasks.process_user_update') as process_mock:
+            process_mock.side_effect = process
+            bulk_subscribe(records, False)
+
+        written = set(r['EMAIL_ADDRESS_'] for c in apply_updates_bulk.call_args_list
+                      for r in c[0][1])
+        self.assertEqual(set(['good@example.com', 'other@example.com']), written)
+        sent = [c[0][1] for c in send_message.delay.call_args_list]
+        self.assertEqual(['good@example.com', 'other@example.com'], sent)
+        update_user.delay.assert_called_once_with(
+            records[1], 'bad@example.com', None, SUBSCRIBE, False)
+
+    @patch('news.tasks.apply_updates')
+    def test_batch_error_raised(self, apply_updates, get_users_data,
+                                apply_updates_bulk, send_message):
+        """A timeout writing a batch is raised for all of it to be retried,
+        rather than writing it a record at a time."""
+        apply_updates_bulk.side_effect = URLError('timed out')
+        updates = BatchedUpdates()
+        updates.start(0)
+        updates.apply(settings.EXACTTARGET_DATA, {'EMAIL_ADDRESS_': 'dude@example.com'})
+        with self.assertRaises(URLError):
+            updates.flush()
+        self.assertFalse(apply_updates.called)
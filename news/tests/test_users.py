@@ -14,7 +14,8 @@ from basket import errors
 from news import models, tasks, views
 from news.backends.common import NewsletterException
 from news.models import Newsletter, APIUser
-from news.utils import look_for_user, get_user_data, SET
+from news.utils import (look_for_user, get_user_data, get_users_data,
+                        MSG_USER_NOT_FOUND, SET)
 
 
 class UpdateFxAInfoTest(TestCase):
@@ -149,6 +150,24 @@ class UpdateFxAInfoTest(TestCase):
         self.send_message.delay.assert_called_with('de_{0}_T'.format(tasks.FXACCOUNT_WELCOME),
                                                    email, sub.token, 'T')
 
+    def test_existing_user_nothing_changed(self):
+        """Nothing is written or sent if ET already has the fxa_id."""
+        email = 'dude@example.com'
+        fxa_id = 'the fxa abides'
+        old_sub = models.Subscriber.objects.create(email=email)
+        self.get_external_user_data.return_value = {
+            'email': email,
+            'token': old_sub.token,
+            'lang': 'de',
+            'format': 'T',
+            'fxa_id': fxa_id,
+            'fxa_lang': 'de',
+        }
+        tasks.update_fxa_info(email, 'de', fxa_id)
+        sub = models.Subscriber.objects.get(email=email)
+        self.assertEqual(sub.fxa_id, fxa_id)
+        self.assertFalse(self.apply_updates.called)
+        self.assertFalse(self.send_message.delay.called)
 
 @override_settings(EXACTTARGET_DATA='DATA_FOR_DUDE',
                    EXACTTARGET_INTERESTS='DUDE_IS_INTERESTED')
@@ -259,6 +278,29 @@ class UpdateGetInvolvedTests(TestCase):
         self.interest.notify_stewards.assert_called_with('Walter', email, 'en',
                                                          'It really tied the room together.')
 
+    def test_existing_user_nothing_changed(self):
+        """The master record isn't written if ET already has it all."""
+        email = 'walter@example.com'
+        sub = models.Subscriber.objects.create(email=email)
+        token = sub.token
+        self.get_user_data.return_value = {
+            'status': 'ok',
+            'format': 'T',
+            'country': 'us',
+            'lang': 'en',
+            'token': token,
+            'newsletters': ['about-mozilla', 'get-involved'],
+        }
+        tasks.update_get_involved('bowling', 'en', 'Walter', email,
+                                  'US', 'T', 'Y', 'It really tied the room together.', None)
+        self.apply_updates.assert_called_once_with(settings.EXACTTARGET_INTERESTS, {
+            'TOKEN': token,
+            'INTEREST': 'bowling',
+        })
+        self.send_message.delay.assert_called_with('en_welcome_bowling_T', email, token, 'T')
+        self.interest.notify_stewards.assert_called_with('Walter', email, 'en',
+                                                         'It really tied the room together.')
+
     def test_existing_user_interested_no_newsletter(self):
         """
         Successful submission of the form for existing newsletter user not
@@ -722,3 +764,189 @@ class TestLookupUser(TestCase):
         }
         rsp = self.ssl_get(params)
         self.assertEqual(404, rsp.status_code, rsp.content)
+
+
+class TestLookupUsers(TestCase):
+    """test for API lookup-users"""
+
+    def setUp(self):
+        self.auth = APIUser.objects.create(name="test")
+        self.url = reverse('lookup_users')
+
+    def ssl_post(self, data, api_key=True, path='', **extra):
+        extra['wsgi.url_scheme'] = 'https'
+        if api_key:
+            extra['HTTP_X_API_KEY'] = self.auth.api_key
+        return self.client.post(self.url + path, json.dumps(data),
+                                content_type='application/json', **extra)
+
+    def test_not_ssl(self):
+        """Without SSL, immediate 401"""
+        rsp = self.client.post(self.url, json.dumps({'tokens': ['dummy']}),
+                               content_type='application/json',
+                               HTTP_X_API_KEY=self.auth.api_key)
+        self.assertEqual(401, rsp.status_code, rsp.content)
+
+    def test_requires_api_key(self):
+        """Even looking up by token requires an API key"""
+        rsp = self.ssl_post({'tokens': ['dummy']}, api_key=False)
+        self.assertEqual(401, rsp.status_code, rsp.content)
+
+    def test_tokens_or_emails(self):
+        """Passing both or neither is a 400 error"""
+        rsp = self.ssl_post({'tokens': ['dummy'], 'emails': ['a@example.com']})
+        self.assertEqual(400, rsp.status_code, rsp.content)
+        rsp = self.ssl_post({})
+        self.assertEqual(400, rsp.status_code, rsp.content)
+        rsp = self.ssl_post({'tokens': 'dummy'})
+        self.assertEqual(400, rsp.status_code, rsp.content)
+
+    @patch('news.views.LOOKUP_USERS_MAX_RECORDS', 2)
+    def test_too_many(self):
+        rsp = self.ssl_post({'tokens': ['a', 'b', 'c']})
+        self.assertEqual(400, rsp.status_code, rsp.content)
+
+    @patch('news.views.LOOKUP_USERS_BATCH_SIZE', 2)
+    @patch('news.views.get_users_data')
+    def test_json(self, get_users_data):
+        """Users come back in order, one per email sent, looked up in
+        batches, once each."""
+        def users_data(emails):
+            return dict((email, {'status': 'ok', 'email': email})
+                        for email in emails if email != 'nope@example.com')
+
+        get_users_data.side_effect = users_data
+        rsp = self.ssl_post({'emails': ['a@example.com', 'nope@example.com',
+                                        'A@example.com', 'b@example.com']})
+        self.assertEqual(200, rsp.status_code, rsp.content)
+        self.assertEqual(json.loads(rsp.content), {
+            'status': 'ok',
+            'users': [
+                {'status': 'ok', 'email': 'a@example.com'},
+                {'status': 'error', 'desc': MSG_USER_NOT_FOUND,
+                 'code': errors.BASKET_UNKNOWN_EMAIL,
+                 'email': 'nope@example.com'},
+                {'status': 'ok', 'email': 'a@example.com'},
+                {'status': 'ok', 'email': 'b@example.com'},
+            ],
+        })
+        get_users_data.assert_has_calls([
+            call(emails=['a@example.com', 'nope@example.com']),
+            call(emails=['b@example.com']),
+        ])
+
+    @patch('news.views.get_users_data')
+    def test_json_et_failure(self, get_users_data):
+        get_users_data.side_effect = NewsletterException(
+            'Stuff', error_code=errors.BASKET_NETWORK_FAILURE, status_code=400)
+        rsp = self.ssl_post({'tokens': ['dummy']})
+        self.assertEqual(400, rsp.status_code, rsp.content)
+        self.assertEqual(json.loads(rsp.content)['code'],
+                         errors.BASKET_NETWORK_FAILURE)
+
+    @patch('news.views.LOOKUP_USERS_BATCH_SIZE', 1)
+    @patch('news.views.get_users_data')
+    def test_ndjson(self, get_users_data):
+        """With format=ndjson each user is a line, and an ET failure
+        ends the stream with an error line."""
+        get_users_data.side_effect = [
+            {'t1': {'status': 'ok', 'token': 't1'}},
+            {'t2': None},
+            NewsletterException('Stuff',
+                                error_code=errors.BASKET_NETWORK_FAILURE),
+        ]
+        rsp = self.ssl_post({'tokens': ['t1', 't2', 't3']},
+                            path='?format=ndjson')
+        self.assertEqual(200, rsp.status_code)
+        self.assertEqual(rsp['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in
+                 ''.join(rsp.streaming_content).splitlines()]
+        self.assertEqual(lines, [
+            {'status': 'ok', 'token': 't1'},
+            {'status': 'error', 'desc': MSG_USER_NOT_FOUND,
+             'code': errors.BASKET_UNKNOWN_TOKEN, 'token': 't2'},
+            {'status': 'error', 'desc': 'Stuff',
+             'code': errors.BASKET_NETWORK_FAILURE},
+        ])
+
+
+class TestGetUsersData(TestCase):
+    def setUp(self):
+        Newsletter.objects.create(slug='n1', vendor_id='NEWSLETTER1')
+        patcher = patch('news.utils.ExactTargetDataExt')
+        self.addCleanup(patcher.stop)
+        self.data_ext = patcher.start()()
+
+    def et_record(self, email, token, **extra):
+        record = {
+            'EMAIL_ADDRESS_': email,
+            'EMAIL_FORMAT_': 'H',
+            'COUNTRY_': 'us',
+            'LANGUAGE_ISO2': 'en',
+            'TOKEN': token,
+            'CREATED_DATE_': 'Yesterday',
+        }
+        record.update(extra)
+        return record
+
+    def test_batched_lookup(self):
+        """
+        Users are looked up with one call per database, and each one's
+        state matches what get_user_data would have said.
+        """
+        def get_records(database, values, fields, field):
+            if database == settings.EXACTTARGET_DATA:
+                return [self.et_record('Master@example.com', 'master-token',
+                                       NEWSLETTER1_FLG='Y')]
+            elif database == settings.EXACTTARGET_OPTIN_STAGE:
+                return [self.et_record('pending@example.com', 'pending-token'),
+                        self.et_record('confirmed@example.com', 'confirmed-token')]
+            else:
+                return [{'TOKEN': 'confirmed-token'}]
+
+        self.data_ext.get_records.side_effect = get_records
+        emails = ['master@example.com', 'pending@example.com',
+                  'confirmed@example.com', 'unknown@example.com']
+        result = get_users_data(emails=emails)
+
+        self.assertEqual(3, self.data_ext.get_records.call_count)
+        optin_call = self.data_ext.get_records.call_args_list[1]
+        self.assertEqual(settings.EXACTTARGET_OPTIN_STAGE, optin_call[0][0])
+        self.assertEqual(set(emails[1:]), set(optin_call[0][1]))
+        confirm_call = self.data_ext.get_records.call_args_list[2]
+        self.assertEqual(settings.EXACTTARGET_CONFIRMATION, confirm_call[0][0])
+        self.assertEqual(set(['pending-token', 'confirmed-token']),
+                         set(confirm_call[0][1]))
+
+        self.assertEqual(set(emails), set(result))
+        master = result['master@example.com']
+        self.assertEqual(['n1'], master['newsletters'])
+        self.assertTrue(master['master'])
+        self.assertTrue(master['confirmed'])
+        self.assertFalse(master['pending'])
+        pending = result['pending@example.com']
+        self.assertFalse(pending['master'])
+        self.assertFalse(pending['confirmed'])
+        self.assertTrue(pending['pending'])
+        confirmed = result['confirmed@example.com']
+        self.assertFalse(confirmed['master'])
+        self.assertTrue(confirmed['confirmed'])
+        self.assertFalse(confirmed['pending'])
+        self.assertIsNone(result['unknown@example.com'])
+
+    def test_all_in_master(self):
+        """If everyone is in master, the other databases aren't checked."""
+        self.data_ext.get_records.return_value = [
+            self.et_record('dude@example.com', 'dude-token')]
+        result = get_users_data(tokens=['dude-token'])
+        self.data_ext.get_records.assert_called_once_with(
+            settings.EXACTTARGET_DATA, ['dude-token'], ANY, 'TOKEN')
+        self.assertEqual('dude@example.com', result['dude-token']['email'])
+
+    def test_et_error(self):
+        self.data_ext.get_records.side_effect = NewsletterException('boom')
+        with self.assertRaises(NewsletterException) as exc_manager:
+            get_users_data(emails=['dude@example.com'])
+
+        self.assertEqual(exc_manager.exception.error_code,
+                         errors.BASKET_NETWORK_FAILURE)
@@ -585,6 +585,145 @@ class SubscribeTests(ViewsPatcherMixin, TestCase):
                                                      optin=True, sync=True)
 
 
+@patch('news.views.bulk_subscribe')
+class SubscribeBulkTests(TestCase):
+    def setUp(self):
+        self.auth = APIUser.objects.create(name='test')
+        models.Newsletter.objects.create(slug='slug', vendor_id='SLUG',
+                                         languages='en,de')
+        models.Newsletter.objects.create(slug='other', vendor_id='OTHER',
+                                         languages='en')
+
+    def tearDown(self):
+        email_block_list_cache.clear()
+
+    def _post(self, data, secure=True, api_key=True):
+        extra = {}
+        if secure:
+            extra['wsgi.url_scheme'] = 'https'
+        if api_key:
+            extra['HTTP_X_API_KEY'] = self.auth.api_key
+        return self.client.post('/news/subscribe-bulk/', json.dumps(data),
+                                content_type='application/json', **extra)
+
+    def test_requires_ssl(self, bulk_mock):
+        resp = self._post([{'email': 'dude@example.com'}], secure=False)
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(json.loads(resp.content)['code'],
+                         errors.BASKET_SSL_REQUIRED)
+        self.assertFalse(bulk_mock.delay.called)
+
+    def test_requires_api_key(self, bulk_mock):
+        resp = self._post([{'email': 'dude@example.com'}], api_key=False)
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(json.loads(resp.content)['code'],
+                         errors.BASKET_AUTH_ERROR)
+        self.assertFalse(bulk_mock.delay.called)
+
+    def test_requires_list(self, bulk_mock):
+        resp = self._post({'subscribers': 'dude@example.com'})
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(json.loads(resp.content)['code'],
+                         errors.BASKET_USAGE_ERROR)
+        self.assertFalse(bulk_mock.delay.called)
+
+    def test_non_string_values(self, bulk_mock):
+        """Values that must be strings but aren't are usage errors."""
+        for data in ({'optin': True, 'subscribers': [{'email': 'dude@example.com',
+                                                      'newsletters': 'slug'}]},
+                     [{'email': 42, 'newsletters': 'slug'}],
+                     [{'email': 'dude@example.com', 'newsletters': ['slug', 7]}],
+                     [{'email': 'dude@example.com', 'newsletters': {'slug': 1}}],
+                     [{'email': 'dude@example.com', 'newsletters': 'slug',
+                       'lang': ['en']}]):
+            resp = self._post(data)
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(json.loads(resp.content)['code'],
+                             errors.BASKET_USAGE_ERROR)
+        self.assertFalse(bulk_mock.delay.called)
+
+    @patch('news.views.BULK_SUBSCRIBE_MAX_RECORDS', 2)
+    def test_too_many_records(self, bulk_mock):
+        resp = self._post([{'email': 'dude%d@example.com' % i,
+                            'newsletters': 'slug'} for i in range(3)])
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(bulk_mock.delay.called)
+
+    @patch('news.views.get_email_block_list')
+    def test_per_record_status(self, block_list_mock, bulk_mock):
+        """Every record gets a status, and only good ones are queued."""
+        block_list_mock.return_value = ['blocked.com']
+        resp = self._post({'optin': 'Y', 'subscribers': [
+            {'email': 'dude@example.com', 'newsletters': 'slug',
+             'format': 'T', 'lang': 'de'},
+            {'email': 'not an email', 'newsletters': 'slug'},
+            {'email': 'walter@example.com', 'newsletters': 'slug,nope'},
+            {'email': 'donny@example.com', 'newsletters': 'slug', 'lang': 'xx-xx-xx'},
+            {'email': 'bunny@blocked.com', 'newsletters': 'slug'},
+            {'newsletters': 'slug'},
+            {'email': 'maude@example.com', 'newsletters': ['other'],
+             'accept_lang': 'en-US,en;q=0.8'},
+        ]})
+        self.assertEqual(resp.status_code, 200)
+        results = json.loads(resp.content)['results']
+        self.assertEqual(7, len(results))
+        self.assertEqual(['ok', 'error', 'error', 'error', 'ok', 'error', 'ok'],
+                         [r['status'] for r in results])
+        self.assertEqual(errors.BASKET_INVALID_EMAIL, results[1]['code'])
+        self.assertEqual(errors.BASKET_INVALID_NEWSLETTER, results[2]['code'])
+        self.assertEqual(errors.BASKET_INVALID_LANGUAGE, results[3]['code'])
+        self.assertEqual(errors.BASKET_USAGE_ERROR, results[5]['code'])
+
+        bulk_mock.delay.assert_called_once_with([
+            {'email': 'dude@example.com', 'newsletters': 'slug',
+             'format': 'T', 'lang': 'de'},
+            {'email': 'maude@example.com', 'newsletters': 'other',
+             'lang': 'en'},
+        ], True)
+
+    def test_duplicates_merged(self, bulk_mock):
+        """Records for the same email are merged into one."""
+        resp = self._post([
+            {'email': 'dude@example.com', 'newsletters': 'slug'},
+            {'email': 'Dude@example.com', 'newsletters': 'other,slug'},
+        ])
+        results = json.loads(resp.content)['results']
+        self.assertEqual(['ok', 'ok'], [r['status'] for r in results])
+        self.assertTrue(results[1]['duplicate'])
+        bulk_mock.delay.assert_called_once_with([
+            {'email': 'dude@example.com', 'newsletters': 'slug,other'},
+        ], False)
+
+    @patch('news.views.EMAIL_VALIDATE_DOMAINS', True)
+    @patch('news.utils.EMAIL_VALIDATE_DOMAINS', True)
+    @patch('news.email.get_resolver')
+    def test_domains_looked_up_together(self, get_resolver_mock, bulk_mock):
+        """The email domains are looked up in one batch, and invalid ones
+        rejected."""
+        self.addCleanup(cache.clear)
+        get_resolver_mock.return_value = resolver = Mock(
+            side_effect=lambda domain: None if domain.endswith('.invalid') else 'mx')
+        resp = self._post([
+            {'email': 'dude@example.com', 'newsletters': 'slug'},
+            {'email': 'walter@example.com', 'newsletters': 'slug'},
+            {'email': 'donny@example.invalid', 'newsletters': 'slug'},
+            {'newsletters': 'slug'},
+        ])
+        results = json.loads(resp.content)['results']
+        self.assertEqual(['ok', 'ok', 'error', 'error'], [r['status'] for r in results])
+        self.assertEqual(errors.BASKET_INVALID_EMAIL, results[2]['code'])
+        self.assertEqual(get_resolver_mock.call_count, 1)
+        self.assertEqual(sorted(c[0][0] for c in resolver.call_args_list),
+                         ['example.com', 'example.invalid'])
+
+    @patch('news.views.BULK_SUBSCRIBE_BATCH_SIZE', 2)
+    def test_batches(self, bulk_mock):
+        self._post([{'email': 'dude%d@example.com' % i, 'newsletters': 'slug'}
+                    for i in range(5)])
+        self.assertEqual([2, 2, 1], [len(c[0][0]) for c in
+                                     bulk_mock.delay.call_args_list])
+
+
 class TestRateLimitingFunctions(ViewsPatcherMixin, TestCase):
     def setUp(self):
         self.rf = RequestFactory()
@@ -750,6 +889,39 @@ class TestNewslettersAPI(TestCase):
         vendor_ids = newsletter_fields()
         self.assertEqual([], vendor_ids)
 
+    def test_etag(self):
+        """A matching If-None-Match gets a 304 without touching the DB."""
+        models.Newsletter.objects.create(slug='slug', vendor_id='VEND1')
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        etag = resp['ETag']
+        self.assertTrue(etag)
+
+        with self.assertNumQueries(0):
+            resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp['ETag'], etag)
+        self.assertEqual(resp.content, '')
+
+        with self.assertNumQueries(0):
+            resp = self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('slug', json.loads(resp.content)['newsletters'])
+
+    def test_etag_changes_with_newsletters(self):
+        nl = models.Newsletter.objects.create(slug='slug', vendor_id='VEND1',
+                                              title='title')
+        resp = self.client.get(self.url)
+        etag = resp['ETag']
+
+        nl.title = 'new title'
+        nl.save()
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
+        data = json.loads(resp.content)
+        self.assertEqual(data['newsletters']['slug']['title'], 'new title')
+
 
 class RecoveryViewTest(TestCase):
     # See the task tests for more
@@ -0,0 +1,69 @@
+import logging
+
+from django.test import TestCase
+
+from mock import Mock, patch
+
+from news import warmup
+from news.backends.exacttarget import logged_in
+from news.backends.fake_et import FakeETServer
+from news.models import BlockedEmail
+from news.newsletters import clear_newsletter_cache
+from news.utils import email_block_list_cache
+
+
+@patch('news.warmup.statsd')
+class WarmUpTests(TestCase):
+    def setUp(self):
+        logged_in.cached_client = None
+        self.addCleanup(setattr, logged_in, 'cached_client', None)
+        self.addCleanup(clear_newsletter_cache)
+        self.addCleanup(email_block_list_cache.clear)
+
+    def test_warm_up(self, statsd_mock):
+        # the WSDL imports a schema, which the fake ET serves
+        server = FakeETServer(('127.0.0.1', 0))
+        server.start()
+        self.addCleanup(server.stop)
+        patcher = patch('news.backends.exacttarget.ET_FAKE_URL', server.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # suds' debug logging of the messages breaks nose's log capture
+        suds_log = logging.getLogger('suds')
+        self.addCleanup(suds_log.setLevel, suds_log.level)
+        suds_log.setLevel(logging.INFO)
+
+        BlockedEmail.objects.create(email_domain='example.com')
+        warmup.warm_up()
+        self.assertIsNotNone(logged_in.cached_client)
+        self.assertEqual(email_block_list_cache.get('email_block_list'),
+                         ['example.com'])
+        timers = [c[0][0] for c in statsd_mock.timing.call_args_list]
+        self.assertEqual(timers, ['news.warmup.et_client', 'news.warmup.newsletters',
+                                  'news.warmup.email_block_list',
+                                  'news.warmup.sms_messages',
+                                  'news.warmup.user_agents', 'news.warmup.total'])
+
+    def test_step_fails(self, statsd_mock):
+        """A step that fails is skipped, and the rest still run."""
+        broken = Mock(side_effect=ValueError)
+        working = Mock()
+        with patch('news.warmup.WARM_UP_STEPS', (('broken', broken),
+                                                 ('working', working))):
+            warmup.warm_up()
+        working.assert_called_once_with()
+        timers = [c[0][0] for c in statsd_mock.timing.call_args_list]
+        self.assertEqual(timers, ['news.warmup.working', 'news.warmup.total'])
+
+    @patch('news.warmup.close_connections')
+    @patch('news.warmup.warm_up')
+    def test_worker_init(self, warm_up_mock, close_mock, statsd_mock):
+        warm_up_mock.return_value = 0.5
+        warmup.warm_up_worker(sender=None)
+        warm_up_mock.assert_called_once_with()
+        close_mock.assert_called_once_with()
+
+        warm_up_mock.reset_mock()
+        with patch('news.warmup.WORKER_WARM_UP', False):
+            warmup.warm_up_worker(sender=None)
+        self.assertFalse(warm_up_mock.called)
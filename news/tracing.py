@@ -0,0 +1,132 @@
+"""
+Tracing of where the time goes in ET tasks.
+
+A sample of task runs, TASK_TRACE_SAMPLE_RATE of them (0 to 1), is
+traced. While a run is traced, each ET SOAP or REST call, cached data
+lookup and the run's database queries are recorded as spans, with their
+duration and, where there is one, payload size in bytes.
+
+When the run ends each span is sent to statsd as the timer
+news.trace.<kind>.<name> (and news.trace.<kind>.<name>.size), and the
+time spent in each kind of span as news.trace.<task name>.<kind>. With
+TASK_TRACE_LOG on, the whole trace is also logged to the news.tracing
+logger as a line of JSON.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+from django_statsd.clients import statsd
+
+
+log = logging.getLogger(__name__)
+
+TASK_TRACE_SAMPLE_RATE = getattr(settings, 'TASK_TRACE_SAMPLE_RATE', 0)
+TASK_TRACE_LOG = getattr(settings, 'TASK_TRACE_LOG', False)
+
+_local = threading.local()
+
+
+class Span(object):
+    def __init__(self, kind, name, size=None):
+        self.kind = kind
+        self.name = name
+        self.size = size
+        self.duration = 0.0
+
+    def as_dict(self):
+        return {
+            'kind': self.kind,
+            'name': self.name,
+            'ms': int(self.duration * 1000),
+            'size': self.size,
+        }
+
+
+class Trace(object):
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+
+
+def current_trace():
+    """Return the Trace being recorded in this thread, or None."""
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def span(kind, name, size=None):
+    """
+    Record the block as a span of the current trace. It yields the Span,
+    so its ``size`` can be set once it's known. Does nothing if the
+    current task run isn't being traced.
+    """
+    trace = current_trace()
+    if trace is None:
+        yield Span(kind, name, size)
+        return
+
+    current = Span(kind, name, size)
+    start = time.time()
+    try:
+        yield current
+    finally:
+        current.duration = time.time() - start
+        trace.spans.append(current)
+
+
+@contextmanager
+def trace_task(name):
+    """Trace the block, a run of task ``name``, if it's sampled."""
+    if (current_trace() is not None or not TASK_TRACE_SAMPLE_RATE or
+            random.random() >= TASK_TRACE_SAMPLE_RATE):
+        yield
+        return
+
+    trace = Trace(name)
+    _local.trace = trace
+    # The debug cursor keeps the queries made, with their times.
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    queries_before = len(connection.queries)
+    start = time.time()
+    try:
+        yield
+    finally:
+        duration = time.time() - start
+        _local.trace = None
+        queries = connection.queries[queries_before:]
+        connection.use_debug_cursor = use_debug_cursor
+        if not (use_debug_cursor or settings.DEBUG):
+            # nothing else is keeping them, or clearing them out
+            del connection.queries[queries_before:]
+        if queries:
+            db_span = Span('db', 'queries', len(queries))
+            db_span.duration = sum(float(q['time']) for q in queries)
+            trace.spans.append(db_span)
+        report(trace, duration)
+
+
+def report(trace, duration):
+    totals = {}
+    for s in trace.spans:
+        prefix = 'news.trace.%s.%s' % (s.kind, s.name)
+        statsd.timing(prefix, int(s.duration * 1000))
+        if s.size is not None:
+            statsd.timing(prefix + '.size', s.size)
+        totals[s.kind] = totals.get(s.kind, 0) + s.duration
+    for kind, total in totals.items():
+        statsd.timing('news.trace.%s.%s' % (trace.name, kind), int(total * 1000))
+
+    if TASK_TRACE_LOG:
+        log.info(json.dumps({
+            'task': trace.name,
+            'ms': int(duration * 1000),
+            'spans': [s.as_dict() for s in trace.spans],
+        }))
@@ -3,8 +3,8 @@ from django.conf.urls import patterns, url
 from .views import (confirm, custom_unsub_reason, custom_update_phonebook,
                     custom_update_student_ambassadors, debug_user,
                     fxa_activity, fxa_register, get_involved, list_newsletters, lookup_user,
-                    newsletters, send_recovery_message, subscribe, subscribe_sms,
-                    unsubscribe, user)
+                    lookup_users, newsletters, send_recovery_message, subscribe, subscribe_bulk,
+                    subscribe_sms, unsubscribe, user)
 
 
 urlpatterns = patterns('',  # noqa
@@ -12,12 +12,14 @@ urlpatterns = patterns('',  # noqa
     url('^fxa-register/$', fxa_register),
     url('^fxa-activity/$', fxa_activity),
     url('^subscribe/$', subscribe),
+    url('^subscribe-bulk/$', subscribe_bulk),
     url('^subscribe_sms/$', subscribe_sms),
     url('^unsubscribe/(.*)/$', unsubscribe),
     url('^user/(.*)/$', user),
     url('^confirm/(.*)/$', confirm),
     url('^debug-user/$', debug_user),
     url('^lookup-user/$', lookup_user, name='lookup_user'),
+    url('^lookup-users/$', lookup_users, name='lookup_users'),
     url('^recover/$', send_recovery_message, name='send_recovery_message'),
 
     url('^custom_unsub_reason/$', custom_unsub_reason),
@@ -1,8 +1,9 @@
 import json
 import re
+import threading
 from datetime import date
 from functools import wraps
-from itertools import chain
+from itertools import chain, count
 
 from django.conf import settings
 from django.core.cache import get_cache
@@ -15,7 +16,8 @@ from django.utils.translation.trans_real import parse_accept_lang_header
 # Get error codes from basket-client so users see the same definitions
 from basket import errors
 
-from news.backends.common import NewsletterNoResultsException
+from news.backends.common import NewsletterNoResultsException, ServiceBusyException
+from news.backends.deadline import et_deadline
 from news.backends.exacttarget import (ExactTargetDataExt, NewsletterException,
                                        UnauthorizedException)
 from news.models import APIUser, BlockedEmail, Subscriber
@@ -26,6 +28,7 @@ from news.newsletters import (
     newsletter_group_newsletter_slugs,
     newsletter_languages,
     newsletter_slugs,
+    newsletters_version,
     slug_to_vendor_id,
 )
 
@@ -44,6 +47,9 @@ SET = 'SET'
 
 email_block_list_cache = get_cache('email_block_list')
 
+# Check that email domains have a mail exchanger, with news.email
+EMAIL_VALIDATE_DOMAINS = getattr(settings, 'EMAIL_VALIDATE_DOMAINS', False)
+
 
 class HttpResponseJSON(HttpResponse):
     def __init__(self, data, status=None):
@@ -166,21 +172,22 @@ def logged_in(f):
 
     @wraps(f)
     def wrapper(request, token, *args, **kwargs):
-        try:
-            subscriber, subscriber_data, created = lookup_subscriber(token=token)
-        except NewsletterException as e:
-            return newsletter_exception_response(e)
+        with et_deadline(f.__name__):
+            try:
+                subscriber, subscriber_data, created = lookup_subscriber(token=token)
+            except NewsletterException as e:
+                return newsletter_exception_response(e)
 
-        if not subscriber:
-            return HttpResponseJSON({
-                'status': 'error',
-                'desc': MSG_TOKEN_REQUIRED,
-                'code': errors.BASKET_USAGE_ERROR,
-            }, 403)
+            if not subscriber:
+                return HttpResponseJSON({
+                    'status': 'error',
+                    'desc': MSG_TOKEN_REQUIRED,
+                    'code': errors.BASKET_USAGE_ERROR,
+                }, 403)
 
-        request.subscriber_data = subscriber_data
-        request.subscriber = subscriber
-        return f(request, token, *args, **kwargs)
+            request.subscriber_data = subscriber_data
+            request.subscriber = subscriber
+            return f(request, token, *args, **kwargs)
     return wrapper
 
 
@@ -239,7 +246,7 @@ def update_user_task(request, api_call_type, data=None, optin=True, sync=False):
                 'code': errors.BASKET_INVALID_LANGUAGE,
             }, 400)
     elif 'accept_lang' in data:
-        lang = get_best_language(get_accept_languages(data['accept_lang']))
+        lang = get_best_accept_language(data['accept_lang'])
         if lang:
             data['lang'] = lang
             del data['accept_lang']
@@ -300,6 +307,12 @@ def look_for_user(database, email, token, fields):
         return None
     if database == settings.EXACTTARGET_CONFIRMATION:
         return True
+    return user_data_from_record(user)
+
+
+def user_data_from_record(user):
+    """Convert a record from one of the ET subscriber databases into
+    our user data dictionary (see get_user_data)."""
     newsletters = []
     for slug in newsletter_slugs():
         vendor_id = slug_to_vendor_id(slug)
@@ -319,6 +332,33 @@ def look_for_user(database, email, token, fields):
     return user_data
 
 
+def look_for_users(database, values, fields, field):
+    """Batch version of look_for_user.
+
+    Fetch every user in the specified ET database whose ``field`` (e.g.
+    'EMAIL_ADDRESS_' or 'TOKEN') is one of ``values``, with a single
+    Retrieve. Returns a dictionary keyed by the value of ``field``
+    (lower-cased for email addresses). If the database is the
+    'Confirmed' database the values are just True, otherwise they are
+    user data dictionaries (see get_user_data).
+    """
+    ext = ExactTargetDataExt(settings.EXACTTARGET_USER,
+                             settings.EXACTTARGET_PASS)
+    records = ext.get_records(database, values, fields, field)
+    found = {}
+    for user in records:
+        key = user.get(field)
+        if key is None:
+            continue
+        if field == 'EMAIL_ADDRESS_':
+            key = key.lower()
+        if database == settings.EXACTTARGET_CONFIRMATION:
+            found[key] = True
+        else:
+            found[key] = user_data_from_record(user)
+    return found
+
+
 def get_user_data(token=None, email=None, sync_data=False):
     """Return a dictionary of the user's data from Exact Target.
     Look them up by their email if given, otherwise by the token.
@@ -419,6 +459,9 @@ def get_user_data(token=None, email=None, sync_data=False):
         user_data['confirmed'] = confirmed
         user_data['pending'] = pending
         user_data['master'] = master
+    except ServiceBusyException:
+        # the tasks defer these rather than use up their retries
+        raise
     except NewsletterException as e:
         raise NewsletterException(str(e),
                                   error_code=errors.BASKET_NETWORK_FAILURE,
@@ -436,6 +479,76 @@ def get_user_data(token=None, email=None, sync_data=False):
     return user_data
 
 
+def get_users_data(tokens=None, emails=None):
+    """Batch version of get_user_data.
+
+    Look up many users, by email if ``emails`` is given, otherwise by
+    ``tokens``, with at most one Retrieve per ET database (master
+    subscribers, opt-in and confirmation) rather than up to three per
+    user. The confirmed/pending/master state is worked out the same way
+    get_user_data does it.
+
+    Returns a dictionary mapping each email or token passed in to the
+    user data dictionary described in get_user_data, or to None if the
+    user is not known.
+    """
+    if emails:
+        field = 'EMAIL_ADDRESS_'
+        keys = dict((email.lower(), email) for email in emails)
+    else:
+        field = 'TOKEN'
+        keys = dict((token, token) for token in tokens or [])
+
+    fields = [
+        'EMAIL_ADDRESS_',
+        'EMAIL_FORMAT_',
+        'COUNTRY_',
+        'LANGUAGE_ISO2',
+        'TOKEN',
+        'CREATED_DATE_',
+    ]
+    for nl in newsletter_fields():
+        fields.append('%s_FLG' % nl)
+
+    try:
+        found = look_for_users(settings.EXACTTARGET_DATA, keys.values(),
+                               fields, field)
+        for user_data in found.values():
+            user_data['confirmed'] = True
+            user_data['pending'] = False
+            user_data['master'] = True
+
+        missing = [keys[key] for key in keys if key not in found]
+        if missing:
+            optin = look_for_users(settings.EXACTTARGET_OPTIN_STAGE, missing,
+                                   fields, field)
+            if optin:
+                tokens = [user_data['token'] for user_data in optin.values()]
+                confirmed = look_for_users(settings.EXACTTARGET_CONFIRMATION,
+                                           tokens, ['Token'], 'TOKEN')
+                for user_data in optin.values():
+                    # See get_user_data for why someone in the optin
+                    # database might have already confirmed.
+                    is_confirmed = user_data['token'] in confirmed
+                    user_data['confirmed'] = is_confirmed
+                    user_data['pending'] = not is_confirmed
+                    user_data['master'] = False
+                found.update(optin)
+    except ServiceBusyException:
+        # the tasks defer these rather than use up their retries
+        raise
+    except NewsletterException as e:
+        raise NewsletterException(str(e),
+                                  error_code=errors.BASKET_NETWORK_FAILURE,
+                                  status_code=400)
+    except UnauthorizedException:
+        raise NewsletterException('Email service provider auth failure',
+                                  error_code=errors.BASKET_EMAIL_PROVIDER_AUTH_FAILURE,
+                                  status_code=500)
+
+    return dict((value, found.get(key)) for key, value in keys.items())
+
+
 def get_user(token=None, email=None, sync_data=False):
     try:
         user_data = get_user_data(token, email, sync_data)
@@ -453,13 +566,16 @@ def get_user(token=None, email=None, sync_data=False):
     return HttpResponseJSON(user_data, status_code)
 
 
+ACCEPT_LANG_RE = re.compile(r'^([A-Za-z]{2,3})(?:-([A-Za-z]{2})(?:-[A-Za-z0-9]+)?)?$')
+ACCEPT_LANGUAGE_CACHE_SIZE = getattr(settings, 'ACCEPT_LANGUAGE_CACHE_SIZE', 1000)
+
+
 def get_accept_languages(header_value):
     """
     Parse the user's Accept-Language HTTP header and return a list of languages
     """
     # adapted from bedrock: http://j.mp/1o3pWo5
     languages = []
-    pattern = re.compile(r'^([A-Za-z]{2,3})(?:-([A-Za-z]{2})(?:-[A-Za-z0-9]+)?)?$')
 
     # bug 1102652
     header_value = header_value.replace('_', '-')
@@ -469,8 +585,9 @@ def get_accept_languages(header_value):
     except ValueError:  # see https://code.djangoproject.com/ticket/21078
         return languages
 
+    supported_langs = None
     for lang, priority in parsed:
-        m = pattern.match(lang)
+        m = ACCEPT_LANG_RE.match(lang)
 
         if not m:
             continue
@@ -479,8 +596,11 @@ def get_accept_languages(header_value):
 
         # Check if the shorter code is supported. This covers obsolete long
         # codes like fr-FR (should match fr) or ja-JP (should match ja)
-        if m.group(2) and lang not in newsletter_languages():
-            lang += '-' + m.group(2).upper()
+        if m.group(2):
+            if supported_langs is None:
+                supported_langs = newsletter_languages()
+            if lang not in supported_langs:
+                lang += '-' + m.group(2).upper()
 
         if lang not in languages:
             languages.append(lang)
@@ -509,6 +629,66 @@ def get_best_language(languages):
     return languages[0]
 
 
+class LRUCache(object):
+    """
+    A cache of up to ``size`` items. When it's full, the least recently
+    used quarter of them are dropped.
+    """
+    def __init__(self, size):
+        self.size = size
+        # {key: [last used, value]}
+        self.items = {}
+        self.clock = count()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        try:
+            item = self.items[key]
+        except KeyError:
+            return default
+        item[0] = next(self.clock)
+        return item[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = [next(self.clock), value]
+            if len(self.items) > self.size:
+                by_use = sorted(self.items.items(), key=lambda i: i[1][0])
+                for old_key, item in by_use[:len(by_use) - self.size * 3 // 4]:
+                    del self.items[old_key]
+
+
+# (newsletters version, LRUCache) of the Accept-Language headers resolved
+# by this process. It's replaced as a whole when the version changes.
+_accept_languages = {'current': (None, None)}
+_missing = object()
+
+
+def get_best_accept_language(header_value):
+    """
+    Return the best language for our newsletters from the value of an
+    Accept-Language header, or None. That is,
+    ``get_best_language(get_accept_languages(header_value))``.
+
+    The same headers come up over and over, so the answers are kept, for
+    up to ACCEPT_LANGUAGE_CACHE_SIZE headers, until newsletters_version()
+    changes.
+    """
+    version = newsletters_version()
+    if version is None:
+        return get_best_language(get_accept_languages(header_value))
+
+    current_version, resolved = _accept_languages['current']
+    if version != current_version:
+        resolved = LRUCache(ACCEPT_LANGUAGE_CACHE_SIZE)
+        _accept_languages['current'] = (version, resolved)
+    lang = resolved.get(header_value, _missing)
+    if lang is _missing:
+        lang = get_best_language(get_accept_languages(header_value))
+        resolved.set(header_value, lang)
+    return lang
+
+
 def validate_email(email):
     """Validates that the email is valid.
 
@@ -520,15 +700,21 @@ def validate_email(email):
     @return: None if email address in the 'email' key is valid
     @raise: EmailValidationError if 'email' key is invalid
     """
-    # disabling this for now and falling back to dumb regex validation.
-    # Bug 1066762.
-    # TODO: Find a more robust solution
-    #       Possibly ET's email validation API.
+    # Full flanker validation is disabled (Bug 1066762), and we fall back
+    # to dumb regex validation, plus, with EMAIL_VALIDATE_DOMAINS, a
+    # cached check that the domain has a mail exchanger.
     try:
         dj_validate_email(force_unicode(email))
     except ValidationError:
         raise EmailValidationError('Invalid email address')
 
+    if EMAIL_VALIDATE_DOMAINS:
+        # flanker is slow to import, and not needed otherwise
+        from news.email import email_domain, get_mail_exchanger
+
+        if get_mail_exchanger(email_domain(email)) is None:
+            raise EmailValidationError('Invalid email domain')
+
     return None
 
 
@@ -1,9 +1,13 @@
 import json
 import re
+from hashlib import md5
 
 from django.conf import settings
+from django.http import (HttpResponse, HttpResponseNotModified,
+                         StreamingHttpResponse)
 from django.shortcuts import render
 from django.utils.encoding import force_unicode
+from django.utils.http import parse_etags, quote_etag
 from django.views.decorators.cache import cache_control, never_cache
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET, require_POST
@@ -14,11 +18,14 @@ from django_statsd.clients import statsd
 from ratelimit.exceptions import Ratelimited
 from ratelimit.utils import is_ratelimited
 
+from news.backends.deadline import with_et_deadline
 from news.models import Newsletter, Subscriber, Interest
-from news.newsletters import get_sms_messages, newsletter_slugs
+from news.newsletters import (get_sms_messages, newsletter_and_group_slugs,
+                              newsletter_slugs, newsletters_version)
 from news.tasks import (
     add_fxa_activity,
     add_sms_user,
+    bulk_subscribe,
     confirm_user,
     send_recovery_message_task,
     update_custom_unsub,
@@ -32,11 +39,13 @@ from news.utils import (
     UNSUBSCRIBE,
     MSG_EMAIL_OR_TOKEN_REQUIRED,
     MSG_USER_NOT_FOUND,
+    EMAIL_VALIDATE_DOMAINS,
     EmailValidationError,
     email_is_blocked,
-    get_accept_languages,
-    get_best_language,
+    get_best_accept_language,
+    get_email_block_list,
     get_user_data,
+    get_users_data,
     get_user,
     has_valid_api_key,
     HttpResponseJSON,
@@ -51,6 +60,14 @@ from news.utils import (
 IP_RATE_LIMIT_EXTERNAL = getattr(settings, 'IP_RATE_LIMIT_EXTERNAL', '40/m')
 IP_RATE_LIMIT_INTERNAL = getattr(settings, 'IP_RATE_LIMIT_INTERNAL', '400/m')
 PHONE_NUMBER_RATE_LIMIT = getattr(settings, 'PHONE_NUMBER_RATE_LIMIT', '1/h')
+# Most records accepted by one subscribe-bulk call, and how many of them
+# are handed to each bulk_subscribe task (and so each ET call).
+BULK_SUBSCRIBE_MAX_RECORDS = getattr(settings, 'BULK_SUBSCRIBE_MAX_RECORDS', 1000)
+BULK_SUBSCRIBE_BATCH_SIZE = getattr(settings, 'BULK_SUBSCRIBE_BATCH_SIZE', 100)
+# Most tokens or emails accepted by one lookup-users call, and how many of
+# them are looked up in ET at a time.
+LOOKUP_USERS_MAX_RECORDS = getattr(settings, 'LOOKUP_USERS_MAX_RECORDS', 1000)
+LOOKUP_USERS_BATCH_SIZE = getattr(settings, 'LOOKUP_USERS_BATCH_SIZE', 100)
 
 
 def ip_rate_limit_key(group, request):
@@ -162,7 +179,7 @@ def fxa_register(request):
             'code': errors.BASKET_USAGE_ERROR,
         }, 401)
 
-    lang = get_best_language(get_accept_languages(data['accept_lang']))
+    lang = get_best_accept_language(data['accept_lang'])
     if lang is None:
         return HttpResponseJSON({
             'status': 'error',
@@ -322,6 +339,197 @@ def subscribe(request):
     return update_user_task(request, SUBSCRIBE, data=data, optin=optin, sync=sync)
 
 
+@require_POST
+@csrf_exempt
+def subscribe_bulk(request):
+    """
+    Subscribe many email addresses at once.
+
+    The request body is JSON: either a list of subscriber records or a
+    dictionary with that list under 'subscribers' and optionally
+    'optin': 'Y'. Each record takes the same fields as /news/subscribe/.
+
+    Records are all validated up front, and records for the same email
+    address are merged. The valid ones are then subscribed in the
+    background in batches. The response has a status for every record,
+    in the order they were sent.
+    """
+    if not request.is_secure():
+        return HttpResponseJSON({
+            'status': 'error',
+            'desc': 'subscribe-bulk requires SSL',
+            'code': errors.BASKET_SSL_REQUIRED,
+        }, 401)
+    if not has_valid_api_key(request):
+        return HttpResponseJSON({
+            'status': 'error',
+            'desc': 'subscribe-bulk requires a valid API-key',
+            'code': errors.BASKET_AUTH_ERROR,
+        }, 401)
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return HttpResponseJSON({
+            'status': 'error',
+            'desc': 'subscribe-bulk requires a JSON request body',
+            'code': errors.BASKET_USAGE_ERROR,
+        }, 400)
+
+    optin = False
+    if isinstance(data, dict):
+        optin = data.get('optin', 'N')
+        if not isinstance(optin, basestring):
+            return HttpResponseJSON({
+                'status': 'error',
+                'desc': 'optin must be a string',
+                'code': errors.BASKET_USAGE_ERROR,
+            }, 400)
+        optin = optin.upper() == 'Y'
+        data = data.get('subscribers')
+
+    if not isinstance(data, list) or not data:
+        return HttpResponseJSON({
+            'status': 'error',
+            'desc': 'subscribe-bulk requires a list of subscribers',
+            'code': errors.BASKET_USAGE_ERROR,
+        }, 400)
+    if len(data) > BULK_SUBSCRIBE_MAX_RECORDS:
+        return HttpResponseJSON({
+            'status': 'error',
+            'desc': 'subscribe-bulk accepts at most %d subscribers per call'
+                    % BULK_SUBSCRIBE_MAX_RECORDS,
+            'code': errors.BASKET_USAGE_ERROR,
+        }, 400)
+
+    type_error = bulk_subscribers_type_error(data)
+    if type_error:
+        return HttpResponseJSON({
+            'status': 'error',
+            'desc': type_error,
+            'code': errors.BASKET_USAGE_ERROR,
+        }, 400)
+
+    results, records = validate_bulk_subscribers(data)
+    for i in range(0, len(records), BULK_SUBSCRIBE_BATCH_SIZE):
+        bulk_subscribe.delay(records[i:i + BULK_SUBSCRIBE_BATCH_SIZE], optin)
+
+    return HttpResponseJSON({
+        'status': 'ok',
+        'results': results,
+    })
+
+
+BULK_SUBSCRIBER_STRING_FIELDS = ('email', 'format', 'country', 'source_url',
+                                 'trigger_welcome', 'lang', 'accept_lang')
+
+
+def bulk_subscribers_type_error(subscribers):
+    """Return a description of the first field of the records sent to
+    subscribe_bulk that isn't a string when it must be, or None."""
+    for subscriber in subscribers:
+        if not isinstance(subscriber, dict):
+            continue
+        for field in BULK_SUBSCRIBER_STRING_FIELDS:
+            value = subscriber.get(field)
+            if value is not None and not isinstance(value, basestring):
+                return '%s must be a string' % field
+        newsletters = subscriber.get('newsletters')
+        if newsletters is not None and not isinstance(newsletters, basestring):
+            if (not isinstance(newsletters, list) or
+                    not all(isinstance(nl, basestring) for nl in newsletters)):
+                return 'newsletters must be a string or a list of strings'
+    return None
+
+
+def validate_bulk_subscribers(subscribers):
+    """Validate the records sent to subscribe_bulk.
+
+    Returns (results, records): a status dictionary for every record
+    sent, and the records that should be passed on to bulk_subscribe,
+    one per email address, with the newsletters of any other records
+    for the same address merged in.
+    """
+    all_newsletters = set(newsletter_and_group_slugs())
+    blocked_domains = tuple(get_email_block_list())
+    if EMAIL_VALIDATE_DOMAINS:
+        # look the domains up all at once, for validate_email to find
+        from news.email import email_domain, get_mail_exchangers
+
+        get_mail_exchangers(
+            email_domain(subscriber['email'].strip()) for subscriber in subscribers
+            if isinstance(subscriber, dict) and subscriber.get('email'))
+
+    def error(desc, code=errors.BASKET_USAGE_ERROR):
+        return {'status': 'error', 'desc': desc, 'code': code}
+
+    results = []
+    records = []
+    by_email = {}
+    for subscriber in subscribers:
+        if not isinstance(subscriber, dict) or not subscriber.get('email'):
+            results.append(error('email is required'))
+            continue
+
+        email = subscriber['email'].strip()
+        result = {'email': email, 'status': 'ok'}
+        results.append(result)
+
+        newsletters = subscriber.get('newsletters') or []
+        if isinstance(newsletters, basestring):
+            newsletters = newsletters.split(',')
+        newsletters = [nl.strip() for nl in newsletters if nl.strip()]
+        if not newsletters:
+            result.update(error('newsletters is missing'))
+            continue
+        if not all_newsletters.issuperset(newsletters):
+            result.update(error('invalid newsletter',
+                                errors.BASKET_INVALID_NEWSLETTER))
+            continue
+
+        try:
+            validate_email(email)
+        except EmailValidationError as e:
+            result.update(error(e.messages[0], errors.BASKET_INVALID_EMAIL))
+            continue
+
+        if blocked_domains and email.endswith(blocked_domains):
+            # don't let on there's a problem
+            continue
+
+        if email.lower() in by_email:
+            record = by_email[email.lower()]
+            merged = record['newsletters'].split(',')
+            merged.extend(nl for nl in newsletters if nl not in merged)
+            record['newsletters'] = ','.join(merged)
+            result['duplicate'] = True
+            continue
+
+        record = {'email': email, 'newsletters': ','.join(newsletters)}
+        for field in ('format', 'country', 'source_url', 'trigger_welcome'):
+            if subscriber.get(field):
+                record[field] = subscriber[field]
+
+        if subscriber.get('lang'):
+            if not language_code_is_valid(subscriber['lang']):
+                result.update(error('invalid language',
+                                    errors.BASKET_INVALID_LANGUAGE))
+                continue
+            record['lang'] = subscriber['lang']
+        elif subscriber.get('accept_lang'):
+            lang = get_best_accept_language(subscriber['accept_lang'])
+            if not lang:
+                result.update(error('invalid language',
+                                    errors.BASKET_INVALID_LANGUAGE))
+                continue
+            record['lang'] = lang
+
+        by_email[email.lower()] = record
+        records.append(record)
+
+    return results, records
+
+
 def invalid_email_response(e):
     resp_data = {
         'status': 'error',
@@ -387,6 +595,7 @@ def unsubscribe(request, token):
     return update_user_task(request, UNSUBSCRIBE, data)
 
 
+@with_et_deadline
 @logged_in
 @csrf_exempt
 @never_cache
@@ -402,6 +611,7 @@ def user(request, token):
 
 @require_POST
 @csrf_exempt
+@with_et_deadline
 def send_recovery_message(request):
     """
     Send a recovery message to an email address.
@@ -439,6 +649,7 @@ def send_recovery_message(request):
 
 
 @never_cache
+@with_et_deadline
 def debug_user(request):
     if 'email' not in request.GET or 'supertoken' not in request.GET:
         return HttpResponseJSON({
@@ -510,26 +721,59 @@ def custom_update_phonebook(request, token):
 
 
 # Get data about current newsletters
+# (version, content, etag) of the last /news/newsletters/ response built
+# by this process. It's replaced as a whole so threads never see a mix.
+_newsletters_response = {'current': (None, None, None)}
+
+
+def newsletters_response():
+    """
+    Return the body of the /news/newsletters/ response and its ETag.
+
+    They're only rebuilt when newsletters_version() changes, so most
+    requests don't touch the database or serialize anything.
+    """
+    version = newsletters_version()
+    current_version, content, etag = _newsletters_response['current']
+    if version is None or version != current_version:
+        # Get the newsletters as a dictionary of dictionaries that are
+        # easily jsonified
+        result = {}
+        for newsletter in Newsletter.objects.all().values():
+            newsletter['languages'] = newsletter['languages'].split(",")
+            result[newsletter['slug']] = newsletter
+            del newsletter['id']  # caller doesn't need to know our pkey
+            del newsletter['slug']  # or our slug
+
+        # sorted so every process comes up with the same ETag
+        content = json.dumps({
+            'status': 'ok',
+            'newsletters': result,
+        }, sort_keys=True)
+        etag = md5(content).hexdigest()
+        _newsletters_response['current'] = (version, content, etag)
+
+    return content, etag
+
+
 @require_GET
 @cache_control(max_age=300)
 def newsletters(request):
-    # Get the newsletters as a dictionary of dictionaries that are
-    # easily jsonified
+    content, etag = newsletters_response()
 
-    result = {}
-    for newsletter in Newsletter.objects.all().values():
-        newsletter['languages'] = newsletter['languages'].split(",")
-        result[newsletter['slug']] = newsletter
-        del newsletter['id']  # caller doesn't need to know our pkey
-        del newsletter['slug']  # or our slug
+    if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if etag in if_none_match or '*' in if_none_match:
+        statsd.incr('news.views.newsletters.not_modified')
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type='application/json')
 
-    return HttpResponseJSON({
-        'status': 'ok',
-        'newsletters': result,
-    })
+    response['ETag'] = quote_etag(etag)
+    return response
 
 
 @never_cache
+@with_et_deadline
 def lookup_user(request):
     """Lookup a user in Exact Target given email or token (not both).
 
@@ -612,6 +856,174 @@ def lookup_user(request):
     return HttpResponseJSON(user_data, status_code)
 
 
+@require_POST
+@csrf_exempt
+@never_cache
+def lookup_users(request):
+    """Look up many users in Exact Target given their tokens or emails.
+
+    The request body is JSON: a dictionary with either a 'tokens' or an
+    'emails' list (not both). SSL and a valid API key are always required.
+
+    Users are looked up in batches of LOOKUP_USERS_BATCH_SIZE, with one
+    Retrieve per ET database for each batch (see `get_users_data`).
+    Duplicate tokens or emails are only looked up once, but each gets its
+    entry in the response.
+
+    By default the response is JSON::
+
+        {
+            'status': 'ok',
+            'users': [<user data>, ...]
+        }
+
+    with an entry for each token or email in the order they were sent.
+    Each entry is either the return value of `get_user_data`, or for
+    users that weren't found::
+
+        {
+            'status': 'error',
+            'desc': 'User not found',
+            'code': BASKET_UNKNOWN_TOKEN or BASKET_UNKNOWN_EMAIL,
+            'token' or 'email': <what was looked up>
+        }
+
+    If 'format=ndjson' is passed in the query string, or the request's
+    Accept header is 'application/x-ndjson', the entries are instead
+    streamed one JSON document per line as each batch is resolved. If
+    talking to ET fails partway through a stream, the last line is an
+    error dictionary and no more entries follow.
+    """
+    if not request.is_secure():
+        return HttpResponseJSON({
+            'status': 'error',
+            'desc': 'lookup-users always requires SSL',
+            'code': errors.BASKET_SSL_REQUIRED,
+        }, 401)
+    if not has_valid_api_key(request):
+        return HttpResponseJSON({
+            'status': 'error',
+            'desc': 'lookup-users requires a valid API-key',
+            'code': errors.BASKET_AUTH_ERROR,
+        }, 401)
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return HttpResponseJSON({
+            'status': 'error',
+            'desc': 'lookup-users requires a JSON request body',
+            'code': errors.BASKET_USAGE_ERROR,
+        }, 400)
+
+    tokens = data.get('tokens')
+    emails = data.get('emails')
+    if bool(tokens) == bool(emails):
+        return HttpResponseJSON({
+            'status': 'error',
+            'desc': MSG_EMAIL_OR_TOKEN_REQUIRED,
+            'code': errors.BASKET_USAGE_ERROR,
+        }, 400)
+
+    values = emails or tokens
+    if (not isinstance(values, list) or
+            not all(value and isinstance(value, basestring) for value in values)):
+        return HttpResponseJSON({
+            'status': 'error',
+            'desc': 'lookup-users requires a list of tokens or emails',
+            'code': errors.BASKET_USAGE_ERROR,
+        }, 400)
+    if len(values) > LOOKUP_USERS_MAX_RECORDS:
+        return HttpResponseJSON({
+            'status': 'error',
+            'desc': 'lookup-users accepts at most %d tokens or emails per call'
+                    % LOOKUP_USERS_MAX_RECORDS,
+            'code': errors.BASKET_USAGE_ERROR,
+        }, 400)
+
+    results = lookup_users_results(values, bool(emails))
+    if (request.GET.get('format') == 'ndjson' or
+            request.META.get('HTTP_ACCEPT') == 'application/x-ndjson'):
+        return StreamingHttpResponse(ndjson_lines(results),
+                                     content_type='application/x-ndjson')
+
+    try:
+        users = list(results)
+    except NewsletterException as e:
+        return newsletter_exception_response(e)
+
+    return HttpResponseJSON({
+        'status': 'ok',
+        'users': users,
+    })
+
+
+def lookup_users_results(values, by_email):
+    """Generate the lookup-users entry for each of ``values`` (tokens or
+    emails), looking them up LOOKUP_USERS_BATCH_SIZE at a time. Duplicates
+    are only looked up once.
+
+    Raises NewsletterException if there's a problem talking to ET.
+    """
+    if by_email:
+        field = 'email'
+        code = errors.BASKET_UNKNOWN_EMAIL
+    else:
+        field = 'token'
+        code = errors.BASKET_UNKNOWN_TOKEN
+
+    def key(value):
+        # ET compares email addresses case-insensitively, so we do too
+        return value.lower() if by_email else value
+
+    # user data by key, of everything looked up so far
+    looked_up = {}
+    start = 0
+    while start < len(values):
+        # the values up to the next batch of ones not looked up yet
+        batch = []
+        end = start
+        while end < len(values) and len(batch) < LOOKUP_USERS_BATCH_SIZE:
+            value = values[end]
+            if key(value) not in looked_up:
+                looked_up[key(value)] = None
+                batch.append(value)
+            end += 1
+        if batch:
+            with statsd.timer('news.views.lookup_users.batch'):
+                found = get_users_data(**{field + 's': batch})
+            for value in batch:
+                looked_up[key(value)] = found.get(value)
+
+        for value in values[start:end]:
+            user_data = looked_up[key(value)]
+            if not user_data:
+                user_data = {
+                    'status': 'error',
+                    'desc': MSG_USER_NOT_FOUND,
+                    'code': code,
+                    field: value,
+                }
+            yield user_data
+        start = end
+
+
+def ndjson_lines(results):
+    """Serialize lookup-users entries one per line, ending the stream with
+    an error line if ET fails partway through."""
+    try:
+        for result in results:
+            yield json.dumps(result) + '\n'
+    except NewsletterException as e:
+        yield json.dumps({
+            'status': 'error',
+            'code': e.error_code or errors.BASKET_UNKNOWN_ERROR,
+            'desc': str(e),
+        }) + '\n'
+
+
 def list_newsletters(request):
     """
     Public web page listing currently active newsletters.
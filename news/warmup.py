@@ -0,0 +1,92 @@
+"""
+Warming up celery workers before they take tasks.
+
+Left to themselves, the first tasks a worker runs pay for building the
+suds client from the WSDL, filling the newsletter, email block list and
+SMS message caches, and compiling the user agent regexes, and take far
+longer than the rest. Instead the worker does all that when it starts,
+before it consumes from the queue.
+
+It's done in the worker's main process, so with the prefork pool the
+children inherit it all when they're forked. The database and cache
+connections it used are closed first, so that no child shares them.
+
+How long each step took is sent as the timer news.warmup.<step>, and the
+whole as news.warmup.total. Set WORKER_WARM_UP = False to turn it off.
+"""
+import logging
+from time import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from celery.signals import worker_init
+from django_statsd.clients import statsd
+
+from news.backends.exacttarget import get_client
+from news.newsletters import _newsletters, get_sms_messages
+from news.utils import email_block_list_cache, get_email_block_list
+
+
+log = logging.getLogger(__name__)
+
+WORKER_WARM_UP = getattr(settings, 'WORKER_WARM_UP', True)
+
+USER_AGENT = ('Mozilla/5.0 (Android; Tablet; rv:36.0) Gecko/36.0 '
+              'Firefox/36.0')
+
+
+def warm_et_client():
+    get_client(settings.EXACTTARGET_USER, settings.EXACTTARGET_PASS)
+
+
+def warm_user_agents():
+    import user_agents
+
+    user_agents.parse(USER_AGENT)
+
+
+WARM_UP_STEPS = (
+    ('et_client', warm_et_client),
+    ('newsletters', _newsletters),
+    ('email_block_list', get_email_block_list),
+    ('sms_messages', get_sms_messages),
+    ('user_agents', warm_user_agents),
+)
+
+
+def warm_up():
+    """
+    Run each of the warm up steps, and return the seconds they took in
+    all. A step that fails is logged and skipped, leaving whatever it
+    does to the first task that needs it.
+    """
+    start = time()
+    for name, step in WARM_UP_STEPS:
+        step_start = time()
+        try:
+            step()
+        except Exception:
+            log.exception('Warming up %s failed', name)
+            continue
+        statsd.timing('news.warmup.%s' % name, (time() - step_start) * 1000)
+    seconds = time() - start
+    statsd.timing('news.warmup.total', seconds * 1000)
+    return seconds
+
+
+def close_connections():
+    for connection in connections.all():
+        connection.close()
+    cache.close()
+    email_block_list_cache.close()
+
+
+@worker_init.connect
+def warm_up_worker(**kwargs):
+    if not WORKER_WARM_UP:
+        return
+    seconds = warm_up()
+    close_connections()
+    log.info('Worker warmed up in %.3f seconds', seconds)
@@ -129,6 +129,9 @@ BROKER_PASSWORD = 'basket'
 BROKER_VHOST = 'basket'
 CELERY_DISABLE_RATE_LIMITS = True
 CELERY_IGNORE_RESULT = True
+# Compact task messages, see news.payloads
+CELERY_TASK_SERIALIZER = 'zjson'
+CELERY_ACCEPT_CONTENT = ['pickle', 'json', 'zjson']
 
 import djcelery
 djcelery.setup_loader()